@@ -1,33 +1,128 @@
-import boto3
-import nicegui.ui as ui
+import datetime
+import threading
+import time
+from typing import TYPE_CHECKING
 
 from aam.config import CONFIG
 
+# boto3 is slow to import so is only imported when the first client is made.
+if TYPE_CHECKING:
+    import boto3
+    import botocore.client
+
+# Assumed role credentials are refreshed when they have less than this long left before they expire.
+CREDENTIAL_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# The botocore Config used by all clients.
+CLIENT_CONFIG = {"retries": {"mode": "adaptive", "max_attempts": 10}, "max_pool_connections": 20}
+
+_lock = threading.Lock()
+_session: "boto3.session.Session | None" = None
+# Assumed role credentials indexed by role ARN.
+_credentials: dict[str, dict] = {}
+# Clients indexed by (service name, role ARN). A role ARN of None means the client uses the default credentials.
+_clients: dict[tuple[str, str | None], "botocore.client.BaseClient"] = {}
+# The number and total duration of calls to get_organization_accounts which had to ("cold") or did not have to
+# ("warm") assume a role and create a client.
+_timing_stats = {"cold": {"calls": 0, "seconds": 0.0}, "warm": {"calls": 0, "seconds": 0.0}}
+
+
+def _get_session() -> "boto3.session.Session":
+    """Get the session used to create all clients. Must be called while holding _lock as sessions are not
+    thread safe."""
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_role_credentials(role_arn: str) -> dict:
+    """Get credentials for an IAM role, assuming the role only if there are no cached credentials or the cached
+    credentials are about to expire.
+
+    :param role_arn: The ARN of the IAM role to assume.
+    :returns: The "Credentials" part of the STS AssumeRole response.
+    """
+    with _lock:
+        credentials = _credentials.get(role_arn)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if credentials and credentials["Expiration"] - CREDENTIAL_REFRESH_MARGIN > now:
+        return credentials
+
+    response = get_client("sts").assume_role(RoleArn=role_arn, RoleSessionName="aam_cross_acct_describe_org")
+    credentials = response["Credentials"]
+    with _lock:
+        _credentials[role_arn] = credentials
+        # Any client made with the old credentials is no longer valid.
+        for service, client_role_arn in list(_clients):
+            if client_role_arn == role_arn:
+                del _clients[(service, client_role_arn)]
+    return credentials
+
+
+def get_client(service: str, role_arn: str | None = None) -> "botocore.client.BaseClient":
+    """Get a client from the pool, creating it if necessary. Clients are thread safe so can be shared.
+
+    :param service: The name of the AWS service, e.g. "organizations".
+    :param role_arn: The ARN of the IAM role the client acts as. If None, the default credentials are used.
+    """
+    if role_arn is not None:
+        credentials = get_role_credentials(role_arn)
+    with _lock:
+        client = _clients.get((service, role_arn))
+        if client is None:
+            import botocore.config
+            config = botocore.config.Config(**CLIENT_CONFIG)
+            if role_arn is None:
+                client = _get_session().client(service, config=config)
+            else:
+                client = _get_session().client(service, config=config,
+                                               aws_access_key_id=credentials['AccessKeyId'],
+                                               aws_secret_access_key=credentials['SecretAccessKey'],
+                                               aws_session_token=credentials['SessionToken'])
+            _clients[(service, role_arn)] = client
+    return client
+
+
+def clear_cache():
+    """Remove all cached credentials and clients, the next call to each role will be a cold call."""
+    with _lock:
+        _credentials.clear()
+        _clients.clear()
+
+
+def get_timing_stats() -> dict[str, dict]:
+    """Get the number of calls and mean duration in seconds of cold and warm calls to get_organization_accounts."""
+    with _lock:
+        return {key: {"calls": stats["calls"],
+                      "mean_seconds": stats["seconds"] / stats["calls"] if stats["calls"] else None}
+                for key, stats in _timing_stats.items()}
+
 
 def get_organization_accounts(org_id: str) -> list[dict]:
-    """Get a list of accounts in the organization."""
+    """Get a list of accounts in the organization.
 
+    :param org_id: The id of the AWS Organization, must have a role in 'organization_list_role_arns' in config.yaml.
+    :raises ValueError: If the organization has no role configured.
+    """
     org_role_arns = CONFIG["organization_list_role_arns"]
     if org_id not in org_role_arns:
-        ui.notify("Selected organization id not found in 'organization_list_role_arns' section in config.yaml")
-        return 0
-
-    sts_connection = boto3.client('sts')
-    acct_b = sts_connection.assume_role(
-        RoleArn=org_role_arns[org_id],
-        RoleSessionName="aam_cross_acct_describe_org"
-    )
-
-    # create service client using the assumed role credentials, e.g. S3
-    org_client = boto3.client('organizations',
-        aws_access_key_id=acct_b['Credentials']['AccessKeyId'],
-        aws_secret_access_key=acct_b['Credentials']['SecretAccessKey'],
-        aws_session_token=acct_b['Credentials']['SessionToken'],
-    )
-
-    response = org_client.list_accounts()
-    accounts = response["Accounts"]
-    while "NextToken" in response:
-        response = org_client.list_accounts(NextToken=response["NextToken"])
-        accounts.extend(response["Accounts"])
+        raise ValueError(f"Organization id '{org_id}' not found in 'organization_list_role_arns' in config.yaml")
+
+    start = time.perf_counter()
+    with _lock:
+        cached_client = _clients.get(("organizations", org_role_arns[org_id]))
+    org_client = get_client("organizations", org_role_arns[org_id])
+    # If the credentials were refreshed then a new client was made.
+    warm = org_client is cached_client
+
+    accounts = []
+    for page in org_client.get_paginator("list_accounts").paginate():
+        accounts.extend(page["Accounts"])
+
+    with _lock:
+        stats = _timing_stats["warm" if warm else "cold"]
+        stats["calls"] += 1
+        stats["seconds"] += time.perf_counter() - start
     return accounts
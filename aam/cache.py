@@ -0,0 +1,63 @@
+"""In process caches shared by all sessions.
+
+`reference_cache` holds reference data which rarely changes, such as the lists of people, organizations and accounts
+used to fill select elements. It is cleared whenever one of the cached tables is written to (see
+`aam.models.ReferenceDataMixin`). `forecast_cache` holds usage forecasts and is cleared whenever the ledger changes
+(see `aam.models.ledger_changed`).
+"""
+import threading
+from typing import Any, Callable
+
+
+class SharedCache:
+    """Stores the result of each lookup until `invalidate` is called, counting cache hits and misses per lookup.
+
+    Cached values are shared between sessions so must not be modified by the caller.
+    """
+    def __init__(self):
+        self._values: dict[tuple, Any] = {}
+        self._hits: dict[str, int] = {}
+        self._misses: dict[str, int] = {}
+        # Incremented on each invalidation so that a value loaded before an invalidation is not stored after it.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, name: str, load: Callable[..., Any], *args) -> Any:
+        """Get the cached result of a lookup, calling `load(*args)` to get it if it is not cached.
+
+        :param name: The name of the lookup, used in the hit and miss counts.
+        :param load: The function which queries the database.
+        :param args: Arguments passed to `load`, each combination of arguments is cached separately.
+        """
+        key = (name, *args)
+        with self._lock:
+            if key in self._values:
+                self._hits[name] = self._hits.get(name, 0) + 1
+                return self._values[key]
+            self._misses[name] = self._misses.get(name, 0) + 1
+            generation = self._generation
+        value = load(*args)
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = value
+        return value
+
+    def invalidate(self):
+        """Remove all cached values."""
+        with self._lock:
+            self._values.clear()
+            self._generation += 1
+
+    def get_stats(self) -> dict[str, dict[str, int]]:
+        """Get the number of cache "hits" and "misses" of each lookup."""
+        with self._lock:
+            return {name: {"hits": self._hits.get(name, 0), "misses": self._misses[name]} for name in self._misses}
+
+    def reset_stats(self):
+        with self._lock:
+            self._hits.clear()
+            self._misses.clear()
+
+
+reference_cache = SharedCache()
+forecast_cache = SharedCache()
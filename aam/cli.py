@@ -0,0 +1,179 @@
+"""Command line interface for running bulk operations without starting the web server, e.g. from cron.
+
+Run with: python -m aam --help
+"""
+import argparse
+import csv
+import datetime
+import sys
+
+import aam.data_quality
+import aam.importers
+import aam.models
+import aam.utilities
+from aam.config import CONFIG, DEFAULT_CONFIG_LOCATION
+
+
+def month_code_argument(value: str) -> int:
+    """Convert a "YYYY-MM" command line argument to a month code."""
+    try:
+        date = datetime.datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a month in the format YYYY-MM")
+    return aam.utilities.month_code(date.year, date.month)
+
+
+def date_argument(value: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a date in the format YYYY-MM-DD")
+
+
+def read_input(file: argparse.FileType) -> str:
+    with file:
+        return file.read()
+
+
+def import_usage(args: argparse.Namespace) -> int:
+    data = read_input(args.file)
+    if args.month is not None:
+        amounts = aam.importers.parse_month_usage(data, args.month)
+    else:
+        amounts = aam.importers.parse_account_monthly_usage(data)
+    result = aam.models.upsert_monthly_usage(amounts)
+    print(f"Monthly usage imported. {result['inserted']} inserted, {result['updated']} updated, "
+          f"{result['unchanged']} unchanged.")
+    aam.data_quality.take_snapshot()
+    return 0
+
+
+def import_exchange_rates(args: argparse.Namespace) -> int:
+    exchange_rates = aam.importers.parse_exchange_rates(read_input(args.file))
+    aam.importers.set_exchange_rates(exchange_rates)
+    print(f"{len(exchange_rates)} exchange rates imported.")
+    return 0
+
+
+def sync(args: argparse.Namespace) -> int:
+    import aam.sync
+
+    results = aam.sync.sync_organizations(None if args.all_orgs else args.org, args.max_workers)
+    for result in results:
+        if result["error"]:
+            print(f"{result['organization']}: failed after {result['fetch_seconds']:.2f} s - {result['error']}",
+                  file=sys.stderr)
+        else:
+            print(f"{result['organization']}: {len(result['accounts'])} accounts, {result['added']} added, "
+                  f"{result['updated']} updated, fetch {result['fetch_seconds']:.2f} s, "
+                  f"apply {result['apply_seconds']:.2f} s")
+    aam.data_quality.take_snapshot()
+    return 1 if any(result["error"] for result in results) else 0
+
+
+def create_recharge(args: argparse.Namespace) -> int:
+    recharge_request, result = aam.models.RechargeRequest.create_for_months(args.start, args.end, args.reference)
+    print(f"Recharge request {recharge_request.reference} ({recharge_request.id}) created with "
+          f"{result['transactions']} transactions and {result['monthly_usage']} months of usage.")
+    if result["conflicts"]:
+        print(f"{len(result['conflicts'])} items were not added as they are already part of another request:",
+              file=sys.stderr)
+        for conflict in result["conflicts"]:
+            print(f"  {conflict['item_type']} {conflict['id']}, {conflict['account_name']}, {conflict['date']} - "
+                  f"{conflict['recharge_reference']}", file=sys.stderr)
+    return 0
+
+
+def allocate_shared_charges(args: argparse.Namespace) -> int:
+    result = aam.models.allocate_shared_charges(args.start, args.end)
+    print(f"Shared charges allocated. {result['updated']} months of usage updated.")
+    if result["unallocated"]:
+        print(f"{len(result['unallocated'])} shares were not allocated as the account has no usage in that month:",
+              file=sys.stderr)
+        for share in result["unallocated"]:
+            month = aam.utilities.date_from_month_code(share["month_code"]).strftime("%Y-%m")
+            print(f"  {share['account_id']}, {month}", file=sys.stderr)
+    return 0
+
+
+def export_balances(args: argparse.Namespace) -> int:
+    Account = aam.models.Account
+    accounts = Account.select(Account.id, Account.name, Account.organization, Account.status).order_by(Account.name)
+    if args.organization:
+        accounts = accounts.where(Account.organization == args.organization)
+    accounts = list(accounts)
+    balances = aam.models.get_balances([account.id for account in accounts], args.date)
+
+    with args.output:
+        writer = csv.writer(args.output)
+        writer.writerow(["Account Id", "Account Name", "Organization", "Status", "Balance"])
+        for account in accounts:
+            writer.writerow([account.id, account.name, account.organization_id, account.status,
+                             round(balances[account.id], 2)])
+    return 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m aam", description="Run bulk operations on the AAM database.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_LOCATION, help="Path to config.yaml.")
+    subparsers = parser.add_subparsers(required=True, metavar="command")
+
+    usage_parser = subparsers.add_parser(
+        "import-usage", help="Import monthly usage.",
+        description="Import monthly usage from a file. With --month, each line is 'account number, [account name,] "
+                    "amount'. Without --month, the file is tab separated with the account numbers on the first line "
+                    "and one 'Mon-yy' month per following line.")
+    usage_parser.add_argument("file", type=argparse.FileType("r"), help="File to import, or - for stdin.")
+    usage_parser.add_argument("--month", type=month_code_argument, help="The month of the usage, YYYY-MM.")
+    usage_parser.set_defaults(func=import_usage)
+
+    exchange_rate_parser = subparsers.add_parser(
+        "import-exchange-rates", help="Import monthly exchange rates.",
+        description="Import exchange rates from a file with one 'Mon-yy, exchange_rate' per line.")
+    exchange_rate_parser.add_argument("file", type=argparse.FileType("r"), help="File to import, or - for stdin.")
+    exchange_rate_parser.set_defaults(func=import_exchange_rates)
+
+    sync_parser = subparsers.add_parser("sync", help="Update accounts from AWS Organizations.")
+    organizations = sync_parser.add_mutually_exclusive_group(required=True)
+    organizations.add_argument("--all-orgs", action="store_true",
+                               help="Sync every organization in 'organization_list_role_arns'.")
+    organizations.add_argument("--org", action="append", help="Organization id to sync, may be repeated.")
+    sync_parser.add_argument("--max-workers", type=int, help="Maximum number of organizations fetched at once.")
+    sync_parser.set_defaults(func=sync)
+
+    recharge_parser = subparsers.add_parser("create-recharge", help="Create a recharge request.")
+    recharge_parser.add_argument("--start", type=month_code_argument, required=True, help="First month, YYYY-MM.")
+    recharge_parser.add_argument("--end", type=month_code_argument, required=True, help="Last month, YYYY-MM.")
+    recharge_parser.add_argument("--reference", required=True)
+    recharge_parser.set_defaults(func=create_recharge)
+
+    allocate_parser = subparsers.add_parser(
+        "allocate-shared-charges", help="Recalculate the shared charges of monthly usage.",
+        description="Split each shared charge between its accounts and update the monthly usage of those months. "
+                    "Usage with no shared charges is reset to 0.")
+    allocate_parser.add_argument("--start", type=month_code_argument,
+                                 help="First month, YYYY-MM. Defaults to the earliest month.")
+    allocate_parser.add_argument("--end", type=month_code_argument,
+                                 help="Last month, YYYY-MM. Defaults to the latest month.")
+    allocate_parser.set_defaults(func=allocate_shared_charges)
+
+    balance_parser = subparsers.add_parser("export-balances", help="Export the balance of each account as CSV.")
+    balance_parser.add_argument("--date", type=date_argument, default=datetime.date.today(),
+                                help="Date of the balances, YYYY-MM-DD. Defaults to today.")
+    balance_parser.add_argument("--organization", help="Only export accounts in this organization.")
+    balance_parser.add_argument("--output", type=argparse.FileType("w"), default="-",
+                                help="File to write to. Defaults to stdout.")
+    balance_parser.set_defaults(func=export_balances)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = get_parser().parse_args(argv)
+    CONFIG.load(args.config)
+    aam.models.init_database()
+    try:
+        return args.func(args)
+    except ValueError as e:
+        # DataImportError and the validation errors of the model layer are ValueErrors.
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
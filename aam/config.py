@@ -1,11 +1,48 @@
+import collections.abc
+import os
 import pathlib
 
 import yaml
 
+DEFAULT_CONFIG_LOCATION = "config.yaml"
 
-def load_config(config_location: pathlib.Path = "config.yaml"):
+
+def load_config(config_location: str | os.PathLike = DEFAULT_CONFIG_LOCATION):
     with open(config_location, 'r') as input_file:
         return yaml.safe_load(input_file)
 
 
-CONFIG = load_config()
+class LazyConfig(collections.abc.Mapping):
+    """The application settings. config.yaml is only read when a setting is first accessed, so importing modules
+    which use CONFIG does not need the file to exist."""
+    def __init__(self, config_location: str | os.PathLike = DEFAULT_CONFIG_LOCATION):
+        self.config_location = pathlib.Path(config_location)
+        self._config: dict | None = None
+
+    def load(self, config_location: str | os.PathLike | None = None) -> "LazyConfig":
+        """Read the settings now, optionally from a different file."""
+        if config_location is not None:
+            self.config_location = pathlib.Path(config_location)
+        self._config = load_config(self.config_location)
+        return self
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._config is not None
+
+    def _get_config(self) -> dict:
+        if self._config is None:
+            self.load()
+        return self._config
+
+    def __getitem__(self, key: str):
+        return self._get_config()[key]
+
+    def __iter__(self):
+        return iter(self._get_config())
+
+    def __len__(self) -> int:
+        return len(self._get_config())
+
+
+CONFIG = LazyConfig()
@@ -0,0 +1,215 @@
+"""Checks for missing or inconsistent data in the ledger. The checks only read from the database so they can be run
+at any time, from the UI or elsewhere.
+
+The results of all checks are stored as a DataQualitySnapshot, taken in the background on a schedule and after data
+is imported or synced, so that they can be shown without running the checks.
+"""
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+from typing import Callable
+
+import peewee
+from peewee import JOIN, fn
+
+import aam.database
+import aam.utilities
+from aam.models import Account, DataQualitySnapshot, MonthlyUsage, Organization, Transaction, TRANSACTION_TYPES, db, \
+    month_code_sql
+
+logger = logging.getLogger(__name__)
+
+# The number of snapshots kept in the database, older snapshots are deleted when a new one is taken.
+SNAPSHOTS_KEPT = 10
+
+# The snapshot being taken in the background, if any.
+_snapshot_task: asyncio.Task | None = None
+
+
+def get_accounts_without_creation_date(organization_id: str | None = None) -> list[dict]:
+    """Find the accounts with no creation date.
+
+    :param organization_id: Only check accounts in this organization. If None, check all accounts.
+    :returns: The "account_id", "account_name", "organization_id" and "organization_name" of each account.
+    """
+    query = (_account_query(organization_id)
+             .where(Account.creation_date.is_null(True)))
+    return list(query.dicts())
+
+
+def get_closed_accounts_without_closure_date(organization_id: str | None = None) -> list[dict]:
+    """Find the closed and suspended accounts with no closure date.
+
+    :param organization_id: Only check accounts in this organization. If None, check all accounts.
+    :returns: The "account_id", "account_name", "organization_id", "organization_name" and "account_status" of each
+        account.
+    """
+    query = (_account_query(organization_id)
+             .select_extend(Account.status.alias("account_status"))
+             .where(Account.status.in_(["Closed", "SUSPENDED"]) & Account.closure_date.is_null(True)))
+    return list(query.dicts())
+
+
+def get_monthly_usage_outside_account_dates(organization_id: str | None = None) -> list[dict]:
+    """Find the MonthlyUsage in months before the month an account was created or after the month it was closed. An
+    account with no closure date is open until the current month. Accounts with no creation date are not checked.
+
+    :param organization_id: Only check accounts in this organization. If None, check all accounts.
+    :returns: The "id", "account_id", "account_name", "organization_id", "date" and "usage" of each MonthlyUsage.
+    """
+    today = datetime.date.today()
+    current_month = aam.utilities.month_code(today.year, today.month)
+    end_month = fn.COALESCE(month_code_sql(Account.closure_date), current_month)
+    query = (MonthlyUsage
+             .select(MonthlyUsage.id, Account.id.alias("account_id"), Account.name.alias("account_name"),
+                     Account.organization.alias("organization_id"), MonthlyUsage.date,
+                     MonthlyUsage.amount.alias("usage"))
+             .join(Account)
+             .where(Account.creation_date.is_null(False)
+                    & ((MonthlyUsage.month < month_code_sql(Account.creation_date)) | (MonthlyUsage.month > end_month)))
+             .order_by(Account.id, MonthlyUsage.month))
+    if organization_id is not None:
+        query = query.where(Account.organization == organization_id)
+    return list(query.dicts())
+
+
+def get_missing_monthly_usage(organization_id: str | None = None) -> list[dict]:
+    """Find the months in which each account was open but has no MonthlyUsage, or has a MonthlyUsage with no amount.
+    The current month is not included as its usage is not yet known.
+
+    The months of each account, from its creation date to its final date, are generated by a recursive CTE and joined
+    to MonthlyUsage so that all accounts are checked in one query.
+
+    :param organization_id: Only check accounts in this organization. If None, check all accounts.
+    :returns: One dict per account with missing usage, with the "account_id", "account_name", "organization_id",
+        "organization_name", number of missing months, "num_months", and "missing_months", a list of month codes.
+    """
+    today = datetime.date.today()
+    last_month = aam.utilities.month_code(today.year, today.month) - 1
+    # An account closed in the past ends in the month it was closed, otherwise it is open until the current month.
+    end_month = fn.MIN(last_month, fn.COALESCE(month_code_sql(Account.closure_date), last_month))
+
+    first_months = (Account
+                    .select(Account.id, month_code_sql(Account.creation_date), end_month)
+                    .where(Account.creation_date.is_null(False)))
+    if organization_id is not None:
+        first_months = first_months.where(Account.organization == organization_id)
+    account_months = first_months.cte("account_months", recursive=True,
+                                      columns=("account_id", "month_code", "end_month"))
+    next_months = (peewee.Select([account_months], [account_months.c.account_id, account_months.c.month_code + 1,
+                                                    account_months.c.end_month])
+                   .where(account_months.c.month_code < account_months.c.end_month))
+    account_months = account_months.union_all(next_months)
+
+    query = (account_months
+             .select_from(account_months.c.account_id, account_months.c.month_code,
+                          Account.name.alias("account_name"), Account.organization.alias("organization_id"),
+                          Organization.name.alias("organization_name"))
+             .join(MonthlyUsage, JOIN.LEFT_OUTER,
+                   on=((MonthlyUsage.account == account_months.c.account_id)
+                       & (MonthlyUsage.month == account_months.c.month_code)))
+             .join_from(account_months, Account, on=(Account.id == account_months.c.account_id))
+             .join_from(Account, Organization, JOIN.LEFT_OUTER)
+             # The base case of the CTE is not filtered, so an account created this month has one month after the end.
+             .where((account_months.c.month_code <= account_months.c.end_month) & MonthlyUsage.amount.is_null())
+             .order_by(account_months.c.account_id, account_months.c.month_code))
+
+    missing_usage = []
+    for account_id, rows in itertools.groupby(query.dicts(), key=lambda row: row["account_id"]):
+        rows = list(rows)
+        missing_usage.append({"account_id": account_id, "account_name": rows[0]["account_name"],
+                              "organization_id": rows[0]["organization_id"],
+                              "organization_name": rows[0]["organization_name"], "num_months": len(rows),
+                              "missing_months": [row["month_code"] for row in rows]})
+    return missing_usage
+
+
+def get_recharges_missing_project_code(organization_id: str | None = None) -> list[dict]:
+    """Find the Recharge transactions with no project code.
+
+    :param organization_id: Only check accounts in this organization. If None, check all accounts.
+    :returns: The "account_id", "account_name", "organization_id" and "transaction_date" of each Transaction.
+    """
+    query = (Transaction
+             .select(Account.id.alias("account_id"), Account.name.alias("account_name"),
+                     Account.organization.alias("organization_id"), Transaction.date.alias("transaction_date"))
+             .join(Account)
+             .where((Transaction.type == TRANSACTION_TYPES.index("Recharge")) & Transaction.project_code.is_null())
+             .order_by(Account.id, Transaction.date))
+    if organization_id is not None:
+        query = query.where(Account.organization == organization_id)
+    return list(query.dicts())
+
+
+def _account_query(organization_id: str | None) -> peewee.ModelSelect:
+    """Select the id, name and organization of accounts, optionally only those in one organization."""
+    query = (Account
+             .select(Account.id.alias("account_id"), Account.name.alias("account_name"),
+                     Account.organization.alias("organization_id"), Organization.name.alias("organization_name"))
+             .join(Organization, JOIN.LEFT_OUTER)
+             .order_by(Account.name))
+    if organization_id is not None:
+        query = query.where(Account.organization == organization_id)
+    return query
+
+
+# The checks stored in each snapshot, indexed by the name of their results.
+CHECKS: dict[str, Callable[[str | None], list[dict]]] = {
+    "no_creation_date": get_accounts_without_creation_date,
+    "no_closure_date": get_closed_accounts_without_closure_date,
+    "missing_usage": get_missing_monthly_usage,
+    "usage_outside_account_dates": get_monthly_usage_outside_account_dates,
+    "recharges_missing_project_code": get_recharges_missing_project_code,
+}
+
+
+def take_snapshot() -> DataQualitySnapshot:
+    """Run all the checks for all organizations and store the results as a new DataQualitySnapshot."""
+    results = {name: check(None) for name, check in CHECKS.items()}
+    with db.atomic():
+        snapshot = DataQualitySnapshot.create(computed_at=datetime.datetime.now(),
+                                              results=json.dumps(results, default=str))
+        kept = DataQualitySnapshot.select(DataQualitySnapshot.id).order_by(DataQualitySnapshot.id.desc()).limit(
+            SNAPSHOTS_KEPT)
+        DataQualitySnapshot.delete().where(DataQualitySnapshot.id.not_in(kept)).execute()
+    return snapshot
+
+
+def get_latest_snapshot() -> DataQualitySnapshot | None:
+    return DataQualitySnapshot.select().order_by(DataQualitySnapshot.id.desc()).first()
+
+
+def get_snapshot_results(snapshot: DataQualitySnapshot, organization_id: str | None = None) -> dict[str, list[dict]]:
+    """Get the results of each check in a snapshot. Dates and amounts are strings.
+
+    :param snapshot: The snapshot to read.
+    :param organization_id: Only return results for accounts in this organization. If None, return all results.
+    """
+    results = json.loads(snapshot.results)
+    if organization_id is not None:
+        results = {name: [row for row in rows if row["organization_id"] == organization_id]
+                   for name, rows in results.items()}
+    return results
+
+
+def schedule_snapshot():
+    """Start taking a snapshot in a worker thread, e.g. after data has been imported, unless one is already being
+    taken. Must be called from the event loop."""
+    global _snapshot_task
+    if _snapshot_task is None or _snapshot_task.done():
+        _snapshot_task = asyncio.get_running_loop().create_task(aam.database.run_in_thread(db, take_snapshot))
+        _snapshot_task.add_done_callback(_log_snapshot_error)
+
+
+async def refresh_snapshot() -> DataQualitySnapshot:
+    """Take a snapshot without blocking the event loop. If a snapshot is already being taken, wait for it rather than
+    starting another."""
+    schedule_snapshot()
+    return await asyncio.shield(_snapshot_task)
+
+
+def _log_snapshot_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Unable to take data quality snapshot.", exc_info=task.exception())
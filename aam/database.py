@@ -0,0 +1,67 @@
+"""Creation and configuration of the SQLite database connection.
+
+peewee opens a separate connection for each thread that uses the database. All connections share the settings in
+the 'database' section of config.yaml, which default to WAL journalling so that readers do not block the writer.
+"""
+import asyncio
+from typing import Any, Callable
+
+import peewee
+
+# Settings used when they are not given in the 'database' section of config.yaml.
+DEFAULT_SETTINGS = {
+    # WAL lets reads happen at the same time as a write.
+    "journal_mode": "wal",
+    # NORMAL is safe from corruption in WAL mode, a power loss may lose the last few committed transactions.
+    "synchronous": "normal",
+    # Negative values are in KiB, so this is a 64 MB page cache per connection.
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    # The number of milliseconds a connection waits for a lock before raising "database is locked".
+    "busy_timeout": 5000,
+}
+
+
+def get_pragmas(settings: dict | None = None) -> dict[str, Any]:
+    """Get the pragmas to set on each connection.
+
+    :param settings: The 'database' section of config.yaml. Missing settings take their value from
+        DEFAULT_SETTINGS.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    # Foreign key constraints are disabled by default in SQLite.
+    pragmas = {"foreign_keys": 1}
+    pragmas.update({key: settings[key] for key in DEFAULT_SETTINGS})
+    return pragmas
+
+
+class SqliteDatabase(peewee.SqliteDatabase):
+    def after_commit(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """Call `fn` once the current transaction is committed, or now if not in a transaction. Unlike peewee's
+        `after_commit`, a function added more than once in a transaction is only called once, so it can be used to
+        clear a cache after each row written."""
+        if self.transaction_depth() and fn in self._state.commit_callbacks:
+            return fn
+        return super().after_commit(fn)
+
+
+def create_database(location: str, settings: dict | None = None) -> SqliteDatabase:
+    """Create the database object. Connections are opened per thread when first used.
+
+    :param location: The path to the database file.
+    :param settings: The 'database' section of config.yaml.
+    """
+    pragmas = get_pragmas(settings)
+    # The busy timeout is set through peewee's timeout (in seconds) so that it also applies when connecting.
+    timeout = pragmas.pop("busy_timeout") / 1000
+    return SqliteDatabase(location, pragmas=pragmas, timeout=timeout)
+
+
+async def run_in_thread(database: peewee.Database, func: Callable, *args, **kwargs):
+    """Run a function which uses the database in a worker thread without blocking the event loop.
+    The worker thread's connection is closed afterwards so connections are not left open in idle pool threads.
+    """
+    def wrapper():
+        with database.connection_context():
+            return func(*args, **kwargs)
+    return await asyncio.to_thread(wrapper)
@@ -0,0 +1,149 @@
+"""Compile and render the jinja templates used to write emails to customers."""
+import datetime
+from decimal import Decimal
+import os
+import pathlib
+import tempfile
+import threading
+from typing import TYPE_CHECKING
+
+from aam.config import CONFIG
+from aam.models import Account, MonthlyUsage, RechargeRequest, Transaction, TRANSACTION_TYPES, get_balances
+
+# jinja2 is only imported when the first template is rendered.
+if TYPE_CHECKING:
+    import jinja2
+
+RECHARGE_TEMPLATE = "email_base.jinja"
+
+
+class TemplateRegistry:
+    """Compiles each template once and keeps it until a file in the template directory is added, removed or
+    modified. Compiled bytecode is also cached on disk so restarting the application does not reparse the templates.
+
+    :param template_location: The directory containing the templates.
+    :param bytecode_cache_location: The directory in which to cache compiled templates.
+    """
+    def __init__(self, template_location: str | os.PathLike, bytecode_cache_location: str | os.PathLike):
+        self.template_location = pathlib.Path(template_location)
+        self.bytecode_cache_location = pathlib.Path(bytecode_cache_location)
+        self._lock = threading.Lock()
+        self._environment: "jinja2.Environment | None" = None
+        self._directory_version = None
+
+    def _get_directory_version(self) -> tuple:
+        """A value which changes whenever a file in the template directory is added, removed or modified."""
+        return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                            for entry in os.scandir(self.template_location) if entry.is_file()))
+
+    def get_environment(self) -> "jinja2.Environment":
+        """Get the jinja Environment, replacing it with a new one if the template directory has changed."""
+        directory_version = self._get_directory_version()
+        with self._lock:
+            if self._environment is None or directory_version != self._directory_version:
+                import jinja2
+                self.bytecode_cache_location.mkdir(parents=True, exist_ok=True)
+                # auto_reload is off as the whole environment is replaced when the directory changes.
+                self._environment = jinja2.Environment(
+                    loader=jinja2.FileSystemLoader(self.template_location),
+                    undefined=jinja2.StrictUndefined,
+                    bytecode_cache=jinja2.FileSystemBytecodeCache(str(self.bytecode_cache_location)),
+                    auto_reload=False)
+                self._directory_version = directory_version
+            return self._environment
+
+    def get_template(self, name: str) -> "jinja2.Template":
+        return self.get_environment().get_template(name)
+
+
+_registry: TemplateRegistry | None = None
+
+
+def get_template_registry() -> TemplateRegistry:
+    """Get the application's TemplateRegistry, created from the 'email' section of config.yaml the first time it is
+    used."""
+    global _registry
+    if _registry is None:
+        email_config = CONFIG["email"]
+        bytecode_cache_location = email_config.get("bytecode_cache_location",
+                                                   pathlib.Path(tempfile.gettempdir()) / "aam_template_cache")
+        _registry = TemplateRegistry(email_config["template_location"], bytecode_cache_location)
+    return _registry
+
+
+def generate_recharge_subject(account: Account) -> str:
+    return f"Research IT AWS account recharge - {account.name}"
+
+
+def render_recharge_email(transactions: list[Transaction | MonthlyUsage], recharge_request: RechargeRequest,
+                          start_balance: Decimal, end_balance: Decimal,
+                          template: "jinja2.Template | None" = None) -> str:
+    """Render the body of the email to send to the customer for one account in a RechargeRequest.
+
+    :param transactions: The items in the request for the account. The account and its budget holder must be set.
+    :param recharge_request: The request the email is about.
+    :param start_balance: The balance of the account before the start date of the request.
+    :param end_balance: The balance of the account on the end date of the request.
+    :param template: The recharge template. If None, it is got from the template registry, which checks the template
+        directory for changes, so it should be passed in when rendering several emails.
+    """
+    account = transactions[0].account
+    data = {"first_name": account.budget_holder.first_name,
+            "account_name": account.name,
+            "account_id": account.id,
+            "recharge_reference": recharge_request.reference,
+            "start_balance": start_balance,
+            "transactions": [],
+            "end_balance": end_balance,
+            "finance_code": account.finance_code,
+            "task_code": account.task_code,
+            "recharge_start_date": recharge_request.start_date,
+            "recharge_end_date": recharge_request.end_date,
+            "recharge_date": (datetime.date.today() + datetime.timedelta(days=14)).strftime("%d/%m/%y")}
+    for transaction in transactions:
+        data["transactions"].append({"date": transaction.date, "type": TRANSACTION_TYPES[transaction.type],
+                                     "amount": transaction.gross_total_pound, "note": transaction.note})
+    data["transactions"].sort(key=lambda t: t["date"])
+    if template is None:
+        template = get_template_registry().get_template(RECHARGE_TEMPLATE)
+    return template.render(data=data)
+
+
+def render_recharge_emails(recharge_request: RechargeRequest, account_ids: list[str] | None = None) -> list[dict]:
+    """Render the emails for accounts in a RechargeRequest in one pass. The items of the request and the balances
+    of the accounts are each fetched with a single query rather than per account.
+
+    :param recharge_request: The request the emails are about.
+    :param account_ids: The accounts to render emails for. If None, emails are rendered for every account in the
+        request.
+    :returns: One dict per account with the keys "account_id", "account_name", "to", "subject", "body" and "error".
+        If the email can not be written, e.g. because the account has no budget holder, "body" is None and "error"
+        describes the problem.
+    """
+    if account_ids is not None and len(account_ids) == 1:
+        items = recharge_request.get_transactions(account_ids[0])
+    else:
+        items = recharge_request.get_transactions()
+    items_by_account: dict[str, list[Transaction | MonthlyUsage]] = {}
+    for item in items:
+        if account_ids is None or item.account_id in account_ids:
+            items_by_account.setdefault(item.account_id, []).append(item)
+
+    start_balances = get_balances(list(items_by_account), recharge_request.start_date, inclusive=False)
+    end_balances = get_balances(list(items_by_account), recharge_request.end_date)
+
+    # The template directory is checked for changes once for the whole batch rather than once per email.
+    template = get_template_registry().get_template(RECHARGE_TEMPLATE) if items_by_account else None
+    emails = []
+    for account_id, transactions in items_by_account.items():
+        account = transactions[0].account
+        email = {"account_id": account_id, "account_name": account.name, "to": None, "cc": "",
+                 "subject": generate_recharge_subject(account), "body": None, "error": None}
+        if account.budget_holder is None:
+            email["error"] = f'Error for account "{account.name}" - no budget holder recorded.'
+        else:
+            email["to"] = account.budget_holder.email
+            email["body"] = render_recharge_email(transactions, recharge_request, start_balances[account_id],
+                                                  end_balances[account_id], template)
+        emails.append(email)
+    return emails
@@ -0,0 +1,156 @@
+"""Forecast the monthly usage and balance of accounts.
+
+The gross usage of all accounts is loaded into an account x month matrix and a linear trend, plus a monthly seasonal
+pattern where there are at least two years of usage, is fitted to every account at once. Forecasts are cached until
+the ledger changes.
+"""
+import datetime
+
+import numpy as np
+
+import aam.cache
+import aam.utilities
+from aam.models import Account, Month, MonthlyUsage, get_balances
+
+# The number of complete months of usage used to fit the models.
+DEFAULT_HISTORY_MONTHS = 36
+# Accounts with fewer months of usage than this are forecast to continue at their mean usage, without a trend.
+MIN_TREND_MONTHS = 6
+# Accounts with fewer months of usage than this are forecast without a seasonal pattern.
+MIN_SEASONAL_MONTHS = 24
+
+
+def load_usage_matrix(account_ids: list[str], month_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Load the gross usage in pounds of each account in each month with a single query.
+
+    :param account_ids: The accounts, one per row of the matrix.
+    :param month_codes: The consecutive months, one per column of the matrix.
+    :returns: The usage matrix and a boolean matrix of the same shape which is True where the usage is known. Months
+        with no MonthlyUsage, or a MonthlyUsage with no amount, are not known.
+    """
+    usage = np.zeros((len(account_ids), len(month_codes)))
+    observed = np.zeros(usage.shape, dtype=bool)
+    if not account_ids or not len(month_codes):
+        return usage, observed
+    rows = {account_id: index for index, account_id in enumerate(account_ids)}
+    first_month = int(month_codes[0])
+
+    query = (MonthlyUsage
+             .select(MonthlyUsage.account, MonthlyUsage.month, MonthlyUsage.gross_total_pound_sql())
+             .join_from(MonthlyUsage, Month)
+             .where(MonthlyUsage.account.in_(account_ids)
+                    & MonthlyUsage.month.between(first_month, int(month_codes[-1]))
+                    & MonthlyUsage.amount.is_null(False)))
+    for account_id, month_code, gross_total_pound in query.tuples():
+        usage[rows[account_id], month_code - first_month] = gross_total_pound
+        observed[rows[account_id], month_code - first_month] = True
+    return usage, observed
+
+
+# The number of rounds of alternately fitting the trend and the seasonal pattern.
+FIT_ITERATIONS = 5
+
+
+def fit(usage: np.ndarray, observed: np.ndarray, month_codes: np.ndarray) -> dict[str, np.ndarray]:
+    """Fit a linear trend and a monthly seasonal pattern to each row of `usage` using only the observed months. The
+    trend and the seasonal pattern are fitted alternately, each to the usage with the other removed.
+
+    :returns: The "intercept" and "slope" of each account's trend, where the first month is 0, and the "seasonal"
+        offset of each account in each calendar month (accounts x 12).
+    """
+    weights = observed.astype(float)
+    t = np.arange(usage.shape[1], dtype=float)
+    calendar_months = np.eye(12)[(month_codes - 1) % 12]  # months x 12, one-hot
+
+    n = weights.sum(axis=1)
+    sum_t = weights @ t
+    sum_tt = weights @ (t * t)
+    denominator = n * sum_tt - sum_t ** 2
+    use_trend = (n >= MIN_TREND_MONTHS) & (denominator > 0)
+    counts = weights @ calendar_months
+    has_month = counts > 0
+    use_seasonal = n >= MIN_SEASONAL_MONTHS
+
+    seasonal = np.zeros(counts.shape)
+    for _ in range(FIT_ITERATIONS):
+        # Least squares fit of the trend to every account at once, from the sums of the observed months.
+        deseasonalised = (usage - seasonal @ calendar_months.T) * weights
+        sum_y = deseasonalised.sum(axis=1)
+        sum_ty = deseasonalised @ t
+        slope = np.divide(n * sum_ty - sum_t * sum_y, denominator, out=np.zeros_like(n), where=use_trend)
+        intercept = np.divide(sum_y - slope * sum_t, n, out=np.zeros_like(n), where=n > 0)
+
+        # The seasonal offset of each calendar month is the mean residual of the trend in that month, centred so that
+        # the seasonal pattern does not change the trend.
+        residuals = (usage - intercept[:, None] - slope[:, None] * t) * weights
+        seasonal = np.divide(residuals @ calendar_months, counts, out=np.zeros_like(counts), where=has_month)
+        mean_offset = np.divide(seasonal.sum(axis=1), has_month.sum(axis=1), out=np.zeros_like(n),
+                                where=has_month.any(axis=1))
+        seasonal = np.where(has_month & use_seasonal[:, None], seasonal - mean_offset[:, None], 0)
+    return {"intercept": intercept, "slope": slope, "seasonal": seasonal}
+
+
+def project(model: dict[str, np.ndarray], history_length: int, month_codes: np.ndarray) -> np.ndarray:
+    """Project the usage of each account in the months following the history. Usage is never negative.
+
+    :param model: The result of `fit`.
+    :param history_length: The number of months of history the model was fitted to.
+    :param month_codes: The months to project, which must directly follow the history.
+    """
+    t = np.arange(history_length, history_length + len(month_codes), dtype=float)
+    usage = (model["intercept"][:, None] + model["slope"][:, None] * t
+             + model["seasonal"][:, (month_codes - 1) % 12])
+    return np.clip(usage, 0, None)
+
+
+def forecast(account_ids: list[str] | None = None, months_ahead: int = 12,
+             history_months: int = DEFAULT_HISTORY_MONTHS) -> dict:
+    """Forecast the usage and balance of accounts for the current month and the following months. The result is
+    cached until the ledger changes.
+
+    :param account_ids: The accounts to forecast. If None, forecast all accounts which are open.
+    :param months_ahead: The number of months to forecast, starting with the current month.
+    :param history_months: The number of complete months of usage to fit the forecast to.
+    :returns: A dict with the forecast "months", a list of month codes, and "accounts", a list with one dict per
+        account containing its "account_id", "account_name", current "balance", forecast "usage" in each month, or
+        the imported usage of the current month if there is any, and the forecast "balance_forecast" at the end of
+        each month. Amounts are gross in pounds.
+    """
+    today = datetime.date.today()
+    # The month is part of the key so that a forecast made last month is not used once the month has changed.
+    key = (tuple(account_ids) if account_ids is not None else None, months_ahead, history_months,
+           aam.utilities.month_code(today.year, today.month))
+    return aam.cache.forecast_cache.get("forecast", _forecast, *key)
+
+
+def _forecast(account_ids: tuple[str, ...] | None, months_ahead: int, history_months: int,
+              current_month: int) -> dict:
+    today = datetime.date.today()
+    history = np.arange(current_month - history_months, current_month)
+    future = np.arange(current_month, current_month + months_ahead)
+
+    accounts = Account.select(Account.id, Account.name).where(Account.creation_date.is_null(False))
+    if account_ids is None:
+        accounts = accounts.where(Account.closure_date.is_null() | (Account.closure_date >= today))
+    else:
+        accounts = accounts.where(Account.id.in_(list(account_ids)))
+    accounts = list(accounts.order_by(Account.name).tuples())
+    ids = [account_id for account_id, _ in accounts]
+
+    usage, observed = load_usage_matrix(ids, history)
+    usage_forecast = project(fit(usage, observed, history), len(history), future)
+    # Where the usage of the current month has been imported it replaces the forecast. It is already in today's
+    # balance so only the usage of the months which have not been imported is added.
+    imported_usage, imported = load_usage_matrix(ids, future[:1])
+    usage_forecast[:, :1] = np.where(imported, imported_usage, usage_forecast[:, :1])
+    forecast_only = usage_forecast.copy()
+    forecast_only[:, :1] = np.where(imported, 0, usage_forecast[:, :1])
+    balances = get_balances(ids, today) if ids else {}
+    balance_forecast = np.array([float(balances[account_id]) for account_id in ids])[:, None] + \
+        np.cumsum(forecast_only, axis=1)
+
+    return {"months": future.tolist(),
+            "accounts": [{"account_id": account_id, "account_name": name, "balance": float(balances[account_id]),
+                          "usage": usage_forecast[index].tolist(),
+                          "balance_forecast": balance_forecast[index].tolist()}
+                         for index, (account_id, name) in enumerate(accounts)]}
@@ -0,0 +1,149 @@
+"""Parse and import the text formats used to bulk load data. These functions are shared by the import page of the
+UI and the command line interface, so report problems by raising DataImportError rather than through the UI."""
+import datetime
+import decimal
+import re
+
+import aam.utilities
+from aam.models import Account, Month, TRANSACTION_TYPES, get_charge_rate
+
+
+class DataImportError(ValueError):
+    """The data to import is malformed or refers to something which is not in the database."""
+
+
+def parse_month_usage(data: str, month_code: int) -> dict[tuple[str, int], decimal.Decimal]:
+    """Parse one month of usage for several accounts. Each line has an account number, an optional account name and
+    a usage amount, separated by commas or tabs.
+
+    :returns: The usage amounts indexed by (account id, month code), ready for `upsert_monthly_usage`.
+    """
+    valid_account_numbers = {account.id for account in Account.select(Account.id)}
+    amounts = {}
+
+    # Assumes account number is first field and amount is last field. Optional account name inbetween.
+    for index, line in enumerate(data.split("\n")):
+        # Remove all spaces
+        line = line.replace(" ", "")
+        # Remove any trailing commas
+        line = line.rstrip(",")
+        # If the line is blank then skip it
+        if line == "":
+            continue
+        # Remove dollar signs
+        line = line.replace("$", "")
+        # Remove any thousand or million separators in usage amount
+        line = re.sub(r"\d,(?=\d{3})", "", line)
+        # Any other commas are now delimiters so replace them with tabs
+        line = line.replace(",", "\t")
+        # Split the line by field seperator
+        line = line.split("\t")
+        # No usage can be represented by a dash
+        line[-1] = line[-1].replace("-", "0")
+        if len(line) not in [2, 3]:
+            raise DataImportError(f"Malformed data on line {index} - wrong number of fields.")
+        if len(line[0]) != 12:
+            raise DataImportError(f"Malformed account number on line {index + 1} - must be 12 characters")
+        if line[0] not in valid_account_numbers:
+            raise DataImportError(f"Account number {line[0]} at line {index + 1} not found in database.")
+        try:
+            amounts[(line[0], month_code)] = decimal.Decimal(line[-1])
+        except decimal.InvalidOperation:
+            raise DataImportError(f"Malformed usage amount on line {index + 1} - unable to convert to Decimal")
+    return amounts
+
+
+def parse_account_monthly_usage(data: str) -> dict[tuple[str, int], decimal.Decimal]:
+    """Parse several months of usage for one or more accounts. The first line is a label followed by the account
+    numbers, each following line is a month ("Mon-yy") followed by the usage of each account, separated by tabs.
+    A hyphen means the account was not open in that month.
+
+    :returns: The usage amounts indexed by (account id, month code), ready for `upsert_monthly_usage`.
+    """
+    data = data.split("\n")
+
+    valid_account_numbers = {account.id for account in Account.select(Account.id)}
+
+    account_numbers = data.pop(0).split("\t")
+    num_columns = len(account_numbers)
+
+    # Go through the account numbers checking their validity
+    # Skip the first value as it is a label
+    for index in range(1, len(account_numbers)):
+        account_number = account_numbers[index]
+        if len(account_number) != 12:
+            raise DataImportError(f"Malformed account number '{account_number}', on line 1, column {index + 2} - "
+                                  f"must be 12 digits")
+        if account_number not in valid_account_numbers:
+            raise DataImportError(f"Account number '{account_number}' at line 1, column {index + 2} not found in "
+                                  f"database.")
+
+    # Check all lines for validity before returning any amounts.
+    amounts = {}
+    for line_number, line in enumerate(data):
+        # Ignore any blank lines
+        if not line:
+            continue
+        # Remove any dollar symbols
+        line = line.replace("$", "")
+        # Remove any thousands comma delimiters
+        line = line.replace(",", "")
+        # Split line
+        line = line.split("\t")
+        # Check that the number of values in the line matches the number of columns in the header
+        if len(line) != num_columns:
+            raise DataImportError(f"Number of columns in line: {line_number + 2} does not match number of columns in "
+                                  f"header line.")
+        # Check that the date in the first column can be parsed
+        try:
+            date = datetime.datetime.strptime(line[0], "%b-%y").date()
+        except ValueError:
+            raise DataImportError(f"Malformed date on line {line_number + 2}")
+        month_code = aam.utilities.month_code(date.year, date.month)
+        for column_index in range(1, num_columns):
+            # Skip if usage is a hyphen as this indicates that the account was not open at that time
+            if line[column_index] == "-":
+                continue
+            try:
+                amount = decimal.Decimal(line[column_index])
+            except decimal.InvalidOperation:
+                raise DataImportError(f"Malformed amount '{line[column_index]}' on line {line_number + 2}, "
+                                      f"column {column_index + 1}")
+            # AWS data from the API comes as gross totals while the breakdowns from Strategic Blue are net.
+            if date < datetime.date(2024, 7, 1):
+                amount = amount / (1 + get_charge_rate("VAT", TRANSACTION_TYPES.index("Monthly Usage"), date))
+            amounts[(account_numbers[column_index], month_code)] = amount
+    return amounts
+
+
+def parse_exchange_rates(data: str) -> dict[int, decimal.Decimal]:
+    """Parse exchange rates, one month per line in the format "Mon-yy, exchange_rate".
+
+    :returns: The exchange rates indexed by month code.
+    """
+    exchange_rates = {}
+    for index, line in enumerate(data.split("\n")):
+        line = line.replace(" ", "")
+        if not line:
+            continue
+        line = line.split(",")
+        try:
+            date = datetime.datetime.strptime(line[0], "%b-%y").date()
+        except ValueError:
+            raise DataImportError(f"Malformed date on line {index + 1}")
+        try:
+            exchange_rates[aam.utilities.month_code(date.year, date.month)] = decimal.Decimal(line[1])
+        except (decimal.InvalidOperation, IndexError):
+            raise DataImportError(f"Malformed exchange rate on line {index + 1}")
+    return exchange_rates
+
+
+def set_exchange_rates(exchange_rates: dict[int, decimal.Decimal]):
+    """Set the exchange rate of each month, creating any months which do not exist."""
+    for month_code, exchange_rate in exchange_rates.items():
+        month = Month.get_or_none(month_code=month_code)
+        if month is None:
+            Month.create(month_code=month_code, exchange_rate=exchange_rate)
+        else:
+            month.exchange_rate = exchange_rate
+            month.save()
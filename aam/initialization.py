@@ -1,17 +1,38 @@
+import asyncio
+import datetime
 import logging
 
-from nicegui import ui
-from authlib.integrations.starlette_client import OAuth
+from nicegui import ui, app
 
+import aam.data_quality
+import aam.database
+import aam.migrations
+import aam.models
+import aam.utilities
 from aam.config import CONFIG
 
-oauth = OAuth()
+logger = logging.getLogger(__name__)
+
+# The authlib OAuth registry, only created if oauth is enabled in config.yaml.
+oauth = None
+
+# The number of hours between data quality snapshots when not set in config.yaml.
+DEFAULT_DATA_QUALITY_INTERVAL_HOURS = 6
+
+# The month code of the month in which the ledger was last backfilled.
+_backfill_month: int | None = None
+
+# The task updating the ledger in a worker thread, if one has been started.
+_ledger_task: asyncio.Task | None = None
 
 
 def initialize():
     logging_init()
+    aam.migrations.log_query_plan_checks()
     if CONFIG['oauth']["auth"]:
         oauth_setup()
+    ledger_backfill_init()
+    data_quality_snapshot_init()
     ui.input.default_props("dense outlined")
     ui.textarea.default_props("outlined")
     ui.select.default_props("outlined")
@@ -19,6 +40,10 @@ def initialize():
 
 
 def oauth_setup():
+    global oauth
+    from authlib.integrations.starlette_client import OAuth
+
+    oauth = OAuth()
     # The value of the name parameter is arbitrary but is needed to call the methods of the OAuth object later.
     oauth.register(
         name="aam_oidc",
@@ -29,6 +54,43 @@ def oauth_setup():
     )
 
 
+def ledger_backfill_init():
+    """Backfill the ledger at startup and check hourly whether the month has changed since the last backfill. Closing
+    balances removed by changes to the ledger are stored again at the same times."""
+    app.timer(3600, backfill_on_month_rollover)
+
+
+def data_quality_snapshot_init():
+    """Take a data quality snapshot in the background at startup and then at a regular interval."""
+    interval_hours = CONFIG.get("data_quality_interval_hours", DEFAULT_DATA_QUALITY_INTERVAL_HOURS)
+    app.timer(interval_hours * 3600, aam.data_quality.schedule_snapshot)
+
+
+def backfill_on_month_rollover():
+    """Start updating the ledger in a worker thread, unless it is already being updated. Must be called from the event
+    loop."""
+    global _ledger_task
+    if _ledger_task is None or _ledger_task.done():
+        _ledger_task = asyncio.get_running_loop().create_task(aam.database.run_in_thread(aam.models.db, update_ledger))
+        _ledger_task.add_done_callback(_log_ledger_error)
+
+
+def update_ledger():
+    """Backfill the ledger if the month has changed since the last backfill and then store closing balances."""
+    global _backfill_month
+    today = datetime.date.today()
+    current_month = aam.utilities.month_code(today.year, today.month)
+    if current_month != _backfill_month:
+        aam.models.backfill_ledger()
+        _backfill_month = current_month
+    aam.models.store_closing_balances()
+
+
+def _log_ledger_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Unable to update the ledger.", exc_info=task.exception())
+
+
 def logging_init():
     if CONFIG["debug"]:
         logger = logging.getLogger('peewee')
@@ -0,0 +1,137 @@
+"""Send emails through the HTTP endpoint configured in the 'email' section of config.yaml without blocking the event
+loop."""
+import asyncio
+import datetime
+import logging
+
+import httpx
+
+from aam.config import CONFIG
+from aam.models import Note
+
+logger = logging.getLogger(__name__)
+
+# Responses with these status codes are retried, all other non-success codes are treated as permanent failures.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class EmailQueue:
+    """A queue of emails which are posted to the send url by a fixed number of worker tasks sharing one pooled HTTP
+    client. Each delivered email is recorded as a "Sent email" Note on its account.
+
+    :param send_url: The url of the endpoint which sends the emails.
+    :param max_concurrent: The maximum number of emails being sent at once.
+    :param timeout: The number of seconds to wait for the endpoint before an attempt fails.
+    :param max_attempts: The maximum number of times to try to send each email.
+    :param retry_delay: The number of seconds to wait before the first retry, doubling for each later retry.
+    """
+    def __init__(self, send_url: str, max_concurrent: int = 4, timeout: float = 30, max_attempts: int = 3,
+                 retry_delay: float = 1):
+        self.send_url = send_url
+        self.max_concurrent = max_concurrent
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.client = httpx.AsyncClient(timeout=timeout,
+                                        limits=httpx.Limits(max_connections=max_concurrent,
+                                                            max_keepalive_connections=max_concurrent))
+        self.queue: asyncio.Queue[tuple[dict, asyncio.Future]] = asyncio.Queue()
+        self.workers: list[asyncio.Task] = []
+
+    def put(self, email: dict) -> asyncio.Future:
+        """Add an email to the queue.
+
+        :param email: A dict with the keys "account_id", "to", "cc", "subject" and "body" where body is plain text.
+        :returns: A future which resolves to the delivery result of the email, see `send`.
+        """
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)]
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((email, future))
+        return future
+
+    async def send_all(self, emails: list[dict]) -> list[dict]:
+        """Queue several emails and wait until they have all been sent or have failed.
+
+        :returns: The delivery result of each email in the order of `emails`.
+        """
+        return list(await asyncio.gather(*[self.put(email) for email in emails]))
+
+    async def close(self):
+        """Stop the workers and close the HTTP client. Emails still in the queue are not sent."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        await self.client.aclose()
+
+    async def _worker(self):
+        while True:
+            email, future = await self.queue.get()
+            try:
+                result = await self.send(email)
+                if result["sent"]:
+                    # The email has been delivered so failing to record it must not be reported as a failed send.
+                    try:
+                        record_sent_email(email)
+                    except Exception:
+                        logger.exception("Unable to record email sent to %s for account %s.", email["to"],
+                                         email["account_id"])
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def send(self, email: dict) -> dict:
+        """Post an email to the send url, retrying on connection errors, timeouts and server errors.
+
+        :returns: A dict with the "account_id" and "to" address of the email, whether it was "sent", the number of
+            "attempts", the last "status_code" and any "error".
+        """
+        payload = {"to": email["to"], "cc": email["cc"], "subject": email["subject"],
+                   "body": email["body"].replace("\n", "<br>")}
+        result = {"account_id": email["account_id"], "to": email["to"], "sent": False, "attempts": 0,
+                  "status_code": None, "error": None}
+
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            result["attempts"] += 1
+            try:
+                response = await self.client.post(self.send_url, json=payload)
+            except httpx.TransportError as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                continue
+            result["status_code"] = response.status_code
+            if response.is_success:
+                result["sent"] = True
+                result["error"] = None
+                break
+            result["error"] = f"Email endpoint returned status code {response.status_code}"
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+        return result
+
+
+def record_sent_email(email: dict):
+    """Add a Note to the Account with the content of an email which has been sent."""
+    note_text = f"to: {email['to']}\ncc:{email['cc']}\nsubject: {email['subject']}\n\n{email['body']}"
+    Note.create(date=datetime.date.today(), text=note_text, type="Sent email", account=email["account_id"])
+
+
+_email_queue: EmailQueue | None = None
+
+
+def get_email_queue() -> EmailQueue:
+    """Get the application's EmailQueue, creating it from the settings in config.yaml the first time it is used.
+    Must be called from the event loop which will send the emails."""
+    global _email_queue
+    if _email_queue is None:
+        email_config = CONFIG["email"]
+        _email_queue = EmailQueue(email_config["send_url"],
+                                  max_concurrent=email_config.get("max_concurrent", 4),
+                                  timeout=email_config.get("timeout", 30),
+                                  max_attempts=email_config.get("max_attempts", 3))
+    return _email_queue
@@ -3,53 +3,77 @@ import string
 from typing import Optional
 
 from nicegui import ui, app
-from authlib.integrations.starlette_client import OAuthError
 from fastapi import Request
 from starlette.responses import RedirectResponse
 
+import aam.models
 from aam import initialization
 from aam.config import CONFIG
-from aam.ui.main import UIMainForm
 from aam.utilities import load_icon
-from aam.initialization import oauth
 
+# Whether create_app has already been called in this process.
+_app_created = False
 
-def main():
+
+def create_app(config_location: str | None = None):
+    """Load the settings, bind the database and register the pages of the application.
+
+    :param config_location: The path to config.yaml. Defaults to config.yaml in the working directory.
+    """
+    global _app_created
+    if _app_created:
+        return app
+    CONFIG.load(config_location)
+    aam.models.init_database()
     app.on_exception(lambda e: ui.notify(f"Exception: {e}"))
     app.on_startup(initialization.initialize)
-    favicon = load_icon()
-    secret = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(50))
-    ui.run(favicon=favicon, storage_secret=secret)
+    register_pages()
+    _app_created = True
+    return app
 
 
-@app.get('/auth')
-async def oidc_authentication(request: Request) -> RedirectResponse:
-    try:
-        user_data = await oauth.aam_oidc.authorize_access_token(request)
-    except OAuthError as e:
-        print(f'OAuth error: {e}')
-        return RedirectResponse('/')  # or return an error page/message
-    app.storage.user['user_data'] = user_data
-    return RedirectResponse('/')
+def register_pages():
+    @app.get('/auth')
+    async def oidc_authentication(request: Request) -> RedirectResponse:
+        from authlib.integrations.starlette_client import OAuthError
 
+        try:
+            user_data = await initialization.oauth.aam_oidc.authorize_access_token(request)
+        except OAuthError as e:
+            print(f'OAuth error: {e}')
+            return RedirectResponse('/')  # or return an error page/message
+        app.storage.user['user_data'] = user_data
+        return RedirectResponse('/')
 
-@ui.page('/not_authorised')
-async def not_authorised():
-    ui.label("Authentication was successful but you are not on the allow list.")
+    @ui.page('/not_authorised')
+    async def not_authorised():
+        ui.label("Authentication was successful but you are not on the allow list.")
 
+    @ui.page('/')
+    async def homepage(request: Request) -> Optional[RedirectResponse]:
+        # The UI modules are only imported when the first page is built.
+        from aam.ui.main import UIMainForm
 
-@ui.page('/')
-async def homepage(request: Request) -> Optional[RedirectResponse]:
-    user_data = app.storage.user.get('user_data', None)
-    if CONFIG["oauth"]["auth"] is False:
-        UIMainForm()
-    elif user_data is not None:
-        if user_data["userinfo"]["email"] in CONFIG["oauth"]["user_allowlist"]:
+        oauth = initialization.oauth
+        user_data = app.storage.user.get('user_data', None)
+        if CONFIG["oauth"]["auth"] is False:
             UIMainForm()
+        elif user_data is not None:
+            if user_data["userinfo"]["email"] in CONFIG["oauth"]["user_allowlist"]:
+                UIMainForm()
+            else:
+                return await oauth.aam_oidc.authorize_redirect(request, request.url_for('not_authorised'))
         else:
-            return await oauth.aam_oidc.authorize_redirect(request, request.url_for('not_authorised'))
-    else:
-        return await oauth.aam_oidc.authorize_redirect(request, request.url_for('oidc_authentication'))
+            return await oauth.aam_oidc.authorize_redirect(request, request.url_for('oidc_authentication'))
+
+
+def main(config_location: str | None = None):
+    create_app(config_location)
+    favicon = load_icon()
+    secret = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(50))
+    ui.run(favicon=favicon, storage_secret=secret)
 
 
-main()
+# NiceGUI runs the main module a second time as __mp_main__ in the server process.
+if __name__ in {"__main__", "__mp_main__"}:
+    main()
@@ -0,0 +1,148 @@
+"""Versioned changes to the database schema.
+
+Each migration is applied once, in order, and recorded in the schema_version table. To change the schema add a new
+function to the end of MIGRATIONS - never edit or reorder migrations which have already been released.
+"""
+import datetime
+import logging
+from typing import Callable
+
+import peewee
+
+from aam import models
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaVersion(peewee.Model):
+    version = peewee.IntegerField(primary_key=True)
+    description = peewee.CharField()
+    applied = peewee.DateTimeField()
+
+    class Meta:
+        database = models.db
+        table_name = "schema_version"
+
+
+def create_tables():
+    """Create the tables of all models. Tables which already exist, from before migrations were versioned, are
+    left unchanged. The default ChargeRules are added so that later migrations which calculate charges use them."""
+    models.db.create_tables([models.Account, models.LastAccountUpdate, models.Person, models.Sysadmin, models.Note,
+                             models.Month, models.MonthlyUsage, models.Transaction, models.RechargeRequest,
+                             models.SharedCharge, models.AccountJoinSharedCharge, models.Organization,
+                             models.MonthlyBalance, models.ChargeRule, models.RechargeRequestSummary])
+    models.create_default_charge_rules()
+
+
+def add_unique_monthly_usage_index():
+    """Each account has one MonthlyUsage per month. Duplicate rows must be removed before the index can be made. If
+    any duplicates differ the migration stops so that they can be resolved by hand (see
+    `models.remove_duplicate_monthly_usage`).
+
+    Removing duplicates changes the ledger. The stored closing balances and recharge summaries are cleared here rather
+    than by `models.ledger_changed`, which also uses tables created by later migrations.
+    """
+    if models.remove_duplicate_monthly_usage():
+        models.MonthlyBalance.delete().execute()
+        models.RechargeRequestSummary.delete().execute()
+    MonthlyUsage = models.MonthlyUsage
+    models.db.execute(MonthlyUsage.index(MonthlyUsage.account, MonthlyUsage.month, unique=True).safe(True))
+
+
+def add_ledger_indexes():
+    """Indexes for the queries which read the ledger of an account, the items of a recharge request and the accounts
+    of an organization."""
+    for index in [models.Transaction.index(models.Transaction.account, models.Transaction.date),
+                  models.Transaction.index(models.Transaction.recharge_request),
+                  models.MonthlyUsage.index(models.MonthlyUsage.recharge_request),
+                  models.Account.index(models.Account.organization, models.Account.status)]:
+        models.db.execute(index.safe(True))
+
+
+def create_data_quality_snapshot_table():
+    models.db.create_tables([models.DataQualitySnapshot])
+
+
+def create_usage_rollup_table():
+    models.db.create_tables([models.MonthlyUsageRollup])
+    models.refresh_usage_rollup()
+
+
+# The version of the schema after each migration is its position in this list, starting from 1.
+MIGRATIONS: list[tuple[str, Callable[[], None]]] = [
+    ("Create tables", create_tables),
+    ("Unique MonthlyUsage (account, month) index", add_unique_monthly_usage_index),
+    ("Ledger indexes", add_ledger_indexes),
+    ("Data quality snapshot table", create_data_quality_snapshot_table),
+    ("MonthlyUsage rollup table", create_usage_rollup_table),
+]
+
+
+def get_schema_version() -> int:
+    """Get the version of the schema, 0 if no migrations have been applied."""
+    SchemaVersion.create_table()
+    return SchemaVersion.select(peewee.fn.MAX(SchemaVersion.version)).scalar() or 0
+
+
+def run_migrations() -> list[int]:
+    """Apply, in order, each migration which has not yet been applied. Each migration runs in its own transaction
+    so a failed migration leaves the schema at the version before it.
+
+    :returns: The versions of the migrations which were applied.
+    """
+    current_version = get_schema_version()
+    applied = []
+    for version, (description, migration) in enumerate(MIGRATIONS, start=1):
+        if version <= current_version:
+            continue
+        with models.db.atomic():
+            migration()
+            SchemaVersion.create(version=version, description=description, applied=datetime.datetime.now())
+        logger.info(f"Applied database migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def get_query_plan_checks() -> list[tuple[str, peewee.Query, str]]:
+    """The main ledger queries, each with the name of the index it is expected to use."""
+    Transaction, MonthlyUsage, Account = models.Transaction, models.MonthlyUsage, models.Account
+    today = datetime.date.today()
+    return [
+        ("Account transactions between dates",
+         Transaction.select().where((Transaction.account == "") & (Transaction.date >= today)
+                                    & (Transaction.date <= today)),
+         "transaction_account_id_date"),
+        ("Account monthly usage for months",
+         MonthlyUsage.select().where((MonthlyUsage.account == "") & (MonthlyUsage.month.in_([0, 1]))),
+         "monthlyusage_account_id_month_id"),
+        ("Recharge request transactions",
+         Transaction.select().where(Transaction.recharge_request == 0),
+         "transaction_recharge_request_id"),
+        ("Recharge request monthly usage",
+         MonthlyUsage.select().where(MonthlyUsage.recharge_request == 0),
+         "monthlyusage_recharge_request_id"),
+        ("Organization accounts with status",
+         Account.select().where((Account.organization == "") & (Account.status == "ACTIVE")),
+         "account_organization_id_status"),
+    ]
+
+
+def check_query_plans() -> list[dict]:
+    """Use EXPLAIN QUERY PLAN to check that the main ledger queries use the expected indexes.
+
+    :returns: One dict per query with its "name", the expected "index", the query "plan" and whether it is "ok".
+    """
+    results = []
+    for name, query, index in get_query_plan_checks():
+        sql, params = query.sql()
+        plan = [row[-1] for row in models.db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        ok = any(f"INDEX {index} " in f"{detail} " for detail in plan)
+        results.append({"name": name, "index": index, "plan": plan, "ok": ok})
+    return results
+
+
+def log_query_plan_checks():
+    """Log a warning for each of the main ledger queries which does not use its expected index."""
+    for result in check_query_plans():
+        if not result["ok"]:
+            logger.warning(f"Query '{result['name']}' does not use index {result['index']}: {result['plan']}")
@@ -11,29 +11,57 @@ from decimal import Decimal
 from collections.abc import Iterable
 
 import peewee
-from peewee import JOIN
+from peewee import JOIN, fn, Case
 
+import aam.cache
+import aam.database
 import aam.utilities
 from aam.config import CONFIG
 
-# Pragmas ensures foreign key constraints are enabled - they are disabled by default in SQLite.
-db = peewee.SqliteDatabase(CONFIG["db_location"], pragmas={'foreign_keys': 1})
+# The database is bound by `init_database` so that importing the models does not open the database file.
+db = peewee.DatabaseProxy()
 
 TRANSACTION_TYPES = ["Pre-pay", "Savings Plan", "Adjustment", "Recharge", "Starting Balance", "Unrecovered spend", "Monthly Usage"]
+# The kinds of percentage charge which can be added to a transaction by a ChargeRule.
+CHARGE_TYPES = ["Support", "VAT"]
 
 class BaseModel(peewee.Model):
     class Meta:
         database = db
 
 
-class Organization(BaseModel):
+class ReferenceDataMixin:
+    """For models whose rows are held in `aam.cache.reference_cache`. Any save or delete clears the cache. Deletes can
+    cascade to other tables so the whole cache is cleared rather than the lookups of one table.
+
+    Within a transaction the cache is cleared once, after the commit, as until then other threads would cache the rows
+    from before the transaction. Bulk writes which do not use `save` or `delete_instance` must call
+    `reference_data_changed` themselves. The account sync (`aam.sync`) and account details import
+    (`aam.ui.import_data`) also call it once they finish, whichever of their rows were saved."""
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        reference_data_changed()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        reference_data_changed()
+        return result
+
+
+def reference_data_changed():
+    """Clear `aam.cache.reference_cache`, or if in a transaction, clear it when the transaction is committed."""
+    db.after_commit(aam.cache.reference_cache.invalidate)
+
+
+class Organization(ReferenceDataMixin, BaseModel):
     id = peewee.CharField(primary_key=True)
     name = peewee.CharField(null=True)
     accounts: "Account"  # backref
     last_updated_time: Iterable["LastAccountUpdate"]  # backref
 
 
-class Person(BaseModel):
+class Person(ReferenceDataMixin, BaseModel):
     id = peewee.AutoField()
     first_name = peewee.CharField()
     last_name = peewee.CharField()
@@ -74,6 +102,14 @@ class Month(BaseModel):
     def to_date(self):
         return datetime.date(self.year, self.month, 1)
 
+    def save(self, *args, **kwargs):
+        # The exchange rate is used to convert MonthlyUsage so changing it changes the balance of every account.
+        exchange_rate_changed = Month.exchange_rate in self.dirty_fields
+        result = super().save(*args, **kwargs)
+        if exchange_rate_changed:
+            ledger_changed(None, self.to_date())
+        return result
+
 
 class RechargeRequest(BaseModel):
     id = peewee.AutoField()
@@ -83,11 +119,41 @@ class RechargeRequest(BaseModel):
     status = peewee.CharField()
     transactions: Iterable["Transaction"]  # backref
     monthly_usage: Iterable["MonthlyUsage"]  # backref
+    summaries: Iterable["RechargeRequestSummary"]  # backref
 
     def to_json(self):
         return {"id": self.id, "start_date": self.start_date, "end_date": self.end_date, "reference": self.reference,
                 "status": self.status}
 
+    @classmethod
+    def create_for_months(cls, start_month_code: int, end_month_code: int,
+                          reference: str) -> tuple["RechargeRequest", dict]:
+        """Create a draft request from the start of one month to the end of another and add the items of recharged
+        accounts in that period to it.
+
+        :raises ValueError: If the months are in the wrong order, there is no reference or a month in the period has
+            no exchange rate set.
+        :returns: The new request and the result of `add_items`.
+        """
+        start_date = aam.utilities.date_from_month_code(start_month_code)
+        end_date = aam.utilities.date_from_month_code(end_month_code)
+        end_date = end_date.replace(day=calendar.monthrange(end_date.year, end_date.month)[1])
+
+        if end_date < start_date:
+            raise ValueError("End month must be after start month.")
+        if not reference:
+            raise ValueError("Must provide a reference")
+        months = Month.select().where((Month.month_code >= start_month_code) & (Month.month_code <= end_month_code))
+        for month in months:
+            if month.exchange_rate == 1:
+                raise ValueError(f"Exchange rate is 1 for month {month.to_date().strftime('%b-%Y')}. Must set exchange "
+                                 f"rate before creating recharge request.")
+
+        # The request is only kept if its items are added too.
+        with db.atomic():
+            recharge_request = cls.create(start_date=start_date, end_date=end_date, reference=reference, status="Draft")
+            return recharge_request, recharge_request.add_items(start_date, end_date)
+
     def get_transactions(self, account_id: str = None) -> list:
         """Get Transaction and MonthlyUsage items associated with the """
         object_types = [Transaction, MonthlyUsage]
@@ -99,14 +165,96 @@ class RechargeRequest(BaseModel):
             else:
                 where_expression = (object_type.recharge_request == self.id) & (Account.id == account_id)
 
-            items.extend(list((object_type.select(object_type, Account, Person)
-                               .join(Account)
-                               .join(Person, JOIN.LEFT_OUTER)
-                               .where(where_expression))))
+            query = (object_type.select(object_type, Account, Person)
+                     .join(Account)
+                     .join(Person, JOIN.LEFT_OUTER)
+                     .where(where_expression))
+            if object_type is MonthlyUsage:
+                # The exchange rate of the Month is needed to calculate the gross total of the usage.
+                query = query.select_extend(Month).join_from(MonthlyUsage, Month)
+            items.extend(list(query))
         return items
 
+    def add_items(self, start_date: datetime.date, end_date: datetime.date) -> dict:
+        """Add all Transactions and MonthlyUsage of recharged accounts between `start_date` and `end_date` to the
+        request. Items which are already part of another request are left unchanged and reported as conflicts.
 
-class Account(BaseModel):
+        Items are added with one UPDATE per item type in a single transaction.
+
+        :returns: A dict with the number of "transactions" and "monthly_usage" added and a list of "conflicts", each a
+            dict describing an item which is already part of another request.
+        """
+        recharged_accounts = Account.select(Account.id).where(Account.is_recharged == True)
+        # Transactions on the end date are not included
+        item_types = [("transactions", "Transaction", Transaction,
+                       (Transaction.date >= start_date) & (Transaction.date < end_date)),
+                      ("monthly_usage", "Monthly Usage", MonthlyUsage,
+                       (MonthlyUsage.date >= start_date) & (MonthlyUsage.date <= end_date))]
+
+        result = {"conflicts": []}
+        with db.atomic():
+            for result_key, item_type, object_type, date_filter in item_types:
+                in_period = date_filter & object_type.account.in_(recharged_accounts)
+                conflicts = (object_type.select(object_type.id, object_type.date, Account.name.alias("account_name"),
+                                                RechargeRequest.reference.alias("recharge_reference"))
+                             .join_from(object_type, Account)
+                             .join_from(object_type, RechargeRequest)
+                             .where(in_period & (object_type.recharge_request != self.id))
+                             .dicts())
+                result["conflicts"].extend({"item_type": item_type, **conflict} for conflict in conflicts)
+
+                result[result_key] = (object_type.update(recharge_request=self.id)
+                                      .where(in_period & object_type.recharge_request.is_null())
+                                      .execute())
+            self.calculate_summaries()
+        return result
+
+    def get_summaries(self) -> list["RechargeRequestSummary"]:
+        """Get a summary of the items in the request for each account, calculating the summaries if they are not
+        stored."""
+        summaries = list(RechargeRequestSummary.select(RechargeRequestSummary, Account.id, Account.name)
+                         .join(Account)
+                         .where(RechargeRequestSummary.recharge_request == self.id))
+        if not summaries:
+            summaries = self.calculate_summaries()
+        return summaries
+
+    def calculate_summaries(self) -> list["RechargeRequestSummary"]:
+        """Calculate and store a summary of the items in the request for each account: the number of items, their
+        total and the balance of the account before the start and end of the request."""
+        items = []
+        for object_type in [Transaction, MonthlyUsage]:
+            query = (object_type.select(object_type.account_id.alias("account_id"),
+                                        object_type.gross_total_pound_sql().alias("amount"))
+                     .where(object_type.recharge_request == self.id))
+            if object_type is MonthlyUsage:
+                query = query.join_from(MonthlyUsage, Month)
+            items.append(query)
+        items = (items[0] + items[1]).alias("items")
+        totals = (peewee.Select([items], [items.c.account_id, fn.SUM(items.c.amount).alias("total"),
+                                          fn.COUNT(items.c.account_id).alias("count")])
+                  .group_by(items.c.account_id)
+                  .bind(db)
+                  .dicts())
+        totals = {row["account_id"]: row for row in totals}
+
+        start_balances = get_balances(totals.keys(), self.start_date, inclusive=False)
+        end_balances = get_balances(totals.keys(), self.end_date, inclusive=False)
+        summaries = [{"recharge_request": self.id, "account": account_id, "start_balance": start_balances[account_id],
+                      "transaction_total": Decimal(str(row["total"])), "end_balance": end_balances[account_id],
+                      "item_count": row["count"]}
+                     for account_id, row in totals.items()]
+        with db.atomic():
+            RechargeRequestSummary.delete().where(RechargeRequestSummary.recharge_request == self.id).execute()
+            for batch in peewee.chunked(summaries, 100):
+                RechargeRequestSummary.insert_many(batch).execute()
+
+        return list(RechargeRequestSummary.select(RechargeRequestSummary, Account.id, Account.name)
+                    .join(Account)
+                    .where(RechargeRequestSummary.recharge_request == self.id))
+
+
+class Account(ReferenceDataMixin, BaseModel):
     id = peewee.CharField(primary_key=True)
     name = peewee.CharField()
     organization = peewee.ForeignKeyField(Organization, backref='accounts', null=True)
@@ -149,6 +297,22 @@ class Account(BaseModel):
 
         return transaction_details
 
+    def get_ledger_window(self, start_date: datetime.date, end_date: datetime.date) -> list[dict]:
+        """Returns the same rows as `get_transaction_details` but with running totals which include the balance of the
+        account before `start_date`, so that a window of the ledger shows the same running totals as the whole ledger.
+
+        :param start_date: The first date of the window. MonthlyUsage is in the ledger for the whole of its month, so
+            the window starts at the beginning of the month containing `start_date`.
+        :param end_date: The last date of the window.
+        """
+        start_date = max(datetime.date(start_date.year, start_date.month, 1), self.creation_date)
+        transaction_details = self.get_transaction_details(start_date, end_date)
+        if transaction_details and start_date > self.creation_date:
+            opening_balance = self.get_balance(start_date, inclusive=False)
+            for row in transaction_details:
+                row["running_total"] += opening_balance
+        return transaction_details
+
     @staticmethod
     def calculate_running_total(transaction_details: list[dict]) -> list[dict]:
         # sort transactions by date and add running total
@@ -177,7 +341,6 @@ class Account(BaseModel):
         :param end_date: The date up to which to include monthly usage data.
         """
         required_months = aam.utilities.get_months_between(start_date, end_date)
-        self.check_missing_monthly_transactions(required_months)
 
         # The Join to Month and RechargeRequest tables prevent N+1 querying when MonthlyUsage.to_json is run
         usage: Iterable[MonthlyUsage] = (
@@ -188,31 +351,6 @@ class Account(BaseModel):
 
         return usage
 
-    def check_missing_monthly_transactions(self, required_months: list[int]):
-        """Accounts should have a usage transaction for each month the account is open. This function checks if the
-        account has 'monthly' type transactions for each month code in `required_months`."""
-        self.add_months()
-        usage: Iterable[MonthlyUsage] = (MonthlyUsage.select(MonthlyUsage.month_id)
-                                         .where((MonthlyUsage.month_id.in_(required_months)) &
-                                                (MonthlyUsage.account_id == self.id))
-                                         )
-        existing_transaction_months = [monthly_usage.month_id for monthly_usage in usage]
-        missing_months = set(required_months) - set(existing_transaction_months)
-        if missing_months:
-            for month_code in missing_months:
-                MonthlyUsage.create(account=self.id, month=month_code,
-                                    date=aam.utilities.date_from_month_code(month_code))
-
-    @staticmethod
-    def add_months():
-        """Checks whether the Month table has all months up to the current month in it."""
-        required_months = aam.utilities.get_months_between(datetime.date(2021, 1, 1), datetime.date.today())
-        actual_months: list[int] = [row[0] for row in (Month.select(Month.month_code).tuples())]
-        missing_months = set(required_months) - set(actual_months)
-
-        for month_code in missing_months:
-            Month.create(month_code=month_code, exchange_rate=1)
-
     @property
     def final_date(self) -> datetime.date:
         """Return the final date on which the account is active."""
@@ -224,16 +362,100 @@ class Account(BaseModel):
     def get_balance(self, date: datetime.date, inclusive: bool = True):
         """Get the balance of an account on a certain date.
 
+        The balance is the closing balance of the previous month (see `get_closing_balance`) plus any MonthlyUsage and
+        Transactions in the month containing `date`.
+
         :param date: The date on which to calculate the balance.
         :param inclusive: Whether the balance includes or excludes transactions that fall on `date`.
         """
         if not inclusive:
             date = date - datetime.timedelta(days=1)
 
-        transaction_details = self.get_transaction_details(end_date=date)
-        if len(transaction_details) == 0:
+        if not self.creation_date:
             return 0
-        return transaction_details[-1]["running_total"]
+        end_date = min(date, self.final_date)
+        month_start = datetime.date(end_date.year, end_date.month, 1)
+        balance = self.get_closing_balance(aam.utilities.month_code(end_date.year, end_date.month) - 1)
+        for row in self.get_transaction_details(max(month_start, self.creation_date), end_date):
+            balance += row["gross_total_pound"] or 0
+        return balance
+
+    def get_closing_balance(self, month_code: int) -> Decimal:
+        """Get the balance of the account at the end of the month given by `month_code`.
+
+        The balance is calculated from the most recent closing balance stored in the MonthlyBalance table plus the
+        ledger after it. Nothing is written so reading a balance never needs a write lock, closing balances are
+        stored by `store_closing_balances`.
+        """
+        return self._calculate_closing_balances(month_code)[0]
+
+    def store_closing_balances(self):
+        """Store the closing balance of each complete month, before the current month, which is not already stored.
+        This writes to the database so is run by `aam.models.store_closing_balances` rather than when reading."""
+        current_month = aam.utilities.month_code(datetime.date.today().year, datetime.date.today().month)
+        closing_balances = self._calculate_closing_balances(current_month - 1)[1]
+        with db.atomic():
+            for batch in peewee.chunked(closing_balances, 100):
+                MonthlyBalance.insert_many(batch).on_conflict_replace().execute()
+
+    def _calculate_closing_balances(self, month_code: int) -> tuple[Decimal, list[dict]]:
+        """Calculate the balance of the account at the end of the month given by `month_code`.
+
+        :returns: The balance, and the closing balance of each month before the current month which was calculated
+            rather than read from the MonthlyBalance table, as rows for MonthlyBalance.
+        """
+        if not self.creation_date:
+            return Decimal(0), []
+        creation_month = aam.utilities.month_code(self.creation_date.year, self.creation_date.month)
+        if month_code < creation_month:
+            return Decimal(0), []
+
+        latest_balance: MonthlyBalance | None = (MonthlyBalance.select()
+                                                 .where((MonthlyBalance.account == self.id) &
+                                                        (MonthlyBalance.month <= month_code))
+                                                 .order_by(MonthlyBalance.month.desc())
+                                                 .first())
+        if latest_balance is None:
+            first_month = creation_month
+            balance = Decimal(0)
+        elif latest_balance.month_id == month_code:
+            return latest_balance.balance, []
+        else:
+            first_month = latest_balance.month_id + 1
+            balance = latest_balance.balance
+
+        start_date = max(self.creation_date, aam.utilities.date_from_month_code(first_month))
+        end_date = min(aam.utilities.date_from_month_code(month_code + 1) - datetime.timedelta(days=1),
+                       self.final_date)
+        month_totals = {month: Decimal(0) for month in range(first_month, month_code + 1)}
+        if start_date <= end_date:
+            for usage in self.get_monthly_usage(start_date, end_date):
+                month_totals[usage.month_id] += usage.gross_total_pound
+            for transaction in self.get_transactions(start_date, end_date):
+                month_totals[aam.utilities.month_code(transaction.date.year, transaction.date.month)] += \
+                    transaction.gross_total_pound or 0
+
+        current_month = aam.utilities.month_code(datetime.date.today().year, datetime.date.today().month)
+        closing_balances = []
+        for month, total in month_totals.items():
+            balance += total
+            if month < current_month:
+                closing_balances.append({"account": self.id, "month": month, "balance": balance})
+        return balance, closing_balances
+
+    def save(self, *args, **kwargs):
+        # The creation and closure dates bound the ledger so changing either can change every closing balance.
+        dates_changed = self.id is not None and (Account.creation_date in self.dirty_fields or
+                                                 Account.closure_date in self.dirty_fields)
+        # Usage statistics are grouped by these fields.
+        groups_changed = self.id is not None and any(field in self.dirty_fields for field in
+                                                     (Account.organization, Account.finance_code, Account.task_code))
+        result = super().save(*args, **kwargs)
+        if dates_changed:
+            ledger_changed(self.id)
+        elif groups_changed:
+            invalidate_usage_rollup(self.id)
+        return result
 
 
 class Sysadmin(BaseModel):
@@ -254,7 +476,35 @@ class Note(BaseModel):
     account = peewee.ForeignKeyField(Account, backref="notes")
 
 
-class MonthlyUsage(BaseModel):
+class LedgerEntryMixin:
+    """Shared behaviour of the models which make up the ledger of an Account (MonthlyUsage and Transaction).
+
+    Saving or deleting an entry invalidates any stored values calculated from the entry (see `ledger_changed`). Each
+    model must have a `ledger_date` property giving the date at which the entry contributes to the balance of the
+    account.
+    """
+    # The names of the fields which change the contribution of the entry to the balance of the account.
+    ledger_fields: tuple[str, ...] = ()
+    ledger_date: datetime.date
+
+    def save(self, *args, **kwargs):
+        entry_changed = self.id is None or any(field.name in self.ledger_fields for field in self.dirty_fields)
+        # The previous version of the entry is needed in case the entry has moved to another date or account.
+        previous = type(self).get_or_none(id=self.id) if entry_changed and self.id is not None else None
+        result = super().save(*args, **kwargs)
+        if entry_changed:
+            ledger_changed(self.account_id, self.ledger_date)
+            if previous is not None:
+                ledger_changed(previous.account_id, previous.ledger_date)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        ledger_changed(self.account_id, self.ledger_date)
+        return result
+
+
+class MonthlyUsage(LedgerEntryMixin, BaseModel):
     # Usage is always in dollars
     id = peewee.AutoField()
     account = peewee.ForeignKeyField(Account, backref="monthly_usage")
@@ -267,6 +517,13 @@ class MonthlyUsage(BaseModel):
     recharge_request = peewee.ForeignKeyField(RechargeRequest, backref="monthly_usage", null=True)
     note = peewee.CharField(null=True)
 
+    ledger_fields = ("account", "month", "amount", "shared_charge")
+
+    @property
+    def ledger_date(self) -> datetime.date:
+        """Usage contributes to the balance from the first day of its month."""
+        return aam.utilities.date_from_month_code(self.month_id)
+
     def to_json(self) -> dict:
         details = {"id": self.id, "account_id": self.account_id, "type": TRANSACTION_TYPES[self.type],
                    "date": self.date, "amount": self.amount, "shared_charge": self.shared_charge,
@@ -283,14 +540,14 @@ class MonthlyUsage(BaseModel):
 
     @property
     def support_eligible(self) -> bool:
-        """Accounts must pay 10% charge after 01/08/24 as this was when the OGVA started."""
-        return self.date >= datetime.date(2024, 8, 1)
+        """Whether a support ChargeRule applies to the usage."""
+        return get_charge_rate("Support", self.type, self.date) != 0
 
     @property
     def support_charge(self) -> Decimal:
         """If the transaction needs to be charged for support, return the amount in dollars."""
         if self.support_eligible and self.amount:
-            return (self.amount + self.shared_charge) * Decimal(0.1)
+            return (self.amount + self.shared_charge) * get_charge_rate("Support", self.type, self.date)
         else:
             return Decimal(0)
 
@@ -298,7 +555,8 @@ class MonthlyUsage(BaseModel):
     def gross_total_dollar(self) -> Decimal:
         """Usage + shared charges + support + VAT."""
         if self.amount:
-            return (self.amount + self.shared_charge + self.support_charge) * Decimal(1.2)
+            vat_rate = get_charge_rate("VAT", self.type, self.date)
+            return (self.amount + self.shared_charge + self.support_charge) * (1 + vat_rate)
         else:
             return Decimal(0)
 
@@ -310,8 +568,22 @@ class MonthlyUsage(BaseModel):
         else:
             return Decimal(0)
 
+    @staticmethod
+    def gross_total_dollar_sql() -> peewee.Expression:
+        """An SQL expression equivalent to `gross_total_dollar`."""
+        usage_type = peewee.Value(TRANSACTION_TYPES.index("Monthly Usage"))
+        net_total = MonthlyUsage.amount + MonthlyUsage.shared_charge
+        support_charge = net_total * get_charge_rate_sql("Support", usage_type, MonthlyUsage.date)
+        vat_rate = get_charge_rate_sql("VAT", usage_type, MonthlyUsage.date)
+        return Case(None, [(MonthlyUsage.amount != 0, (net_total + support_charge) * (1 + vat_rate))], 0)
+
+    @staticmethod
+    def gross_total_pound_sql() -> peewee.Expression:
+        """An SQL expression equivalent to `gross_total_pound`. Queries using it must join to Month."""
+        return MonthlyUsage.gross_total_dollar_sql() * Month.exchange_rate
+
 
-class Transaction(BaseModel):
+class Transaction(LedgerEntryMixin, BaseModel):
     id = peewee.AutoField()
     account = peewee.ForeignKeyField(Account, backref="transactions")
     account_id: int  # Direct access to Foreign key value
@@ -326,16 +598,24 @@ class Transaction(BaseModel):
     project_code = peewee.CharField(null=True)
     task_code = peewee.CharField(null=True)
 
+    ledger_fields = ("account", "type", "date", "amount", "is_pound", "exchange_rate")
+
+    @property
+    def ledger_date(self) -> datetime.date:
+        # The date is set directly from the transaction grid as an ISO format string.
+        if isinstance(self.date, str):
+            return datetime.date.fromisoformat(self.date)
+        return self.date
+
     @property
     def support_eligible(self) -> bool:
-        """Accounts must pay 10% charge after 01/08/24 as this was when the OGVA started."""
-        return self.date >= datetime.date(2024, 8, 1)
+        """Whether a support ChargeRule applies to the transaction."""
+        return get_charge_rate("Support", self.type, self.ledger_date) != 0
 
     @property
     def support_charge(self) -> Decimal:
         if self.support_eligible and self.amount:
-            if self.type == TRANSACTION_TYPES.index("Savings Plan"):
-                return self.amount * Decimal(0.1)
+            return self.amount * get_charge_rate("Support", self.type, self.ledger_date)
         return Decimal(0)
 
     def to_json(self) -> dict:
@@ -382,11 +662,11 @@ class Transaction(BaseModel):
 
     @property
     def gross_total_dollar(self) -> Decimal | None:
-        """Calculate the total cost for the month, adding 20% for VAT."""
+        """Calculate the total cost for the month, adding support and VAT."""
         if self.amount is None or self.amount_dollar is None:
             return None
         else:
-            return (self.amount_dollar + self.support_charge) * Decimal(1.2)
+            return (self.amount_dollar + self.support_charge) * (1 + get_charge_rate("VAT", self.type, self.ledger_date))
 
     @property
     def gross_total_pound(self) -> Decimal | None:
@@ -398,6 +678,20 @@ class Transaction(BaseModel):
 
         return self.gross_total_dollar * self.exchange_rate
 
+    @staticmethod
+    def gross_total_dollar_sql() -> peewee.Expression:
+        """An SQL expression equivalent to `gross_total_dollar` for dollar transactions."""
+        support_charge = Transaction.amount * get_charge_rate_sql("Support", Transaction.type, Transaction.date)
+        vat_rate = get_charge_rate_sql("VAT", Transaction.type, Transaction.date)
+        return (Transaction.amount + support_charge) * (1 + vat_rate)
+
+    @staticmethod
+    def gross_total_pound_sql() -> peewee.Expression:
+        """An SQL expression equivalent to `gross_total_pound`, giving 0 where `gross_total_pound` is None."""
+        return fn.COALESCE(Case(None, [(Transaction.is_pound == True, Transaction.amount),
+                                       (Transaction.amount != 0,
+                                        Transaction.gross_total_dollar_sql() * Transaction.exchange_rate)], 0), 0)
+
 
 class SharedCharge(BaseModel):
     # Shared charges are a way to assign additional usage to a MonthlyUsage.
@@ -417,5 +711,618 @@ class AccountJoinSharedCharge(BaseModel):
         primary_key = peewee.CompositeKey('account', 'shared_charge')
 
 
-db.create_tables([Account, LastAccountUpdate, Person, Sysadmin, Note, Month, MonthlyUsage, Transaction, RechargeRequest,
-                  SharedCharge, AccountJoinSharedCharge, Organization])
+class ChargeRule(BaseModel):
+    # A percentage charge added to the net value of transactions of one type between two dates. The gross value of a
+    # transaction is calculated from these rules both in Python (e.g. MonthlyUsage.gross_total_dollar) and in SQL
+    # (e.g. MonthlyUsage.gross_total_dollar_sql) so that totals can be calculated by the database.
+    id = peewee.AutoField()
+    charge: str = peewee.CharField()  # One of CHARGE_TYPES
+    transaction_type: int = peewee.IntegerField()  # Index into TRANSACTION_TYPES
+    rate: Decimal = peewee.DecimalField()  # Fraction of the net value, e.g. 0.2 for 20%
+    start_date: datetime.date = peewee.DateField(null=True)  # Applies on or after this date. None if no start.
+    end_date: datetime.date = peewee.DateField(null=True)  # Applies on or before this date. None if no end.
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "charge": self.charge, "transaction_type": TRANSACTION_TYPES[self.transaction_type],
+                "rate": self.rate, "start_date": self.start_date, "end_date": self.end_date}
+
+    def applies(self, transaction_type: int, date: datetime.date) -> bool:
+        """Whether the rule applies to a transaction of `transaction_type` on `date`."""
+        if transaction_type != self.transaction_type:
+            return False
+        if self.start_date and date < self.start_date:
+            return False
+        if self.end_date and date > self.end_date:
+            return False
+        return True
+
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        charge_rules_changed()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        charge_rules_changed()
+        return result
+
+
+# ChargeRules are read for every transaction displayed so are cached rather than queried each time.
+_charge_rules: dict[str, list[ChargeRule]] | None = None
+
+
+def get_charge_rules(charge: str) -> list[ChargeRule]:
+    """Get the ChargeRules for one of the CHARGE_TYPES. Rules are in order of precedence, where more than one rule
+    applies to a transaction the first is used."""
+    global _charge_rules
+    if _charge_rules is None:
+        rules = {charge_type: [] for charge_type in CHARGE_TYPES}
+        for rule in ChargeRule.select().order_by(ChargeRule.id):
+            rules.setdefault(rule.charge, []).append(rule)
+        _charge_rules = rules
+    return _charge_rules.get(charge, [])
+
+
+def charge_rules_changed():
+    """Clear the ChargeRule cache and any stored values calculated using the previous rules."""
+    clear_charge_rule_cache()
+    ledger_changed(None)
+
+
+def clear_charge_rule_cache():
+    """Clear the ChargeRule cache so that the rules are read again when next used."""
+    global _charge_rules
+    _charge_rules = None
+
+
+def get_charge_rate(charge: str, transaction_type: int, date: datetime.date) -> Decimal:
+    """Get the rate of `charge` for a transaction of `transaction_type` on `date`. Returns 0 if no rule applies."""
+    for rule in get_charge_rules(charge):
+        if rule.applies(transaction_type, date):
+            return rule.rate
+    return Decimal(0)
+
+
+def get_charge_rate_sql(charge: str, transaction_type: peewee.Node, date: peewee.Node) -> peewee.Node:
+    """Compile the ChargeRules for `charge` into an SQL CASE expression equivalent to `get_charge_rate`.
+
+    :param charge: One of CHARGE_TYPES.
+    :param transaction_type: An SQL expression giving the index of the transaction type.
+    :param date: An SQL expression giving the date of the transaction.
+    """
+    cases = []
+    for rule in get_charge_rules(charge):
+        condition = (transaction_type == rule.transaction_type)
+        if rule.start_date:
+            condition &= (date >= rule.start_date)
+        if rule.end_date:
+            condition &= (date <= rule.end_date)
+        cases.append((condition, float(rule.rate)))
+    if not cases:
+        return peewee.Value(0)
+    return Case(None, cases, 0)
+
+
+def create_default_charge_rules() -> bool:
+    """If there are no ChargeRules, add the standard charges: 20% VAT on everything and a 10% support charge on usage
+    and savings plans from 01/08/24, when the OGVA started.
+
+    The ChargeRule cache is cleared but stored values calculated without the rules are not, so that this can be run
+    by a migration. The caller must call `ledger_changed` if needed.
+
+    :returns: Whether the rules were added.
+    """
+    if ChargeRule.select().exists():
+        return False
+    rules = [{"charge": "VAT", "transaction_type": transaction_type, "rate": Decimal("0.2"), "start_date": None}
+             for transaction_type in range(len(TRANSACTION_TYPES))]
+    rules.extend({"charge": "Support", "transaction_type": TRANSACTION_TYPES.index(transaction_type),
+                  "rate": Decimal("0.1"), "start_date": datetime.date(2024, 8, 1)}
+                 for transaction_type in ["Monthly Usage", "Savings Plan"])
+    ChargeRule.insert_many(rules).execute()
+    clear_charge_rule_cache()
+    return True
+
+
+def get_person_names() -> dict[int, str]:
+    """Get the full name of each Person, indexed by id and ordered by name. The result is cached."""
+    def load() -> dict[int, str]:
+        people = Person.select().order_by(Person.first_name, Person.last_name)
+        return {person.id: person.full_name for person in people}
+    return aam.cache.reference_cache.get("person_names", load)
+
+
+def get_organization_names() -> dict[str, str | None]:
+    """Get the name of each Organization, indexed by id. The result is cached."""
+    def load() -> dict[str, str | None]:
+        return {organization.id: organization.name for organization in Organization.select().order_by(Organization.id)}
+    return aam.cache.reference_cache.get("organization_names", load)
+
+
+def get_account_summaries(organization_id: str | None = None) -> list[dict]:
+    """Get the "id", "name" and "status" of each Account, ordered by name. The result is cached.
+
+    :param organization_id: Only get accounts in this organization. If None, get all accounts.
+    """
+    def load(organization_id: str | None) -> list[dict]:
+        query = Account.select(Account.id, Account.name, Account.status).order_by(Account.name)
+        if organization_id is not None:
+            query = query.where(Account.organization == organization_id)
+        return list(query.dicts())
+    return aam.cache.reference_cache.get("account_summaries", load, organization_id)
+
+
+class RechargeRequestSummary(BaseModel):
+    # A summary of the items for one Account in a RechargeRequest, used to display the request without calculating
+    # balances for every account each time. Summaries are calculated by RechargeRequest.calculate_summaries and removed
+    # by `invalidate_recharge_summaries` whenever the ledger changes.
+    recharge_request = peewee.ForeignKeyField(RechargeRequest, backref="summaries", on_delete="CASCADE")
+    recharge_request_id: int  # Direct access to Foreign Key
+    account = peewee.ForeignKeyField(Account, backref="recharge_summaries", on_delete="CASCADE")
+    account_id: str  # Direct access to Foreign Key
+    start_balance: Decimal = peewee.DecimalField()
+    transaction_total: Decimal = peewee.DecimalField()
+    end_balance: Decimal = peewee.DecimalField()
+    item_count: int = peewee.IntegerField()
+
+    class Meta:
+        primary_key = peewee.CompositeKey('recharge_request', 'account')
+
+    def to_json(self) -> dict:
+        return {"account_name": self.account.name, "account_id": self.account_id,
+                "num_transactions": self.item_count, "transaction_total": self.transaction_total,
+                "start_balance": self.start_balance, "end_balance": self.end_balance}
+
+
+class MonthlyBalance(BaseModel):
+    # The balance of an Account at the end of a month. This is a cache of the ledger which allows Account.get_balance to
+    # start from the most recent closing balance rather than replaying the full history of the account. Rows are
+    # removed by `invalidate_monthly_balances` whenever the ledger changes and are stored again in the background by
+    # `store_closing_balances`.
+    account = peewee.ForeignKeyField(Account, backref="monthly_balances", on_delete="CASCADE")
+    account_id: str  # Direct access to Foreign Key
+    month: Month = peewee.ForeignKeyField(Month, backref="monthly_balances")
+    month_id: int  # Direct access to Foreign Key
+    balance: Decimal = peewee.DecimalField()
+
+    class Meta:
+        primary_key = peewee.CompositeKey('account', 'month')
+
+
+class MonthlyUsageRollup(BaseModel):
+    # The gross totals of a MonthlyUsage with the account details used to group them, so that statistics can be summed
+    # by the database without calculating charges for each row. Like MonthlyBalance, rows are removed by
+    # `invalidate_usage_rollup` when the ledger changes and are recalculated by `refresh_usage_rollup` when next needed.
+    monthly_usage = peewee.ForeignKeyField(MonthlyUsage, primary_key=True, backref="rollup", on_delete="CASCADE")
+    monthly_usage_id: int  # Direct access to Foreign Key
+    account = peewee.ForeignKeyField(Account, backref="usage_rollup", on_delete="CASCADE")
+    account_id: str  # Direct access to Foreign Key
+    month: Month = peewee.ForeignKeyField(Month, backref="usage_rollup")
+    month_id: int  # Direct access to Foreign Key
+    organization = peewee.ForeignKeyField(Organization, backref="usage_rollup", null=True)
+    organization_id: str  # Direct access to Foreign Key
+    finance_code = peewee.CharField(null=True)
+    task_code = peewee.CharField(null=True)
+    gross_total_dollar: Decimal = peewee.DecimalField()
+    gross_total_pound: Decimal = peewee.DecimalField()
+
+    class Meta:
+        indexes = ((("month", "account"), False),)
+
+
+class DataQualitySnapshot(BaseModel):
+    # The results of the checks in aam.data_quality, taken in the background by `aam.data_quality.take_snapshot` so
+    # that the Data Quality tab can show the latest results without running the checks.
+    id = peewee.AutoField()
+    computed_at: datetime.datetime = peewee.DateTimeField(index=True)
+    results: str = peewee.TextField()  # JSON, the rows found by each check indexed by check name
+
+
+def backfill_ledger(account_ids: Iterable[str] | None = None):
+    """Accounts should have a MonthlyUsage for each month the account is open. Add any missing Month rows up to the
+    current month and a placeholder MonthlyUsage for each month an account is open without one.
+
+    This is run at startup, when the month changes and when accounts are created or their dates are changed, so that
+    reading the ledger never has to write to the database. All rows are added in a single transaction.
+
+    :param account_ids: The accounts to add MonthlyUsage to. If None, all accounts are checked.
+    """
+    month_codes = aam.utilities.get_months_between(datetime.date(2021, 1, 1), datetime.date.today())
+    accounts = (Account.select(Account.id, Account.creation_date, Account.closure_date)
+                .where(Account.creation_date.is_null(False)))
+    existing_usage = (MonthlyUsage.select(MonthlyUsage.account, MonthlyUsage.month)
+                      .join(Account)
+                      .where(Account.creation_date.is_null(False)))
+    if account_ids is not None:
+        account_ids = list(account_ids)
+        accounts = accounts.where(Account.id.in_(account_ids))
+        existing_usage = existing_usage.where(Account.id.in_(account_ids))
+
+    with db.atomic():
+        for batch in peewee.chunked(month_codes, 100):
+            (Month.insert_many([{"month_code": month_code, "exchange_rate": 1} for month_code in batch])
+             .on_conflict_ignore().execute())
+
+        existing_usage = set(existing_usage.tuples())
+        new_usage = []
+        for account in accounts:
+            for month_code in aam.utilities.get_months_between(account.creation_date, account.final_date):
+                if (account.id, month_code) not in existing_usage:
+                    new_usage.append({"account": account.id, "month": month_code,
+                                      "date": aam.utilities.date_from_month_code(month_code)})
+        for batch in peewee.chunked(new_usage, 100):
+            MonthlyUsage.insert_many(batch).execute()
+
+
+def store_closing_balances(account_ids: Iterable[str] | None = None) -> int:
+    """Store the closing balances of accounts which have no closing balance stored for the previous month, e.g.
+    because their ledger has changed. This is run regularly in the background (see `aam.initialization`) so that
+    reading balances does not write to the database.
+
+    :param account_ids: The accounts to check. If None, all accounts are checked.
+    :returns: The number of accounts whose closing balances were stored.
+    """
+    today = datetime.date.today()
+    previous_month = aam.utilities.month_code(today.year, today.month) - 1
+    stored = MonthlyBalance.select().where((MonthlyBalance.account == Account.id)
+                                           & (MonthlyBalance.month == previous_month))
+    accounts = (Account.select()
+                .where(Account.creation_date.is_null(False)
+                       & (Account.creation_date < datetime.date(today.year, today.month, 1))
+                       & ~fn.EXISTS(stored)))
+    if account_ids is not None:
+        accounts = accounts.where(Account.id.in_(list(account_ids)))
+    accounts = list(accounts)
+    for account in accounts:
+        account.store_closing_balances()
+    return len(accounts)
+
+
+def upsert_monthly_usage(amounts: dict[tuple[str, int], Decimal | None]) -> dict[str, int]:
+    """Set the amount of many MonthlyUsage in a single transaction, creating any MonthlyUsage which do not exist.
+    Rows are written with one bulk insert which updates the amount of existing rows, so either all the amounts are
+    set or, if there is an error, none are.
+
+    :param amounts: The net usage in dollars, indexed by (account id, month code).
+    :returns: The number of MonthlyUsage "inserted", "updated" and "unchanged".
+    """
+    result = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not amounts:
+        return result
+    account_ids = {account_id for account_id, _ in amounts}
+    month_codes = {month_code for _, month_code in amounts}
+
+    with db.atomic():
+        for batch in peewee.chunked(month_codes, 100):
+            (Month.insert_many([{"month_code": month_code, "exchange_rate": 1} for month_code in batch])
+             .on_conflict_ignore().execute())
+
+        existing_usage = (MonthlyUsage.select(MonthlyUsage.account, MonthlyUsage.month, MonthlyUsage.amount)
+                          .where(MonthlyUsage.account.in_(list(account_ids)) & MonthlyUsage.month.in_(list(month_codes)))
+                          .tuples())
+        existing_usage = {(account_id, month_code): amount for account_id, month_code, amount in existing_usage}
+
+        new_usage = []
+        # The earliest changed month for each account
+        changed_accounts: dict[str, int] = {}
+        for (account_id, month_code), amount in amounts.items():
+            if (account_id, month_code) not in existing_usage:
+                result["inserted"] += 1
+            # Amounts are stored as floating point numbers by SQLite so compare them as such.
+            elif (existing_usage[(account_id, month_code)] is None) == (amount is None) and \
+                    (amount is None or float(existing_usage[(account_id, month_code)]) == float(amount)):
+                result["unchanged"] += 1
+                continue
+            else:
+                result["updated"] += 1
+            new_usage.append({"account": account_id, "month": month_code, "amount": amount,
+                              "date": aam.utilities.date_from_month_code(month_code)})
+            changed_accounts[account_id] = min(month_code, changed_accounts.get(account_id, month_code))
+
+        for batch in peewee.chunked(new_usage, 100):
+            (MonthlyUsage.insert_many(batch)
+             .on_conflict(conflict_target=[MonthlyUsage.account, MonthlyUsage.month], preserve=[MonthlyUsage.amount])
+             .execute())
+        for account_id, month_code in changed_accounts.items():
+            ledger_changed(account_id, aam.utilities.date_from_month_code(month_code))
+    return result
+
+
+class DuplicateMonthlyUsageError(ValueError):
+    """Raised when an account has more than one MonthlyUsage in a month and they cannot be reduced to one without
+    losing usage. Each must be resolved by hand."""
+    def __init__(self, duplicates: list[tuple[str, int]]):
+        self.duplicates = duplicates
+        months = ", ".join(f"{account_id} {aam.utilities.date_from_month_code(month_code):%Y-%m}"
+                           for account_id, month_code in duplicates)
+        super().__init__(f"Accounts have conflicting MonthlyUsage in the same month, keep one MonthlyUsage for each "
+                         f"of these before upgrading the database: {months}")
+
+
+def remove_duplicate_monthly_usage() -> list[tuple[str, int]]:
+    """Each account should have one MonthlyUsage per month. Where there is more than one, delete exact duplicates,
+    with the same amount, shared charge and RechargeRequest, and empty MonthlyUsage, with no amount, shared charge,
+    RechargeRequest or note. Nothing is deleted if any other duplicates remain.
+
+    This is run by a migration so it only uses the MonthlyUsage table. The caller must remove any stored values
+    calculated from the changed ledgers.
+
+    :raises DuplicateMonthlyUsageError: If an account has MonthlyUsage in one month which differ.
+    :returns: The (account id, month code) of each month which had duplicates.
+    """
+    duplicates = list(MonthlyUsage.select(MonthlyUsage.account, MonthlyUsage.month)
+                      .group_by(MonthlyUsage.account, MonthlyUsage.month)
+                      .having(fn.COUNT(MonthlyUsage.id) > 1)
+                      .tuples())
+    removed_ids = []
+    conflicts = []
+    for account_id, month_code in duplicates:
+        # A MonthlyUsage with a note is kept in preference to one without.
+        usage = list(MonthlyUsage.select()
+                     .where((MonthlyUsage.account == account_id) & (MonthlyUsage.month == month_code))
+                     .order_by(MonthlyUsage.note.is_null(), MonthlyUsage.id))
+        entries = [monthly_usage for monthly_usage in usage
+                   if monthly_usage.amount is not None or monthly_usage.shared_charge
+                   or monthly_usage.recharge_request_id is not None or monthly_usage.note is not None]
+        # Amounts are stored as floating point numbers by SQLite so compare them as such.
+        values = {(None if monthly_usage.amount is None else float(monthly_usage.amount),
+                   float(monthly_usage.shared_charge), monthly_usage.recharge_request_id)
+                  for monthly_usage in entries}
+        if len(values) > 1:
+            conflicts.append((account_id, month_code))
+            continue
+        kept = entries[0] if entries else usage[0]
+        removed_ids.extend(monthly_usage.id for monthly_usage in usage if monthly_usage is not kept)
+    if conflicts:
+        raise DuplicateMonthlyUsageError(conflicts)
+
+    with db.atomic():
+        for batch in peewee.chunked(removed_ids, 100):
+            MonthlyUsage.delete().where(MonthlyUsage.id.in_(batch)).execute()
+    return duplicates
+
+
+def allocate_shared_charges(start_month: int | None = None, end_month: int | None = None) -> dict:
+    """Set the shared charge of every MonthlyUsage in a range of months to its share of the SharedCharges of that month.
+    Each SharedCharge is split equally between its accounts. MonthlyUsage with no SharedCharges, e.g. because an
+    account was removed from a charge, is reset to 0.
+
+    The shares are calculated by one grouped query which is used to update all the changed MonthlyUsage with a single
+    UPDATE, in one transaction.
+
+    :param start_month: The month code of the first month to allocate. If None, start from the earliest month.
+    :param end_month: The month code of the last month to allocate. If None, continue to the latest month.
+    :returns: The number of MonthlyUsage "updated" and a list of the ("account_id", "month_code") of each "unallocated"
+        share, which could not be allocated as the account has no MonthlyUsage in that month.
+    """
+    def in_range(month: peewee.Node) -> peewee.Expression:
+        condition = peewee.Value(True)
+        if start_month is not None:
+            condition &= month >= start_month
+        if end_month is not None:
+            condition &= month <= end_month
+        return condition
+
+    # Amounts are cast so that SQLite does not use integer division for whole amounts.
+    shares = (SharedCharge
+              .select(SharedCharge.id, month_code_sql(SharedCharge.date).alias("month_code"),
+                      (SharedCharge.amount.cast("REAL") / fn.COUNT(AccountJoinSharedCharge.account)).alias("share"))
+              .join(AccountJoinSharedCharge)
+              .where(in_range(month_code_sql(SharedCharge.date)))
+              .group_by(SharedCharge.id))
+    allocations = (AccountJoinSharedCharge
+                   .select(AccountJoinSharedCharge.account.alias("account_id"), shares.c.month_code,
+                           fn.SUM(shares.c.share).alias("shared_charge"))
+                   .join(shares, on=(AccountJoinSharedCharge.shared_charge == shares.c.id))
+                   .group_by(AccountJoinSharedCharge.account, shares.c.month_code)
+                   .cte("allocations"))
+    shared_charge = fn.COALESCE(
+        allocations.select_from(allocations.c.shared_charge)
+        .where((allocations.c.account_id == MonthlyUsage.account) & (allocations.c.month_code == MonthlyUsage.month)),
+        0)
+    changed = in_range(MonthlyUsage.month) & (MonthlyUsage.shared_charge != shared_charge)
+
+    with db.atomic():
+        # The earliest changed month of each account, so that the values calculated from its ledger are removed.
+        changed_accounts = (MonthlyUsage.select(MonthlyUsage.account, fn.MIN(MonthlyUsage.month))
+                            .where(changed)
+                            .group_by(MonthlyUsage.account)
+                            .tuples())
+        changed_accounts = list(changed_accounts)
+        updated = MonthlyUsage.update(shared_charge=shared_charge).where(changed).execute()
+        for account_id, month_code in changed_accounts:
+            ledger_changed(account_id, aam.utilities.date_from_month_code(month_code))
+
+        unallocated = (allocations
+                       .select_from(allocations.c.account_id, allocations.c.month_code)
+                       .join(MonthlyUsage, JOIN.LEFT_OUTER,
+                             on=((MonthlyUsage.account == allocations.c.account_id)
+                                 & (MonthlyUsage.month == allocations.c.month_code)))
+                       .where(MonthlyUsage.id.is_null())
+                       .order_by(allocations.c.account_id, allocations.c.month_code))
+        unallocated = list(unallocated.dicts())
+    return {"updated": updated, "unallocated": unallocated}
+
+
+def month_code_sql(date_expression) -> peewee.Expression:
+    """An SQL expression equivalent to `aam.utilities.month_code` for a date column or expression."""
+    return (fn.strftime("%Y", date_expression).cast("INTEGER") * 12
+            + fn.strftime("%m", date_expression).cast("INTEGER"))
+
+
+def get_balances(account_ids: Iterable[str] | None, date: datetime.date, inclusive: bool = True) -> dict[str, Decimal]:
+    """Get the balance of several accounts on a certain date. This gives the same result as calling
+    `Account.get_balance` for each account but calculates all the balances in a single query.
+
+    :param account_ids: The accounts to get the balance of. If None, gets the balance of all accounts.
+    :param date: The date on which to calculate the balance.
+    :param inclusive: Whether the balance includes or excludes transactions that fall on `date`.
+    :returns: A dict of balances indexed by account id. Accounts with no ledger entries have a balance of 0.
+    """
+    if not inclusive:
+        date = date - datetime.timedelta(days=1)
+    # The ledger of an account runs from its creation date to the earliest of `date`, the closure date and today.
+    date = min(date, datetime.date.today()).isoformat()
+    end_date = fn.MIN(date, fn.COALESCE(Account.closure_date, date))
+
+    usage = (MonthlyUsage.select(MonthlyUsage.account_id.alias("account_id"),
+                                 MonthlyUsage.gross_total_pound_sql().alias("amount"))
+             .join_from(MonthlyUsage, Month)
+             .join_from(MonthlyUsage, Account)
+             .where(Account.creation_date.is_null(False)
+                    & (MonthlyUsage.month_id >= month_code_sql(Account.creation_date))
+                    & (MonthlyUsage.month_id <= month_code_sql(end_date))))
+    transactions = (Transaction.select(Transaction.account_id.alias("account_id"),
+                                       Transaction.gross_total_pound_sql().alias("amount"))
+                    .join_from(Transaction, Account)
+                    .where(Account.creation_date.is_null(False)
+                           & (Transaction.date >= Account.creation_date)
+                           & (Transaction.date <= end_date)))
+    if account_ids is not None:
+        account_ids = list(account_ids)
+        usage = usage.where(MonthlyUsage.account_id.in_(account_ids))
+        transactions = transactions.where(Transaction.account_id.in_(account_ids))
+
+    ledger = (usage + transactions).alias("ledger")
+    query = (peewee.Select([ledger], [ledger.c.account_id, fn.SUM(ledger.c.amount).alias("balance")])
+             .group_by(ledger.c.account_id)
+             .bind(db))
+
+    balances = {account_id: Decimal(0) for account_id in account_ids or []}
+    for row in query.dicts():
+        balances[row["account_id"]] = Decimal(str(row["balance"]))
+    return balances
+
+
+def ledger_changed(account_id: str | None, date: datetime.date | None = None):
+    """Called when the ledger of an account changes to remove any stored values calculated from it.
+
+    :param account_id: The account whose ledger has changed. If None, the ledger of every account has changed.
+    :param date: The date of the earliest change. If None, the whole ledger has changed.
+    """
+    invalidate_monthly_balances(account_id, date)
+    invalidate_recharge_summaries(account_id, date)
+    invalidate_usage_rollup(account_id, date)
+    # Cleared after the commit so that other threads cannot cache a forecast of the ledger from before the change.
+    db.after_commit(aam.cache.forecast_cache.invalidate)
+
+
+def invalidate_monthly_balances(account_id: str | None, date: datetime.date | None = None):
+    """Remove stored closing balances which are affected by a change to the ledger.
+
+    :param account_id: The account whose ledger has changed. If None, balances are removed for all accounts.
+    :param date: The date of the change. Closing balances for the month containing `date` and all later months are
+        removed. If None, all closing balances are removed.
+    """
+    query = MonthlyBalance.delete()
+    if account_id is not None:
+        query = query.where(MonthlyBalance.account == account_id)
+    if date is not None:
+        query = query.where(MonthlyBalance.month >= aam.utilities.month_code(date.year, date.month))
+    query.execute()
+
+
+def invalidate_usage_rollup(account_id: str | None, date: datetime.date | None = None):
+    """Remove the rolled up MonthlyUsage which is affected by a change to the ledger or to the details of an account.
+
+    :param account_id: The account which has changed. If None, rows are removed for all accounts.
+    :param date: The date of the change. Rows for the month containing `date` and all later months are removed. If
+        None, rows for all months are removed.
+    """
+    query = MonthlyUsageRollup.delete()
+    if account_id is not None:
+        query = query.where(MonthlyUsageRollup.account == account_id)
+    if date is not None:
+        query = query.where(MonthlyUsageRollup.month >= aam.utilities.month_code(date.year, date.month))
+    query.execute()
+
+
+def refresh_usage_rollup() -> int:
+    """Add a MonthlyUsageRollup for each MonthlyUsage which does not have one, calculating the gross totals in a single
+    INSERT ... SELECT.
+
+    :returns: The number of rows added.
+    """
+    gross_total_dollar = MonthlyUsage.gross_total_dollar_sql()
+    missing = (MonthlyUsage
+               .select(MonthlyUsage.id, MonthlyUsage.account, MonthlyUsage.month, Account.organization,
+                       Account.finance_code, Account.task_code, gross_total_dollar,
+                       gross_total_dollar * Month.exchange_rate)
+               .join_from(MonthlyUsage, Account)
+               .join_from(MonthlyUsage, Month)
+               .join_from(MonthlyUsage, MonthlyUsageRollup, JOIN.LEFT_OUTER)
+               .where(MonthlyUsageRollup.monthly_usage.is_null()))
+    fields = [MonthlyUsageRollup.monthly_usage, MonthlyUsageRollup.account, MonthlyUsageRollup.month,
+              MonthlyUsageRollup.organization, MonthlyUsageRollup.finance_code, MonthlyUsageRollup.task_code,
+              MonthlyUsageRollup.gross_total_dollar, MonthlyUsageRollup.gross_total_pound]
+    with db.atomic():
+        return MonthlyUsageRollup.insert_from(missing, fields).execute()
+
+
+# The ways usage statistics can be grouped, with the MonthlyUsageRollup field of each.
+USAGE_GROUPS = {"account": MonthlyUsageRollup.account, "month": MonthlyUsageRollup.month,
+                "organization": MonthlyUsageRollup.organization, "finance_code": MonthlyUsageRollup.finance_code}
+
+
+def get_usage_totals(account_ids: Iterable[str] | None, start_month: int, end_month: int,
+                     group_by: str | None = None) -> list[dict]:
+    """Get the gross totals of MonthlyUsage, optionally grouped, from the rollup table.
+
+    :param account_ids: The accounts to include. If None, include all accounts.
+    :param start_month: The month code of the first month to include.
+    :param end_month: The month code of the last month to include.
+    :param group_by: One of the keys of USAGE_GROUPS, or None for a single total.
+    :returns: One dict per group with the group "key", "gross_total_dollar" and "gross_total_pound", ordered by key.
+    """
+    refresh_usage_rollup()
+    key = USAGE_GROUPS[group_by] if group_by else peewee.Value(None)
+    query = (MonthlyUsageRollup
+             .select(key.alias("key"), fn.SUM(MonthlyUsageRollup.gross_total_dollar).alias("gross_total_dollar"),
+                     fn.SUM(MonthlyUsageRollup.gross_total_pound).alias("gross_total_pound"))
+             .where(MonthlyUsageRollup.month.between(start_month, end_month)))
+    if account_ids is not None:
+        query = query.where(MonthlyUsageRollup.account.in_(list(account_ids)))
+    if group_by:
+        query = query.group_by(key).order_by(key)
+    totals = []
+    for row in query.dicts():
+        if row["gross_total_dollar"] is None:
+            continue
+        totals.append({"key": row["key"], "gross_total_dollar": Decimal(str(row["gross_total_dollar"])),
+                       "gross_total_pound": Decimal(str(row["gross_total_pound"]))})
+    return totals
+
+
+def invalidate_recharge_summaries(account_id: str | None, date: datetime.date | None = None):
+    """Remove the stored summaries of any RechargeRequest which are affected by a change to the ledger. All the
+    summaries of an affected request are removed so that they are recalculated together.
+
+    :param account_id: The account whose ledger has changed. If None, summaries are removed for all accounts.
+    :param date: The date of the change. Summaries are removed for requests which end on or after `date`. If None,
+        summaries are removed for all requests.
+    """
+    affected_requests = (RechargeRequestSummary.select(RechargeRequestSummary.recharge_request)
+                         .join(RechargeRequest))
+    if account_id is not None:
+        affected_requests = affected_requests.where(RechargeRequestSummary.account == account_id)
+    if date is not None:
+        affected_requests = affected_requests.where(RechargeRequest.end_date >= date)
+    (RechargeRequestSummary.delete()
+     .where(RechargeRequestSummary.recharge_request.in_(affected_requests))
+     .execute())
+
+
+def init_database(location: str | None = None):
+    """Bind the models to the database and bring its schema up to date. Must be called before the models are used.
+    Connection settings, including enabling foreign key constraints, are described in aam.database.
+
+    :param location: The path to the database file. Defaults to 'db_location' in config.yaml.
+    """
+    import aam.migrations
+
+    if location is None:
+        location = CONFIG["db_location"]
+    db.initialize(aam.database.create_database(location, CONFIG.get("database")))
+    aam.migrations.run_migrations()
+    if create_default_charge_rules():
+        ledger_changed(None)
@@ -0,0 +1,130 @@
+"""Synchronise the accounts in the database with the accounts in the configured AWS Organizations."""
+import concurrent.futures
+import datetime
+import time
+from typing import Callable
+
+import aam.aws
+from aam.config import CONFIG
+from aam.models import Account, LastAccountUpdate, Organization, backfill_ledger, db, reference_data_changed
+
+# The default number of organizations fetched from AWS at the same time.
+DEFAULT_MAX_WORKERS = 4
+
+
+def fetch_organization_accounts(org_id: str,
+                                fetch: Callable[[str], list[dict]] = aam.aws.get_organization_accounts) -> dict:
+    """Get the accounts in an organization from AWS, recording how long it took and any error.
+    This does not touch the database so it is safe to run in a worker thread.
+
+    :param org_id: The id of the AWS Organization.
+    :param fetch: The function used to get the list of accounts for an organization.
+    :returns: A dict with the keys "organization", "accounts", "error" and "fetch_seconds".
+    """
+    start = time.perf_counter()
+    result = {"organization": org_id, "accounts": None, "error": None}
+    try:
+        accounts = fetch(org_id)
+        result["accounts"] = [account for account in accounts if "SBSL" not in account["Name"]]
+        if not result["accounts"]:
+            result["error"] = "No accounts found in organization. This is probably a permissions error."
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["fetch_seconds"] = time.perf_counter() - start
+    return result
+
+
+def fetch_all_organization_accounts(
+        org_ids: list[str], max_workers: int | None = None,
+        fetch: Callable[[str], list[dict]] = aam.aws.get_organization_accounts) -> list[dict]:
+    """Get the accounts of several organizations from AWS in parallel on a bounded thread pool.
+
+    :param org_ids: The ids of the AWS Organizations to fetch.
+    :param max_workers: The maximum number of organizations to fetch at once. Defaults to 'sync_max_workers' in
+        config.yaml.
+    :param fetch: The function used to get the list of accounts for an organization.
+    :returns: One result from fetch_organization_accounts for each organization, in the order of org_ids.
+    """
+    if not org_ids:
+        return []
+    if max_workers is None:
+        max_workers = CONFIG.get("sync_max_workers", DEFAULT_MAX_WORKERS)
+    max_workers = max(1, min(max_workers, len(org_ids)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aam_sync") as executor:
+        return list(executor.map(lambda org_id: fetch_organization_accounts(org_id, fetch), org_ids))
+
+
+def apply_organization_accounts(org_id: str, account_info: list[dict]) -> dict:
+    """Update the database with the list of accounts in an organization.
+    Accounts in the database which are not in account_info are marked as closed, new accounts are added.
+
+    :param org_id: The id of the AWS Organization.
+    :param account_info: The accounts in the organization as returned by the AWS Organizations ListAccounts call.
+    :returns: The number of accounts "added" and "updated".
+    """
+    account_info = {account["Id"]: account for account in account_info}
+    result = {"added": 0, "updated": 0}
+
+    with db.atomic():
+        organization = Organization.get_or_create(id=org_id)[0]
+
+        # Loop through all accounts in DB checking against data from AWS updating as necessary.
+        db_accounts = {account.id: account for account in Account.select().where(Account.organization == org_id)}
+        # Fields are only assigned when their value changes as peewee treats any assignment as a change.
+        for account_id, account in db_accounts.items():
+            if account_id not in account_info:
+                status = "Closed"
+            else:
+                status = account_info[account_id]["Status"]
+            if account.status != status:
+                account.status = status
+            if account.organization_id is None:
+                account.organization = organization.id
+            if account.is_dirty():
+                result["updated"] += 1
+                account.save()
+
+        # Loop through all account in AWS data, adding any that are not in the DB to the DB
+        new_account_ids = []
+        for account_id, account_details in account_info.items():
+            if account_id not in db_accounts:
+                Account.create(id=account_details["Id"], name=account_details["Name"], email=account_details["Email"],
+                               status=account_details["Status"], organization=organization.id)
+                new_account_ids.append(account_id)
+        backfill_ledger(new_account_ids)
+        result["added"] = len(new_account_ids)
+        reference_data_changed()
+
+        last_updated = LastAccountUpdate.get_or_create(organization=org_id)[0]
+        last_updated.time = datetime.datetime.now()
+        last_updated.save()
+    return result
+
+
+def sync_organizations(org_ids: list[str] | None = None, max_workers: int | None = None,
+                       fetch: Callable[[str], list[dict]] = aam.aws.get_organization_accounts) -> list[dict]:
+    """Fetch the accounts of several organizations from AWS in parallel, then apply them to the database one
+    organization at a time from the calling thread.
+
+    :param org_ids: The ids of the AWS Organizations to sync. If None, all organizations in
+        'organization_list_role_arns' in config.yaml are synced.
+    :param max_workers: The maximum number of organizations to fetch at once.
+    :param fetch: The function used to get the list of accounts for an organization.
+    :returns: One dict per organization with the keys "organization", "accounts", "error", "fetch_seconds",
+        "apply_seconds", "added" and "updated".
+    """
+    if org_ids is None:
+        org_ids = list(CONFIG["organization_list_role_arns"])
+
+    results = fetch_all_organization_accounts(org_ids, max_workers, fetch)
+    for result in results:
+        result.update({"added": 0, "updated": 0, "apply_seconds": 0})
+        if result["error"]:
+            continue
+        start = time.perf_counter()
+        try:
+            result.update(apply_organization_accounts(result["organization"], result["accounts"]))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["apply_seconds"] = time.perf_counter() - start
+    return results
@@ -6,7 +6,9 @@ from nicegui import ui
 from peewee import JOIN, fn
 
 import aam.utilities
-from aam.models import Account, Person, Sysadmin, Organization, Transaction, TRANSACTION_TYPES
+import aam.ui.widgets
+from aam.models import Account, Person, Sysadmin, Organization, Transaction, TRANSACTION_TYPES, get_balances, \
+    backfill_ledger, get_person_names
 from aam.ui.notes import UIAccountNotes
 
 if TYPE_CHECKING:
@@ -52,9 +54,9 @@ class UIAccountDetails:
                             ui.label("Sysadmin email:")
                             self.sysadmin_email = ui.label("")
                             ui.label("Creation date")
-                            self.account_creation_input = aam.utilities.date_picker()
+                            self.account_creation_input = aam.ui.widgets.date_picker()
                             ui.label("Closure date")
-                            self.account_closure_input = aam.utilities.date_picker()
+                            self.account_closure_input = aam.ui.widgets.date_picker()
                         with ui.column().classes("items-end w-full"):
                             self.save_changes = ui.button("Save Changes", on_click=self.save_account_changes)
                     with ui.column().classes('w-1/3'):
@@ -80,7 +82,7 @@ class UIAccountDetails:
                 })
                 self.refresh_list_button = ui.button("Refresh account list", on_click=self.populate_account_list)
 
-        all_people = {person.id: person.full_name for person in Person.select()}
+        all_people = get_person_names()
         self.budget_holder.set_options(all_people)
         self.sysadmin.set_options(all_people)
 
@@ -100,13 +102,14 @@ class UIAccountDetails:
                               .group_by(Account.id)
                               ).dicts()
         last_recharge_date = {row['id']: row['date'] for row in last_recharge_date}
+        balances = get_balances(None, datetime.date.today())
 
         for account in accounts:
             details = ({"id": account.id, "name": account.name, "organization": account.organization.name,
                         "status": account.status, "opened_date": account.creation_date,
                         "closure_date": account.closure_date, "finance_code": account.finance_code,
                         "task_code": account.task_code, "is_recharged": account.is_recharged,
-                        "balance": account.get_balance(datetime.date.today())})
+                        "balance": balances.get(account.id, 0)})
             if account.budget_holder:
                 details["budget_holder"] = f"{account.budget_holder.first_name} {account.budget_holder.last_name}"
             if account.id in last_recharge_date:
@@ -162,7 +165,8 @@ class UIAccountDetails:
         account.task_code = self.task_code.value
 
         account.save()
-        self.parent.transactions.update_transaction_grid()
+        backfill_ledger([account.id])
+        self.parent.update_transaction_grid()
 
     def update_sysadmin_email(self, event: nicegui.events.ValueChangeEventArguments):
         selected_person = event.sender.value
@@ -1,5 +1,3 @@
-import asyncio
-import datetime
 from typing import TYPE_CHECKING
 
 import nicegui.events
@@ -7,7 +5,10 @@ from nicegui import ui, ElementFilter
 from peewee import JOIN
 
 import aam.aws
-from aam.models import Account, LastAccountUpdate, Organization, Person
+import aam.data_quality
+import aam.database
+import aam.sync
+from aam.models import Account, LastAccountUpdate, Person, db, get_account_summaries, get_organization_names
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -28,6 +29,7 @@ class UIAccountSelect:
             self.show_suspended = ui.checkbox(on_change=self.update_account_select_options)
         with ui.column():
             self.update_button = ui.button("Update Account Info", on_click=self.update_account_info)
+            self.sync_all_button = ui.button("Sync All Organizations", on_click=self.sync_all_organizations)
             self.last_updated = ui.label()
         with ui.column():
             self.dark_mode_button = ui.button(icon='dark_mode', on_click=self.handle_theme_change)
@@ -37,8 +39,7 @@ class UIAccountSelect:
         self.update_account_select_options()
 
     def update_organization_select_options(self):
-        orgs = Organization.select()
-        orgs = {org.id: f"{org.name} ({org.id})" for org in orgs}
+        orgs = {org_id: f"{name} ({org_id})" for org_id, name in get_organization_names().items()}
         self.organization_select.set_options(orgs)
 
     def update_account_select_options(self):
@@ -51,12 +52,11 @@ class UIAccountSelect:
         if self.show_suspended.value is True:
             valid_status.append("SUSPENDED")
 
-        accounts = sorted(list(Account.select().where(Account.organization == organization_id)),
-                          key=lambda item: item.name)
+        accounts = get_account_summaries(organization_id) if organization_id else []
 
         account_items = {None: "No account selected"}
-        account_items.update({account.id: f"{account.name} ({account.id}) - {account.status}"
-                              for account in accounts if account.status in valid_status})
+        account_items.update({account["id"]: f"{account['name']} ({account['id']}) - {account['status']}"
+                              for account in accounts if account["status"] in valid_status})
         self.account_select.set_options(account_items)
 
     def organization_selected(self, event: nicegui.events.ValueChangeEventArguments):
@@ -77,7 +77,8 @@ class UIAccountSelect:
 
             self.parent.account_details.update(account)
             self.parent.set_selected_account_id(account)
-            self.parent.transactions.initialize(account)
+            if self.parent.transactions is not None:
+                self.parent.transactions.initialize(account)
             self.parent.account_details.notes.update_note_grid()
 
     async def update_account_info(self):
@@ -89,11 +90,27 @@ class UIAccountSelect:
         with ui.dialog() as loadingDialog:
             ui.spinner(size='10em', color='black')
         loadingDialog.open()
-        await asyncio.to_thread(get_and_process_account_info, self.organization_select.value)
+        results = await aam.database.run_in_thread(db, aam.sync.sync_organizations, [selected_organization])
+        if results[0]["error"]:
+            ui.notify(results[0]["error"])
+        aam.data_quality.schedule_snapshot()
         self.update_last_updated_label(self.organization_select.value)
         self.update_account_select_options()
         loadingDialog.close()
 
+    async def sync_all_organizations(self):
+        with ui.dialog() as loadingDialog:
+            ui.spinner(size='10em', color='black')
+        loadingDialog.open()
+        results = await aam.database.run_in_thread(db, aam.sync.sync_organizations)
+        loadingDialog.close()
+        aam.data_quality.schedule_snapshot()
+
+        self.update_organization_select_options()
+        self.update_last_updated_label(self.organization_select.value)
+        self.update_account_select_options()
+        UISyncResultsDialog(results).open()
+
     def update_last_updated_label(self, organization_id: str | None):
         if not organization_id:
             text = "None"
@@ -125,33 +142,39 @@ class UIAccountSelect:
             grid.classes(toggle='ag-theme-balham-dark ag-theme-balham')
 
 
-def get_and_process_account_info(org_id: str):
-
-    organization = Organization.get_or_create(id=org_id)[0]
 
-    account_info = aam.aws.get_organization_accounts(org_id)
-    account_info = {account["Id"]: account for account in account_info if "SBSL" not in account["Name"]}
-
-    if not account_info:
-        ui.notify("No accounts found in organization. This is probably a permissions error.")
-        return 0
-
-    # Loop through all accounts in DB checking against data from AWS updating as necessary.
-    db_accounts = {account.id: account for account in Account.select().where(Account.organization==org_id)}
-    for account_id, account in db_accounts.items():
-        if account_id not in account_info:
-            account.status = "Closed"
-        else:
-            account.status = account_info[account_id]["Status"]
-        if account.organization is None:
-            account.organization = organization.id
-        account.save()
-
-    # Loop through all account in AWS data, adding any that are not in the DB to the DB
-    for account_id, account_details in account_info.items():
-        if account_id not in db_accounts:
-            Account.create(id=account_details["Id"], name=account_details["Name"], email=account_details["Email"], status=account_details["Status"], organization=organization.id)
-
-    last_updated = LastAccountUpdate.get_or_create(organization=org_id)[0]
-    last_updated.time=datetime.datetime.now()
-    last_updated.save()
+class UISyncResultsDialog:
+    """Dialog box showing the accounts added, time taken and any error for each synced organization."""
+
+    def __init__(self, results: list[dict]):
+        num_failed = sum(1 for result in results if result["error"])
+        with ui.dialog() as self.dialog:
+            with ui.card().classes("min-w-[900px]"):
+                ui.label("Organization sync results").classes("text-2xl")
+                ui.label(f"{len(results) - num_failed} organizations synced, {num_failed} failed.")
+                timing_stats = aam.aws.get_timing_stats()
+                ui.label(", ".join(f"{key} AWS calls: {stats['calls']} (mean {stats['mean_seconds'] or 0:.2f} s)"
+                                   for key, stats in timing_stats.items()).capitalize())
+                ui.aggrid({
+                    'theme': 'balham',
+                    'defaultColDef': {"suppressMovable": True},
+                    'columnDefs': [{"headerName": "Organization", "field": "organization", "sort": "asc"},
+                                   {"headerName": "Accounts", "field": "num_accounts"},
+                                   {"headerName": "Added", "field": "added"},
+                                   {"headerName": "Updated", "field": "updated"},
+                                   {"headerName": "Fetch Time (s)", "field": "fetch_seconds"},
+                                   {"headerName": "Apply Time (s)", "field": "apply_seconds"},
+                                   {"headerName": "Error", "field": "error", "flex": 1, "wrapText": True,
+                                    "autoHeight": True}],
+                    'rowData': [{"organization": result["organization"],
+                                 "num_accounts": len(result["accounts"]) if result["accounts"] is not None else None,
+                                 "added": result["added"],
+                                 "updated": result["updated"],
+                                 "fetch_seconds": round(result["fetch_seconds"], 2),
+                                 "apply_seconds": round(result["apply_seconds"], 2),
+                                 "error": result["error"]} for result in results],
+                })
+                ui.button("Close", on_click=self.dialog.close)
+
+    def open(self):
+        self.dialog.open()
@@ -1,11 +1,11 @@
-import datetime
-from typing import TYPE_CHECKING, Iterable
+from typing import TYPE_CHECKING
 
 import nicegui.events
 from nicegui import ui
 
-from aam.models import Account, Organization, MonthlyUsage, Transaction, TRANSACTION_TYPES
+import aam.data_quality
 import aam.utilities
+from aam.models import MonthlyUsage
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -15,6 +15,11 @@ class UIDataQuality:
     def __init__(self, parent: "UIMainForm"):
         self.parent = parent
 
+        with ui.row().classes("items-center"):
+            self.selected_organization_only = ui.switch("Only show the selected organization",
+                                                        on_change=self.show_latest_snapshot)
+            self.computed_at_label = ui.label()
+            self.recompute_button = ui.button("Recompute", on_click=self.recompute)
         with ui.tabs().props("align left").classes('w-full') as tabs:
             tab_one = ui.tab("Account Dates")
             tab_two = ui.tab("Monthly Usage")
@@ -32,7 +37,6 @@ class UIDataQuality:
                                        {"headerName": "Organization", "field": "organization_name"}
                                        ],
                         'rowData': {}})
-                    ui.button("Refresh list", on_click=self.populate_no_open_grid)
 
                     ui.label("Closed/Suspended accounts with no close date")
                     self.no_close_grid = ui.aggrid({
@@ -43,7 +47,6 @@ class UIDataQuality:
                                        {"headerName": "Account Status", "field": "account_status"}
                                        ],
                         'rowData': {}})
-                    ui.button("Refresh list", on_click=self.populate_no_close_grid)
 
             with ui.tab_panel(tab_two):
                 with ui.column().classes('w-full no-wrap'):
@@ -59,7 +62,6 @@ class UIDataQuality:
                                        ],
                         'rowSelection': 'multiple',
                         'rowData': {}})
-                    ui.button("Refresh list", on_click=self.populate_missing_usage_grid)
 
                     ui.label("Accounts with Monthly Usage outside of open/close dates").classes("text-2xl")
                     self.wrong_monthly_usage = ui.aggrid({
@@ -74,7 +76,6 @@ class UIDataQuality:
                         'rowSelection': 'multiple',
                         'rowData': {}})
                     with ui.row():
-                        ui.button("Refresh list", on_click=self.populate_wrong_monthly_usage)
                         ui.button("Delete selected months", on_click=self.delete_selected_monthly_usage)
 
             with ui.tab_panel(tab_three):
@@ -89,85 +90,44 @@ class UIDataQuality:
                                        ],
                         'rowSelection': 'multiple',
                         'rowData': {}})
-                    ui.button("Refresh list", on_click=self.populate_recharges_missing_code_grid)
-
-            self.populate_no_open_grid()
-            self.populate_no_close_grid()
-            self.populate_recharges_missing_code_grid()
-
-    def populate_no_open_grid(self):
-        accounts = (Account.select()
-                    .join(Organization)
-                    .where(Account.creation_date.is_null(True)))
-        account_details = [{"account_name": account.name, "organization_name": account.organization.name}
-                           for account in accounts]
-        self.no_open_grid.options["rowData"] = account_details
-        self.no_open_grid.update()
-
-    def populate_no_close_grid(self):
-        account_status = ["Closed", "SUSPENDED"]
-        accounts = (Account.select()
-                    .join(Organization)
-                    .where((Account.status.in_(account_status) & Account.closure_date.is_null(True))))
-        account_details = [{"account_name": account.name, "organization_name": account.organization.name,
-                            "account_status": account.status} for account in accounts]
-        self.no_close_grid.options["rowData"] = account_details
-        self.no_close_grid.update()
-
-    def populate_recharges_missing_code_grid(self):
-        transactions: Iterable[Transaction] = (Transaction.select(Transaction, Account.name, Account.id)
-                                               .join(Account)
-                                               .where((Transaction.type == TRANSACTION_TYPES.index("Recharge")) & (Transaction.project_code.is_null())))
-        transaction_details = [{"account_name": transaction.account.name, "account_id": transaction.account_id,
-                                "transaction_date": transaction.date} for transaction in transactions]
-        self.recharges_missing_code_grid.options["rowData"] = transaction_details
-        self.recharges_missing_code_grid.update()
-
-    def populate_missing_usage_grid(self):
-        accounts: Iterable[Account] = (Account.select(Account, Organization.name).join(Organization))
-        account_summaries = []
-        for account in accounts:
-            if account.creation_date:
-                required_months = aam.utilities.get_months_between(account.creation_date, account.final_date)
-                # Check that all empty months have been generated for the account
-                account.check_missing_monthly_transactions(required_months)
-                # Remove current month as we don't care that current month is not populated
-                current_month = [aam.utilities.month_code(datetime.date.today().year, datetime.date.today().month)]
-                required_months = set(required_months) - set(current_month)
-                missing_usage_months: Iterable[MonthlyUsage] = (MonthlyUsage.select()
-                                                                .where((MonthlyUsage.account_id == account.id)
-                                                                       & (MonthlyUsage.month_id.in_(required_months))
-                                                                       & (MonthlyUsage.amount.is_null(True)))
-                                        )
-                num_months = len(list(missing_usage_months))
-                if num_months > 0:
-                    missing_months = ", ".join([month.date.strftime("%b-%Y") for month in missing_usage_months])
-                    account_summaries.append({"account_name": account.name, "account_id": account.id,
-                                              "organization_name": account.organization.name,
-                                              "num_months": num_months, "missing_months": missing_months})
-
-        self.missing_usage.options["rowData"] = account_summaries
-        self.missing_usage.update()
-
-    def populate_wrong_monthly_usage(self):
-        """Remove any MonthlyUsage transactions which fall before the opening date or after the closing date of an
-        account."""
-        all_usage: Iterable[MonthlyUsage] = MonthlyUsage.select(MonthlyUsage, Account).join(Account)
-        usage_details = []
-        for usage in all_usage:
-            account: Account = usage.account
-            if not account.creation_date:
-                pass
-            start_month = aam.utilities.month_code(account.creation_date.year, account.creation_date.month)
-            if account.closure_date:
-                end_month = aam.utilities.month_code(account.closure_date.year, account.closure_date.month)
-            else:
-                end_month = aam.utilities.month_code(datetime.date.today().year, datetime.date.today().month)
-            if usage.month_id < start_month or usage.month_id > end_month:
-                usage_details.append({"id": usage.id, "account_name": usage.account.name,
-                                      "account_id": usage.account.id, "date": usage.date, "usage": usage.amount})
-        self.wrong_monthly_usage.options["rowData"] = usage_details
-        self.wrong_monthly_usage.update()
+
+        self.show_latest_snapshot()
+
+    @property
+    def organization_id(self) -> str | None:
+        """The organization to show, or None to show all organizations."""
+        if self.selected_organization_only.value:
+            return self.parent.get_selected_organization_id()
+        return None
+
+    def show_latest_snapshot(self):
+        """Show the results of the most recent data quality snapshot, which are computed in the background."""
+        snapshot = aam.data_quality.get_latest_snapshot()
+        if snapshot is None:
+            self.computed_at_label.set_text("The checks have not been run yet.")
+            results = {name: [] for name in aam.data_quality.CHECKS}
+        else:
+            self.computed_at_label.set_text(f"Computed at {snapshot.computed_at:%d/%m/%Y %H:%M}")
+            results = aam.data_quality.get_snapshot_results(snapshot, self.organization_id)
+
+        for summary in results["missing_usage"]:
+            summary["missing_months"] = ", ".join(aam.utilities.date_from_month_code(month_code).strftime("%b-%Y")
+                                                  for month_code in summary["missing_months"])
+        for grid, name in [(self.no_open_grid, "no_creation_date"), (self.no_close_grid, "no_closure_date"),
+                           (self.missing_usage, "missing_usage"),
+                           (self.wrong_monthly_usage, "usage_outside_account_dates"),
+                           (self.recharges_missing_code_grid, "recharges_missing_project_code")]:
+            grid.options["rowData"] = results[name]
+            grid.update()
+
+    async def recompute(self):
+        """Run the checks again in a worker thread and show the new results."""
+        self.recompute_button.disable()
+        try:
+            await aam.data_quality.refresh_snapshot()
+        finally:
+            self.recompute_button.enable()
+        self.show_latest_snapshot()
 
     async def delete_selected_monthly_usage(self, event: nicegui.events.ClickEventArguments):
         selected_rows = await(self.wrong_monthly_usage.get_selected_rows())
@@ -177,5 +137,5 @@ class UIDataQuality:
         monthly_usage_ids = [row["id"] for row in selected_rows]
         query = MonthlyUsage.delete().where(MonthlyUsage.id.in_(monthly_usage_ids))
         rows_deleted = query.execute()
-        self.populate_wrong_monthly_usage()
         ui.notify(f"{rows_deleted} rows deleted")
+        await self.recompute()
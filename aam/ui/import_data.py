@@ -1,13 +1,15 @@
 import datetime
 import decimal
 from typing import TYPE_CHECKING
-import re
 
 import nicegui.events
 from nicegui import ui
 
-import aam.utilities
-from aam.models import Account, Month, Person, Sysadmin, MonthlyUsage, TRANSACTION_TYPES, Transaction
+import aam.data_quality
+import aam.importers
+import aam.ui.widgets
+from aam.models import (Account, Person, Sysadmin, TRANSACTION_TYPES, Transaction, backfill_ledger,
+                        reference_data_changed, upsert_monthly_usage)
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -20,7 +22,7 @@ class UIImport:
         self.import_type = ui.select({1: "Monthly Usage - One month, multiple account", 2:"Monthly usage - One account, multiple months", 3:"Exchange Rate", 4:"Account Details", 5: "Transactions"},
                                      label="Import Type", value=1, on_change=self.import_type_selected)
         self.description = ui.label("").style('white-space: pre-wrap')
-        self.date_select = aam.utilities.MonthYearPicker()
+        self.date_select = aam.ui.widgets.MonthYearPicker()
         self.import_textbox = ui.textarea("Raw data").classes("w-1/2")
         self.import_button = ui.button("Import data", on_click=self.import_data)
 
@@ -73,35 +75,21 @@ class UIImport:
             self.import_account_details(data)
         elif import_type == 5:
             self.import_transactions(data)
+        # The imported data may have fixed or caused data quality problems.
+        aam.data_quality.schedule_snapshot()
 
     def import_exchange_rate(self, data: str):
-        data = data.split("\n")
-
-        for index, line in enumerate(data):
-            line = line.replace(" ", "")
-            line = line.split(",")
-            date = datetime.datetime.strptime(line[0], "%b-%y").date()
-            try:
-                exchange_rate = decimal.Decimal(line[1])
-            except decimal.InvalidOperation:
-                ui.notify(f"Malformed exchange rate on line {index}")
-                return 0
-            month_code = aam.utilities.month_code(date.year, date.month)
-            month = Month.get_or_none(month_code=month_code)
-            if month is None:
-                Month.create(month_code=month_code, exchange_rate=exchange_rate)
-            month.exchange_rate = exchange_rate
-            month.save()
-        self.parent.settings.ui_exchange_rate.populate_exchange_rate_grid()
+        try:
+            exchange_rates = aam.importers.parse_exchange_rates(data)
+        except aam.importers.DataImportError as e:
+            ui.notify(str(e))
+            return 0
+        aam.importers.set_exchange_rates(exchange_rates)
+        if self.parent.settings is not None:
+            self.parent.settings.ui_exchange_rate.populate_exchange_rate_grid()
         ui.notify("Exchange rates imported.")
 
     def import_month_usage(self, data: str):
-        data = data.split("\n")
-
-        valid_account_numbers = [account.id for account in Account.select(Account.id)]
-
-        processed_lines = []
-
         if not self.date_select.month:
             ui.notify("Must select month.")
             return 0
@@ -110,134 +98,33 @@ class UIImport:
             ui.notify("Must select year.")
             return 0
 
-        # Check data validity
-        # Assumes account number is first field and amount is last field. Optional account name inbetween.
-        for index, line in enumerate(data):
-            # Remove all spaces
-            line = line.replace(" ", "")
-            # Remove any trailing commas
-            line = line.rstrip(",")
-            # If the line is blank then skip it
-            if line == "":
-                continue
-            # Remove dollar signs
-            line = line.replace("$", "")
-            # Remove any thousand or million separators in usage amount
-            line = re.sub("\d,(?=\d{3})", "", line)
-            # Any other commas are now delimiters so replace them with tabs
-            line = line.replace(",", "\t")
-            # Split the line by field seperator
-            line = line.split("\t")
-            # No usage can be represented by a dash
-            line[-1] = line[-1].replace("-", "0")
-            if len(line) not in [2, 3]:
-                ui.notify(f"Malformed data on line {index} - wrong number of fields.")
-                return 0
-            if len(line[0]) != 12:
-                ui.notify(f"Malformed account number on line {index + 1} - must be 12 characters")
-                return 0
-            if line[0] not in valid_account_numbers:
-                ui.notify(f"Account number {line[0]} at line {index + 1} not found in database.")
-                return 0
-            try:
-                decimal.Decimal(line[-1])
-            except decimal.InvalidOperation:
-                ui.notify(f"Malformed usage amount on line {index + 1} - unable to convert to Decimal")
-                return 0
-            processed_lines.append(line)
+        try:
+            amounts = aam.importers.parse_month_usage(data, self.date_select.month_code)
+        except aam.importers.DataImportError as e:
+            ui.notify(str(e))
+            return 0
         ui.notify("Data is valid.")
 
-        month_code = self.date_select.month_code
+        result = upsert_monthly_usage(amounts)
 
-        for line in processed_lines:
-            usage = MonthlyUsage.get_or_none(account=line[0], month=month_code)
-            if usage:
-                usage.amount = decimal.Decimal(line[-1])
-                usage.save()
-            else:
-                MonthlyUsage.create(account=line[0], month=month_code, amount=decimal.Decimal(line[-1]),
-                                    date=aam.utilities.date_from_month_code(month_code))
-
-        self.parent.transactions.update_transaction_grid()
-        ui.notify("Monthly Usage added to accounts.")
+        self.parent.update_transaction_grid()
+        ui.notify(f"Monthly Usage added to accounts. {result['inserted']} inserted, {result['updated']} updated, "
+                  f"{result['unchanged']} unchanged.")
 
     def import_account_monthly_usage(self, data: str):
         """Import multiple months of data for one or more accounts."""
-        data = data.split("\n")
-
-        valid_account_numbers = [account.id for account in Account.select(Account.id)]
-
-        account_numbers = data.pop(0).split("\t")
-        num_columns = len(account_numbers)
-
-        # Go through the account numbers checking their validity
-        # Skip the first value as it is a label
-        for index in range(1, len(account_numbers)):
-            account_number = account_numbers[index]
-            if len(account_number) != 12:
-                ui.notify(f"Malformed account number '{account_number}', on line 1, column {index + 2} - must be 12 digits")
-                return 0
-            if account_number not in valid_account_numbers:
-                ui.notify(f"Account number '{account_number}' at line 1, column {index + 2} not found in database.")
-                return 0
-
-        # Check all lines for validity before adding anything to the database.
-        processed_lines = []
-        for line_number, line in enumerate(data):
-            # Ignore any blank lines
-            if not line:
-                continue
-            # Remove any dollar symbols
-            line = line.replace("$", "")
-            # Remove any thousands comma delimiters
-            line = line.replace(",", "")
-            # Split line
-            line = line.split("\t")
-            # Check that the number of values in the line matches the number of columns in the header
-            if len(line) != num_columns:
-                ui.notify(f"Number of columns in line: {line_number + 2} does not match number of columns in header line.")
-                return 0
-            # Check that the date in the first column can be parsed
-            try:
-                datetime.datetime.strptime(line[0], "%b-%y").date()
-            except ValueError:
-                ui.notify(f"Malformed date on line {line_number + 2}")
-                return 0
-            # Go through the values in the row checking they can be parsed as numbers
-            for column_index in range(1, num_columns):
-                if line[column_index] != "-":
-                    try:
-                        decimal.Decimal(line[column_index])
-                    except decimal.InvalidOperation:
-                        ui.notify(f"Malformed amount '{line[column_index]}' on line {line_number + 2}, column {column_index + 1}")
-                        return 0
-            processed_lines.append(line)
-
-        for line in processed_lines:
-            date = datetime.datetime.strptime(line[0], "%b-%y").date()
-            month_code = aam.utilities.month_code(date.year, date.month)
-            for column_index in range(1, num_columns):
-                account_number = account_numbers[column_index]
-                # Skip if usage is a hyphen as this indicates that the account was not open at that time
-                if line[column_index] == "-":
-                    continue
-                amount = decimal.Decimal(line[column_index])
-                # AWS data from the API comes as gross totals while the breakdowns from Strategic Blue are net.
-                if date < datetime.date(2024, 7, 1):
-                    amount = (amount / decimal.Decimal(1.2))
-
-                usage = MonthlyUsage.get_or_none(account=account_number, month=month_code)
+        try:
+            amounts = aam.importers.parse_account_monthly_usage(data)
+        except aam.importers.DataImportError as e:
+            ui.notify(str(e))
+            return 0
+        result = upsert_monthly_usage(amounts)
 
-                if not usage:
-                    MonthlyUsage.create(account=account_number, month=month_code, amount=amount,
-                                        date=aam.utilities.date_from_month_code(month_code))
-                else:
-                    usage.amount = amount
-                    usage.save()
         # If the account being imported to is currently visible then update the transactions grid.
-        if self.parent.get_selected_account_id() in account_numbers:
-            self.parent.transactions.update_transaction_grid()
-        ui.notify("Monthly Usage added.")
+        if self.parent.get_selected_account_id() in {account_id for account_id, _ in amounts}:
+            self.parent.update_transaction_grid()
+        ui.notify(f"Monthly Usage added. {result['inserted']} inserted, {result['updated']} updated, "
+                  f"{result['unchanged']} unchanged.")
 
     @staticmethod
     def import_account_details(data: str):
@@ -292,6 +179,8 @@ class UIImport:
                 Sysadmin.create(account=account_id, person=sysadmin.id)
 
             account.save()
+        reference_data_changed()
+        backfill_ledger([line[0] for line in processed_lines])
         ui.notify("Account details imported.")
 
     # noinspection PyTypeChecker
@@ -331,5 +220,5 @@ class UIImport:
             Transaction.create(account=account_id, date=line[1], amount=line[7], type=transaction_type,  is_pound=True, note=line[4],
                                reference=line[0], project_code=line[5], task_code=line[6])
 
-        self.parent.transactions.update_transaction_grid()
+        self.parent.update_transaction_grid()
         ui.notify("Transactions added.")
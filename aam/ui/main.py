@@ -1,7 +1,9 @@
 from typing import Optional
 
+import nicegui.events
 from nicegui import ui
 
+from aam.config import CONFIG
 from aam.models import Account
 from aam.ui.account_details import UIAccountDetails
 from aam.ui.account_select import UIAccountSelect
@@ -14,6 +16,10 @@ from aam.ui.statistics import UIStatistics
 from aam.ui.transactions import UITransactions
 
 
+# Whether tab panels stay built, and are kept up to date, after the user moves to another tab.
+DEFAULT_KEEP_TABS_WARM = True
+
+
 class UIMainForm:
     def __init__(self):
         ui.page_title("AWS Account Manager")
@@ -23,6 +29,17 @@ class UIMainForm:
         # Represents the ID of the account currently selected in the UIAccountSelect gui element
         self._selected_account_id: Optional[str] = None
 
+        # Only the Account Details panel is built with the page. The other panels are built the first time their tab
+        # is shown, until then their attribute is None.
+        self.transactions: UITransactions | None = None
+        self.shared_charges: UISharedCharges | None = None
+        self.import_data: UIImport | None = None
+        self.data_quality: UIDataQuality | None = None
+        self.stats: UIStatistics | None = None
+        self.people: UIPeople | None = None
+        self.settings: UISettings | None = None
+        self.keep_tabs_warm: bool = CONFIG.get("keep_tabs_warm", DEFAULT_KEEP_TABS_WARM)
+
         with ui.row().classes('w-full place-content-center'):
             self.account_select = UIAccountSelect(self)
         ui.separator()
@@ -39,31 +56,62 @@ class UIMainForm:
                     self.people_tab = ui.tab('People', icon='face')
                     self.settings_tab = ui.tab('Settings', icon='settings')
             with splitter.after:
-                with ui.tab_panels(tabs, value=self.accounts_tab).props('vertical').classes('w-full h-full'):
+                with ui.tab_panels(tabs, value=self.accounts_tab, on_change=self.tab_changed
+                                   ).props('vertical').classes('w-full h-full'):
                     with ui.tab_panel(self.accounts_tab):
                         self.account_details = UIAccountDetails(self)
-                    with ui.tab_panel(self.transactions_tab):
-                        self.transactions = UITransactions(self)
-                    with ui.tab_panel(self.shared_charges_tab):
-                        self.shared_charges = UISharedCharges(self)
-                    with ui.tab_panel(self.import_tab):
-                        self.import_data = UIImport(self)
-                    with ui.tab_panel(self.data_quality_tab):
-                        self.data_quality = UIDataQuality(self)
-                    with ui.tab_panel(self.stats_tab):
-                        self.stats = UIStatistics(self)
-                    with ui.tab_panel(self.people_tab):
-                        self.people = UIPeople(self)
-                    with ui.tab_panel(self.settings_tab):
-                        self.settings = UISettings(self)
+                    # The attribute and class of each lazily built panel, indexed by tab name.
+                    self._lazy_tabs = {"Transactions": ("transactions", UITransactions),
+                                       "Shared Charges": ("shared_charges", UISharedCharges),
+                                       "Import": ("import_data", UIImport),
+                                       "Data Quality": ("data_quality", UIDataQuality),
+                                       "Statistics": ("stats", UIStatistics),
+                                       "People": ("people", UIPeople),
+                                       "Settings": ("settings", UISettings)}
+                    self._lazy_panels = {tab_name: ui.tab_panel(tab_name) for tab_name in self._lazy_tabs}
+                self._current_tab = "Account Details"
 
         # This has to be called after all UI elements are created as it references multiple elements
         self.account_select.select_default_org()
 
+    def tab_changed(self, event: nicegui.events.ValueChangeEventArguments):
+        """Build the panel of the newly shown tab if it has not been built yet. Unless tabs are kept warm, the panel
+        which was hidden is removed so that it is not updated in the background."""
+        if not self.keep_tabs_warm and self._current_tab in self._lazy_tabs:
+            self.clear_tab(self._current_tab)
+        self._current_tab = event.value
+        if event.value in self._lazy_tabs:
+            self.build_tab(event.value)
+
+    def build_tab(self, tab_name: str):
+        """Build the panel of a tab, if it has not been built, and populate it for the current selection."""
+        attribute, panel_class = self._lazy_tabs[tab_name]
+        if getattr(self, attribute) is not None:
+            return
+        with self._lazy_panels[tab_name]:
+            panel = panel_class(self)
+        setattr(self, attribute, panel)
+        # Other panels populate themselves when built, the transactions depend on the selected account.
+        if attribute == "transactions" and self._selected_account_id is not None:
+            panel.update_transaction_grid()
+
+    def clear_tab(self, tab_name: str):
+        attribute, _ = self._lazy_tabs[tab_name]
+        self._lazy_panels[tab_name].clear()
+        setattr(self, attribute, None)
+
+    def update_transaction_grid(self):
+        """Update the transaction grid if the Transactions panel has been built."""
+        if self.transactions is not None:
+            self.transactions.update_transaction_grid()
+
     def set_selected_organization_id(self, org_id: str | None):
         """Setter method for selected_account_id instance attribute."""
         self._selected_organization_id = org_id
-        self.shared_charges.populate_shared_charges_table()
+        if self.shared_charges is not None:
+            self.shared_charges.populate_shared_charges_table()
+        if self.data_quality is not None and self.data_quality.selected_organization_only.value:
+            self.data_quality.show_latest_snapshot()
         self.account_select.update_last_updated_label(org_id)
 
     def get_selected_organization_id(self) -> Optional[str]:
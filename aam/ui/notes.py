@@ -5,6 +5,7 @@ import nicegui.events
 from nicegui import ui
 
 import aam.utilities
+import aam.ui.widgets
 from aam.models import Note
 
 if TYPE_CHECKING:
@@ -144,7 +145,7 @@ class AddNoteDialog:
         with ui.dialog() as self.dialog:
             with ui.card():
                 ui.label("Add Note").classes("text-2xl")
-                self.date = aam.utilities.date_picker(datetime.date.today())
+                self.date = aam.ui.widgets.date_picker(datetime.date.today())
                 self.text = ui.textarea().classes('w-full')
                 with ui.row():
                     ui.button("Save note", on_click=self.save_new_note)
@@ -3,7 +3,7 @@ from typing import TYPE_CHECKING
 from nicegui import ui
 import nicegui.events
 
-from aam.models import Person
+from aam.models import Person, get_person_names
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -51,9 +51,7 @@ class UIPeople:
         ui.notify("Person details updated.")
 
     def populate_select(self):
-        people = sorted(list(Person.select()),key=lambda item: item.first_name)
-        people = {person.id: f"{person.first_name} {person.last_name}" for person in people}
-        self.person_select.set_options(people)
+        self.person_select.set_options(get_person_names())
         
     def show_person_details(self, event: nicegui.events.ValueChangeEventArguments):
         selected_person_id = event.sender.value
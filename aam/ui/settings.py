@@ -1,9 +1,12 @@
+import datetime
+import decimal
 from typing import TYPE_CHECKING, Iterable
 
 from nicegui import ui
 import nicegui.events
 
-from aam.models import Month, Organization, Account
+from aam.models import Month, Organization, Account, ChargeRule, CHARGE_TYPES, TRANSACTION_TYPES, backfill_ledger, \
+    get_organization_names
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -18,6 +21,11 @@ class UISettings:
             ui.label("Exchange Rate").classes("text-xl")
             self.ui_exchange_rate = UIExchangeRate(self)
             ui.separator()
+            ui.label("Charge Rules").classes("text-xl")
+            ui.label("Percentage charges added to the net value of transactions. Where more than one rule applies to "
+                     "a transaction, the rule listed first is used.")
+            self.ui_charge_rules = UIChargeRules(self)
+            ui.separator()
             ui.label("Organizations").classes("text-xl")
             self.ui_organizations = UIOrganizations(self)
             ui.separator()
@@ -57,6 +65,81 @@ class UIExchangeRate:
         month.save()
 
 
+class UIChargeRules:
+    def __init__(self, parent: UISettings):
+        self.parent = parent
+
+        with ui.row().classes('w-full no-wrap'):
+            with ui.row().classes('w-1/2'):
+                self.rule_grid = ui.aggrid({
+                    'theme': 'balham',
+                    "defaultColDef": {"sortable": False},
+                    'columnDefs': [{"headerName": "id", "field": "id", "hide": True},
+                                   {"headerName": "Charge", "field": "charge", "editable": True,
+                                    "cellEditor": 'agSelectCellEditor', "cellEditorParams": {"values": CHARGE_TYPES}},
+                                   {"headerName": "Transaction Type", "field": "transaction_type", "editable": True,
+                                    "cellEditor": 'agSelectCellEditor',
+                                    "cellEditorParams": {"values": TRANSACTION_TYPES}},
+                                   {"headerName": "Rate", "field": "rate", "editable": True},
+                                   {"headerName": "Start Date", "field": "start_date", "editable": True},
+                                   {"headerName": "End Date", "field": "end_date", "editable": True}],
+                    'rowData': {},
+                    'rowSelection': 'single',
+                    'stopEditingWhenCellsLoseFocus': True,
+                })
+            with ui.column():
+                ui.button("Add new rule", on_click=self.add_rule)
+                ui.button("Delete selected rule", on_click=self.delete_rule)
+
+        self.rule_grid.on("cellValueChanged", self.update_rule)
+        self.populate_rule_grid()
+
+    def populate_rule_grid(self):
+        rules: Iterable[ChargeRule] = ChargeRule.select().order_by(ChargeRule.id)
+        self.rule_grid.options["rowData"] = [rule.to_json() for rule in rules]
+        self.rule_grid.update()
+
+    def update_rule(self, event: nicegui.events.GenericEventArguments):
+        # Only change db as a result of callbacks triggered by user, otherwise we can get stuck in a loop.
+        if "source" not in event.args:
+            return 0
+
+        rule: ChargeRule = ChargeRule.get(ChargeRule.id == event.args["data"]["id"])
+        cell_edited = event.args["colId"]
+        value = event.args["data"][cell_edited]
+        try:
+            if cell_edited == "charge":
+                rule.charge = value
+            elif cell_edited == "transaction_type":
+                rule.transaction_type = TRANSACTION_TYPES.index(value)
+            elif cell_edited == "rate":
+                rule.rate = decimal.Decimal(value)
+            elif cell_edited in ["start_date", "end_date"]:
+                setattr(rule, cell_edited, datetime.date.fromisoformat(value) if value else None)
+        except (decimal.InvalidOperation, ValueError):
+            ui.notify(f"Invalid value '{value}' for {cell_edited}.")
+            self.populate_rule_grid()
+            return 0
+        rule.save()
+        self.parent.parent.update_transaction_grid()
+        ui.notify("Charge rule updated.")
+
+    def add_rule(self, _event: nicegui.events.ClickEventArguments):
+        ChargeRule.create(charge=CHARGE_TYPES[0], transaction_type=TRANSACTION_TYPES.index("Monthly Usage"),
+                          rate=0)
+        self.populate_rule_grid()
+
+    async def delete_rule(self, _event: nicegui.events.ClickEventArguments):
+        selected_rule = await(self.rule_grid.get_selected_row())
+        if selected_rule:
+            ChargeRule.get(ChargeRule.id == selected_rule["id"]).delete_instance()
+            self.populate_rule_grid()
+            self.parent.parent.update_transaction_grid()
+            ui.notify("Charge rule deleted.")
+        else:
+            ui.notify("No charge rule selected to delete.")
+
+
 class UIOrganizations:
     def __init__(self, parent: UISettings):
         self.parent = parent
@@ -81,8 +164,7 @@ class UIOrganizations:
         self.populate_org_grid()
 
     def populate_org_grid(self):
-        orgs = Organization.select()
-        org_details = [{"id": org.id, "name": org.name} for org in orgs]
+        org_details = [{"id": org_id, "name": name} for org_id, name in get_organization_names().items()]
         self.organization_grid.options["rowData"] = org_details
         self.organization_grid.update()
 
@@ -157,9 +239,7 @@ class UIAddAccountDialog:
                     ui.label("Account Name")
                     self.account_name = ui.input(validation={"Friendly name must be provided": lambda value: len(value) > 0})
                     ui.label("Organization")
-                    organizations = Organization.select()
-                    organization_details = {org.id: org.name for org in organizations}
-                    self.organization = ui.select(options=organization_details, validation={"Organization must be selected": lambda value: len(value) > 0})
+                    self.organization = ui.select(options=get_organization_names(), validation={"Organization must be selected": lambda value: len(value) > 0})
                     ui.button("Add", on_click=self.add_new_account)
                     ui.button("Cancel", on_click=self.dialog.close)
 
@@ -178,5 +258,6 @@ class UIAddAccountDialog:
         else:
             name = self.account_name.value.strip()
             Account.create(id=account_id, name=name, organization=organization, email="-", status="Closed")
+            backfill_ledger([account_id])
             ui.notify(f"Account {name} added.")
             self.dialog.close()
\ No newline at end of file
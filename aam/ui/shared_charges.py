@@ -5,10 +5,10 @@ from typing import TYPE_CHECKING, Iterable
 
 import nicegui.events
 from nicegui import ui
-from peewee import JOIN, fn
 
 import aam.utilities
-from aam.models import SharedCharge, Account, AccountJoinSharedCharge, MonthlyUsage
+import aam.ui.widgets
+from aam.models import SharedCharge, Account, AccountJoinSharedCharge, get_account_summaries, allocate_shared_charges
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -121,7 +121,7 @@ class UISharedChargeDialog:
                     ui.label("Name")
                     self.name = ui.input()
                     ui.label("Date")
-                    self.month_year_picker = aam.utilities.MonthYearPicker()
+                    self.month_year_picker = aam.ui.widgets.MonthYearPicker()
                     ui.label("Amount ($)")
                     self.amount = ui.input(validation=lambda value: 'Invalid format' if re.fullmatch(r"\d*.\d*", value) is None else None)
                     ui.label("Accounts")
@@ -145,8 +145,8 @@ class UISharedChargeDialog:
             status.append("SUSPENDED")
         if self.show_closed.value:
             status.append("Closed")
-        accounts = Account.select().where((Account.status.in_(status)) & (Account.organization==selected_org_id))
-        accounts = {account.id: account.name for account in accounts}
+        accounts = {account["id"]: account["name"] for account in get_account_summaries(selected_org_id)
+                    if account["status"] in status}
         self.account_select.set_options(accounts)
 
     def save_shared_charge(self, _: nicegui.events.ClickEventArguments):
@@ -156,17 +156,17 @@ class UISharedChargeDialog:
             return 0
 
         date = datetime.date(self.month_year_picker.year, self.month_year_picker.month, 1)
+        previous_date = date
         amount = decimal.Decimal(self.amount.value)
 
-        affected_accounts: list[str] = []
-
         if not self.shared_charge_id:
             shared_charge = SharedCharge.create(name=self.name.value, amount=amount, date=date)
-            affected_accounts.extend(self.account_select.value)
         else:
 
             # Get existing SharedCharge
             shared_charge: SharedCharge = SharedCharge.get(SharedCharge.id == self.shared_charge_id)
+            # The accounts of the charge's previous month must also be recalculated if the charge has moved.
+            previous_date = shared_charge.date
             shared_charge.name = self.name.value
             shared_charge.amount = amount
             shared_charge.date = date
@@ -178,10 +178,10 @@ class UISharedChargeDialog:
         for account_id in self.account_select.value:
             AccountJoinSharedCharge.create(account=account_id, shared_charge=shared_charge.id)
 
-        calculate_shared_charge_per_account(date)
+        calculate_shared_charge_per_account(previous_date, date)
 
         self.parent.populate_shared_charges_table()
-        self.parent.parent.transactions.update_transaction_grid()
+        self.parent.parent.update_transaction_grid()
         if self.shared_charge_id:
             ui.notify("Shared charge edited.")
         else:
@@ -228,36 +228,13 @@ class UISharedChargeDialog:
         self.dialog.close()
 
 
-def calculate_shared_charge_per_account(date: datetime.date):
-    """Calculate the total of all SharedCharges assigned to an Account in the month given by `date` and assign this
-    value to the Account.shared_charge field."""
-
-    # Get the accounts and the ids of shared charges in the current month
-    accounts: list[dict] = (
-        SharedCharge.select(SharedCharge.id, AccountJoinSharedCharge.account_id)
-        .join(AccountJoinSharedCharge, JOIN.LEFT_OUTER)
-        .where(SharedCharge.date == date).dicts()
-    )
-    # Group by account
-    grouped_accounts = {}
-    for account in accounts:
-        grouped_accounts.setdefault(account["account"], []).append(account["id"])
-    amount_per_account = (
-        SharedCharge.select(
-            (SharedCharge.amount / fn.COUNT(AccountJoinSharedCharge.shared_charge_id)).alias("amount_per_account"),
-            SharedCharge.id)
-        .join(AccountJoinSharedCharge, JOIN.LEFT_OUTER)
-        .where(SharedCharge.date == date)
-        .group_by(SharedCharge.id)
-        .dicts()
-    )
-    # Group by SharedCharge id
-    amount_per_account = {row["id"]: row["amount_per_account"] for row in amount_per_account}
-    month_code = aam.utilities.month_code(date.year, date.month)
-    for account_id in grouped_accounts:
-        total = 0
-        for shared_charge_id in grouped_accounts[account_id]:
-            total += amount_per_account[shared_charge_id]
-        monthly_usage: MonthlyUsage = MonthlyUsage.get((MonthlyUsage.account_id == account_id) & (MonthlyUsage.month_id == month_code))
-        monthly_usage.shared_charge = total
-        monthly_usage.save()
+def calculate_shared_charge_per_account(*dates: datetime.date):
+    """Recalculate the shared charge of every MonthlyUsage from the earliest to the latest month of `dates` (see
+    `aam.models.allocate_shared_charges`), telling the user about any shares which could not be allocated."""
+    month_codes = [aam.utilities.month_code(date.year, date.month) for date in dates]
+    result = allocate_shared_charges(min(month_codes), max(month_codes))
+    account_names = {account["id"]: account["name"] for account in get_account_summaries()}
+    for share in result["unallocated"]:
+        month = aam.utilities.date_from_month_code(share["month_code"]).strftime("%b-%Y")
+        ui.notify(f"No monthly usage for {account_names.get(share['account_id'], share['account_id'])} in {month}, "
+                  f"its shared charge has not been allocated.", type="warning")
@@ -1,12 +1,11 @@
-import datetime
-import decimal
-from typing import TYPE_CHECKING, Iterable
+from typing import TYPE_CHECKING
 
 import nicegui.events
 from nicegui import ui
 
 import aam.utilities
-from aam.models import Account, MonthlyUsage, Month
+import aam.ui.widgets
+from aam.models import get_account_summaries, get_organization_names, get_usage_totals
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
@@ -29,13 +28,51 @@ class UIStatistics:
                     self.show_suspended = ui.switch("Show Suspended", on_change=self.update_account_select_options)
         with ui.row():
             ui.label("Start date")
-            self.start_date = aam.utilities.MonthYearPicker()
+            self.start_date = aam.ui.widgets.MonthYearPicker()
             ui.label("End date")
-            self.end_date = aam.utilities.MonthYearPicker()
-        self.calculate_usage = ui.button("Calculate Usage", on_click=self.calculate_usage)
+            self.end_date = aam.ui.widgets.MonthYearPicker()
+        with ui.row():
+            self.group_by = ui.select(label="Breakdown", value=None,
+                                      options={None: "None", "account": "Per account", "month": "Per month",
+                                               "organization": "Per organization",
+                                               "finance_code": "Per finance code"}).classes("min-w-[200px]")
+            self.calculate_usage = ui.button("Calculate Usage", on_click=self.calculate_usage)
         with ui.row():
             ui.label("Total monthly usage:")
             self.total = ui.label("£0")
+        self.breakdown_grid = ui.aggrid({
+            'theme': 'balham',
+            'defaultColDef': {"suppressMovable": True},
+            'columnDefs': [{"headerName": "Group", "field": "group"},
+                           {"headerName": "Gross Total ($)", "field": "gross_total_dollar",
+                            "valueFormatter": "value.toFixed(2)"},
+                           {"headerName": "Gross Total (£)", "field": "gross_total_pound",
+                            "valueFormatter": "value.toFixed(2)"}],
+            'rowData': [],
+        })
+        self.breakdown_grid.set_visibility(False)
+
+        ui.separator()
+        ui.label("Forecast").classes("text-2xl")
+        ui.label("Forecasts the gross usage of the selected accounts, or of all open accounts if none are selected, "
+                 "from the trend and seasonal pattern of their past usage.")
+        with ui.row():
+            self.forecast_months = ui.number("Months ahead", value=12, min=1, max=60, precision=0)
+            ui.button("Forecast", on_click=self.calculate_forecast)
+        self.forecast_grid = ui.aggrid({
+            'theme': 'balham',
+            'defaultColDef': {"suppressMovable": True},
+            'columnDefs': [{"headerName": "Account", "field": "account_name"},
+                           {"headerName": "Current Balance (£)", "field": "balance",
+                            "valueFormatter": "value.toFixed(2)"},
+                           {"headerName": "Usage This Month (£)", "field": "next_usage",
+                            "valueFormatter": "value.toFixed(2)"},
+                           {"headerName": "Total Forecast Usage (£)", "field": "total_usage",
+                            "valueFormatter": "value.toFixed(2)"},
+                           {"headerName": "Forecast Balance (£)", "field": "final_balance",
+                            "valueFormatter": "value.toFixed(2)"}],
+            'rowData': [],
+        })
 
         self.update_account_select_options()
 
@@ -44,6 +81,7 @@ class UIStatistics:
         # remove the accounts from the value property!
         self.account_select.set_value([])
         self.total.set_text("£0")
+        self.breakdown_grid.set_visibility(False)
 
         valid_status = []
         if self.show_active.value is True:
@@ -53,10 +91,8 @@ class UIStatistics:
         if self.show_suspended.value is True:
             valid_status.append("SUSPENDED")
 
-        accounts = Account.select(Account.name, Account.id, Account.status).where((Account.status.in_(valid_status)))
-        accounts = sorted(list(accounts), key=lambda item: item.name)
-
-        account_items = {account.id: f"{account.name}" for account in accounts}
+        account_items = {account["id"]: account["name"] for account in get_account_summaries()
+                         if account["status"] in valid_status}
         self.account_select.set_options(account_items)
         self.account_select.update()
 
@@ -84,16 +120,45 @@ class UIStatistics:
         end_month_code = self.end_date.month_code
 
         selected_accounts = self.account_select.value
-
-        monthly_usage: Iterable[MonthlyUsage] = (MonthlyUsage.select(MonthlyUsage, Account.id, Month.exchange_rate)
-                                                .join(Account)
-                                                .join_from(MonthlyUsage, Month)
-                                                .where((Account.id.in_(selected_accounts) &
-                                                        (MonthlyUsage.month_id >= start_month_code) &
-                                                        (MonthlyUsage.month_id <= end_month_code))
-                                                       )
-                                                )
-        total = decimal.Decimal(0)
-        for usage in monthly_usage:
-            total += usage.gross_total_pound
+        totals = get_usage_totals(selected_accounts, start_month_code, end_month_code)
+        total = totals[0]["gross_total_pound"] if totals else 0
         self.total.set_text(f"£{total:0,.2f}")
+
+        group_by = self.group_by.value
+        self.breakdown_grid.set_visibility(group_by is not None)
+        if group_by is not None:
+            labels = self.get_group_labels(group_by)
+            self.breakdown_grid.options["rowData"] = [
+                {"group": labels(row["key"]), "gross_total_dollar": float(row["gross_total_dollar"]),
+                 "gross_total_pound": float(row["gross_total_pound"])}
+                for row in get_usage_totals(selected_accounts, start_month_code, end_month_code, group_by)]
+            self.breakdown_grid.update()
+
+    @staticmethod
+    def get_group_labels(group_by: str):
+        """Get a function which converts the key of a usage group to the text shown in the breakdown grid."""
+        if group_by == "account":
+            account_names = {account["id"]: account["name"] for account in get_account_summaries()}
+            return lambda key: f"{account_names.get(key)} ({key})"
+        if group_by == "month":
+            return lambda key: aam.utilities.date_from_month_code(key).strftime("%b-%Y")
+        if group_by == "organization":
+            organization_names = get_organization_names()
+            return lambda key: f"{organization_names.get(key)} ({key})" if key else "No organization"
+        return lambda key: key or "No finance code"
+
+    def calculate_forecast(self, _event: nicegui.events.ClickEventArguments):
+        # numpy is only imported when a forecast is first made.
+        import aam.forecast
+
+        months_ahead = int(self.forecast_months.value or 0)
+        if months_ahead < 1:
+            ui.notify("Must forecast at least one month.")
+            return 0
+
+        result = aam.forecast.forecast(self.account_select.value or None, months_ahead)
+        self.forecast_grid.options["rowData"] = [
+            {"account_name": account["account_name"], "balance": account["balance"],
+             "next_usage": account["usage"][0], "total_usage": sum(account["usage"]),
+             "final_balance": account["balance_forecast"][-1]} for account in result["accounts"]]
+        self.forecast_grid.update()
@@ -4,19 +4,21 @@ import decimal
 from decimal import Decimal
 from typing import TYPE_CHECKING, Iterable, Optional
 
-import jinja2
 import nicegui.events
 from nicegui import ui
-import requests
 
+import aam.email_templates
+import aam.mailer
 import aam.utilities
-from aam import utilities
-from aam.config import CONFIG
-from aam.models import Account, RechargeRequest, Transaction, MonthlyUsage, TRANSACTION_TYPES, Note, Month
+import aam.ui.widgets
+from aam.models import Account, RechargeRequest, Transaction, MonthlyUsage, TRANSACTION_TYPES
 
 if TYPE_CHECKING:
     from aam.ui.main import UIMainForm
 
+# The number of months of an account's ledger shown in the journal when an account is selected.
+DEFAULT_JOURNAL_WINDOW_MONTHS = 12
+
 
 class UITransactions:
     def __init__(self, parent: "UIMainForm"):
@@ -24,7 +26,17 @@ class UITransactions:
 
         self.new_transaction_dialog = UINewSingleTransactionDialog(self)
 
+        # The journal shows a window of the ledger, `window_months` long and ending with the month `window_end`.
+        self.window_months: int | None = DEFAULT_JOURNAL_WINDOW_MONTHS
+        self.window_end: int | None = None
+
         ui.label("Account Transaction Journal").classes("text-4xl")
+        with ui.row().classes("items-center"):
+            self.earlier_button = ui.button(icon="chevron_left", on_click=lambda: self.move_window(-1))
+            self.window_label = ui.label()
+            self.later_button = ui.button(icon="chevron_right", on_click=lambda: self.move_window(1))
+            ui.select({12: "12 months", 24: "24 months", 60: "5 years", None: "All"}, label="Show",
+                      value=self.window_months, on_change=self.window_size_changed).classes("min-w-[120px]")
         self.transaction_grid = ui.aggrid({
             'theme': 'balham',
             'defaultColDef': {"suppressMovable": True, "sortable": False},
@@ -53,7 +65,11 @@ class UITransactions:
             'rowData': {},
             'rowSelection': 'multiple',
             'stopEditingWhenCellsLoseFocus': True,
+            # MonthlyUsage and Transactions have separate ids so rows are identified by type and id.
+            ':getRowId': 'params => params.data.row_id',
         })
+        # The first and last date of the ledger window shown in the grid.
+        self.window_dates: tuple[datetime.date, datetime.date] | None = None
 
         self.transaction_grid.on("cellValueChanged", self.update_transaction)
         with ui.row():
@@ -67,8 +83,41 @@ class UITransactions:
     def initialize(self, account: Account | None):
         """This function is run when an account is selected from the dropdown menu."""
         if account is not None:
+            # Show the most recent part of the ledger.
+            self.window_end = None
             self.update_transaction_grid()
 
+    def move_window(self, steps: int):
+        """Move the window of the ledger shown in the journal earlier or later by `steps` window lengths."""
+        if self.window_end is None or self.window_months is None:
+            return 0
+        self.window_end += steps * self.window_months
+        self.update_transaction_grid()
+
+    def window_size_changed(self, event: nicegui.events.ValueChangeEventArguments):
+        self.window_months = event.value
+        self.update_transaction_grid()
+
+    def get_window(self, account: Account) -> tuple[datetime.date, datetime.date]:
+        """Get the first and last date of the window of the account's ledger to show in the journal, keeping the
+        window within the life of the account."""
+        first_month = aam.utilities.month_code(account.creation_date.year, account.creation_date.month)
+        last_month = aam.utilities.month_code(account.final_date.year, account.final_date.month)
+        if self.window_months is None:
+            self.window_end = last_month
+            return account.creation_date, account.final_date
+
+        if self.window_end is None:
+            self.window_end = last_month
+        # Show a whole window where the account is old enough.
+        self.window_end = min(max(self.window_end, first_month + self.window_months - 1), last_month)
+        window_start = max(self.window_end - self.window_months + 1, first_month)
+
+        start_date = max(aam.utilities.date_from_month_code(window_start), account.creation_date)
+        end_date = aam.utilities.date_from_month_code(self.window_end)
+        end_date = min(end_date.replace(day=calendar.monthrange(end_date.year, end_date.month)[1]), account.final_date)
+        return start_date, end_date
+
     def add_new_transaction(self):
         account_id = self.parent.get_selected_account_id()
         if account_id is None:
@@ -89,14 +138,16 @@ class UITransactions:
 
         transaction_ids = [row["id"] for row in selected_rows]
 
-        transactions = Transaction.select().where(Transaction.id.in_(transaction_ids))
+        transactions = list(Transaction.select().where(Transaction.id.in_(transaction_ids)))
+        if not transactions:
+            return 0
         for transaction in transactions:
             transaction.delete_instance()
-            self.update_transaction_grid()
-            selected_request_row = await(self.ui_recharge_requests.request_grid.get_selected_row())
-            if selected_request_row:
-                self.ui_recharge_requests.populate_request_items_grid(selected_request_row["id"])
-            ui.notify("Transaction deleted.")
+        self.refresh_rows_from(min(transaction.ledger_date for transaction in transactions))
+        selected_request_row = await(self.ui_recharge_requests.request_grid.get_selected_row())
+        if selected_request_row:
+            self.ui_recharge_requests.populate_request_items_grid(selected_request_row["id"])
+        ui.notify(f"{len(transactions)} transactions deleted.")
 
     def update_transaction_grid(self):
         account_id = self.parent.get_selected_account_id()
@@ -104,11 +155,56 @@ class UITransactions:
             row_data = []
         else:
             account: Account = Account.get(Account.id == account_id)
-            row_data = account.get_transaction_details()
+            if account.creation_date:
+                start_date, end_date = self.get_window(account)
+                self.window_dates = (start_date, end_date)
+                row_data = self.add_row_ids(account.get_ledger_window(start_date, end_date))
+                self.window_label.set_text(f"{start_date.strftime('%b %Y')} - {end_date.strftime('%b %Y')}")
+                self.earlier_button.set_enabled(start_date > account.creation_date)
+                self.later_button.set_enabled(end_date < account.final_date)
+            else:
+                row_data = []
 
         self.transaction_grid.options["rowData"] = row_data
         self.transaction_grid.update()
 
+    @staticmethod
+    def add_row_ids(rows: list[dict]) -> list[dict]:
+        for row in rows:
+            row["row_id"] = f"{'usage' if row['type'] == 'Monthly Usage' else 'transaction'}-{row['id']}"
+        return rows
+
+    def refresh_rows_from(self, date: datetime.date):
+        """Update the grid after a change to the ledger on `date`. Only the rows from the start of the month of `date`,
+        whose running totals may have changed, are fetched and sent to the grid as an AG Grid transaction."""
+        account_id = self.parent.get_selected_account_id()
+        if account_id is None or self.window_dates is None:
+            return 0
+        start_date, end_date = self.window_dates
+        if date > end_date:
+            return 0
+        # Monthly usage is in the ledger for the whole of its month, so refresh from the start of the month.
+        date = max(datetime.date(date.year, date.month, 1), start_date)
+
+        account: Account = Account.get(Account.id == account_id)
+        new_rows = self.add_row_ids(account.get_ledger_window(date, end_date))
+
+        old_rows = self.transaction_grid.options["rowData"]
+        unchanged_rows = [row for row in old_rows if str(row["date"]) < date.isoformat()]
+        old_rows = old_rows[len(unchanged_rows):]
+
+        if [row["row_id"] for row in old_rows] == [row["row_id"] for row in new_rows]:
+            # Same rows in the same order, only send the rows whose values changed.
+            changed_rows = [new_row for old_row, new_row in zip(old_rows, new_rows) if old_row != new_row]
+            delta = {"update": changed_rows}
+        else:
+            delta = {"remove": [{"row_id": row["row_id"]} for row in old_rows], "add": new_rows,
+                     "addIndex": len(unchanged_rows)}
+        self.transaction_grid.run_grid_method("applyTransaction", delta)
+        # Keep the options in step with the grid without sending all the rows again.
+        with self.transaction_grid.props.suspend_updates():
+            self.transaction_grid.options["rowData"] = unchanged_rows + new_rows
+
     def update_transaction(self, event: nicegui.events.GenericEventArguments):
         """Called when the value of a cell in the transaction grid is changed."""
         if not self._validate_cell_change(event):
@@ -123,8 +219,10 @@ class UITransactions:
         else:
             transaction: Transaction = Transaction.get(id=transaction_id)
 
+        changed_date = transaction.ledger_date
         if cell_edited == "date":
             transaction.date = event.args["data"]["date"]
+            changed_date = min(changed_date, transaction.ledger_date)
         elif cell_edited == "type":
             transaction.type = TRANSACTION_TYPES.index(event.args["data"]["type"])
         elif cell_edited == "amount":
@@ -148,7 +246,7 @@ class UITransactions:
         else:
             raise TypeError(f"No method to edit '{cell_edited}' column type.")
         transaction.save()
-        self.update_transaction_grid()
+        self.refresh_rows_from(changed_date)
         ui.notify(f"Transaction {cell_edited} updated.")
 
     def _validate_cell_change(self, event: nicegui.events.GenericEventArguments) -> bool:
@@ -250,6 +348,7 @@ class UIRechargeRequests:
             self.email_body = ui.textarea().classes("w-full").props("input-class=h-96")
             with ui.row():
                 self.send_email_button = ui.button("Send email", on_click=self.send_email)
+                self.send_all_emails_button = ui.button("Send all emails for request", on_click=self.send_all_emails)
                 self.email_spinner = ui.spinner(size='lg')
 
         self.request_grid.on('rowSelected', self.request_selected)
@@ -259,6 +358,12 @@ class UIRechargeRequests:
         self.request_items_grid.on("cellDoubleClicked", self.request_item_cell_double_clicked)
         self.email_spinner.visible = False
 
+        with ui.dialog() as self.send_all_dialog, ui.card():
+            self.send_all_label = ui.label()
+            with ui.row():
+                ui.button("Send", on_click=lambda: self.send_all_dialog.submit(True))
+                ui.button("Cancel", on_click=lambda: self.send_all_dialog.submit(False))
+
     async def get_selected_recharge_id(self) -> Optional[str]:
         """Get the ID of the selected RechargeRequest."""
         selected_row = await(self.request_grid.get_selected_row())
@@ -351,60 +456,65 @@ class UIRechargeRequests:
             export_string += f"{row['account_name']}, {row['finance_code']}, {row['task_code']}, {round(row['end_balance'], 2)}\n"
         return export_string
 
-    @staticmethod
-    def generate_recharge_email(transactions: list[Transaction | MonthlyUsage], recharge_request: RechargeRequest) -> str:
-        """Use Jinja to generate the body of the email to send to the customer from a template."""
-        account = transactions[0].account
-        if account.budget_holder is None:
-            ui.notify(f'Error for account "{account.name}" - no budget holder recorded.')
-            return ""
-        data = {"first_name": account.budget_holder.first_name,
-                "account_name": account.name,
-                "account_id": account.id,
-                "recharge_reference": recharge_request.reference,
-                "start_balance": account.get_balance(recharge_request.start_date, inclusive=False),
-                "transactions": [],
-                "end_balance": account.get_balance(recharge_request.end_date),
-                "finance_code": account.finance_code,
-                "task_code": account.task_code,
-                "recharge_start_date": recharge_request.start_date,
-                "recharge_end_date": recharge_request.end_date,
-                "recharge_date": (datetime.date.today() + datetime.timedelta(days=14)).strftime("%d/%m/%y")}
-        for transaction in transactions:
-            data["transactions"].append({"date": transaction.date, "type": TRANSACTION_TYPES[transaction.type],
-                                         "amount": transaction.gross_total_pound, "note": transaction.note})
-            data["transactions"].sort(key=lambda t: t["date"])
-        env = jinja2.Environment(loader=jinja2.FileSystemLoader(CONFIG["email"]["template_location"]), undefined=jinja2.StrictUndefined)
-        template = env.get_template("email_base.jinja")
-        return template.render(data=data)
-
     async def send_email(self):
-        """Email a customer and add a Note to the Account with the content of the email."""
-        self.email_spinner.visible = True
+        """Email a customer. A Note is added to the Account with the content of the email once it is sent."""
         account_id = await(self.get_selected_request_item_account())
-        to = self.email_to.value
-        cc = self.email_cc.value
-        subject = self.email_subject.value
-        body: str = self.email_body.value
-        html_body = body.replace("\n", "<br>")
-        payload = {"to": to, "cc": cc, "subject": subject, "body": html_body}
-        response = requests.post(CONFIG["email"]["send_url"], json=payload)
-        note_text = f"to: {to}\ncc:{cc}\nsubject: {subject}\n\n{body}"
-        Note.create(date=datetime.date.today(), text=note_text, type="Sent email", account=account_id)
+        if account_id is None:
+            ui.notify("No request item selected.")
+            return 0
+        self.email_spinner.visible = True
+        email = {"account_id": account_id, "to": self.email_to.value, "cc": self.email_cc.value,
+                 "subject": self.email_subject.value, "body": self.email_body.value}
+        result = await aam.mailer.get_email_queue().put(email)
         self.email_spinner.visible = False
-        ui.notify(f"Email request response status code: {response.status_code}")
+        if result["sent"]:
+            ui.notify(f"Email sent to {result['to']}.")
+        else:
+            ui.notify(f"Email to {result['to']} failed after {result['attempts']} attempts - {result['error']}")
+
+    async def send_all_emails(self):
+        """Render the recharge email for every account in the selected RechargeRequest and send them all."""
+        recharge_id = await(self.get_selected_recharge_id())
+        if recharge_id is None:
+            ui.notify("No recharge request selected.")
+            return 0
+        recharge_request: RechargeRequest = RechargeRequest.get(recharge_id)
+
+        emails = []
+        for email in aam.email_templates.render_recharge_emails(recharge_request):
+            if email["error"]:
+                ui.notify(email["error"])
+            else:
+                emails.append(email)
+        if not emails:
+            ui.notify("No emails to send.")
+            return 0
+
+        self.send_all_label.set_text(f"Send {len(emails)} emails for recharge request {recharge_request.reference}?")
+        if not await self.send_all_dialog:
+            return 0
+
+        self.email_spinner.visible = True
+        results = await aam.mailer.get_email_queue().send_all(emails)
+        self.email_spinner.visible = False
+        failed = [result for result in results if not result["sent"]]
+        ui.notify(f"{len(results) - len(failed)} emails sent, {len(failed)} failed.")
+        for result in failed:
+            ui.notify(f"Email to {result['to']} failed after {result['attempts']} attempts - {result['error']}")
 
     async def request_item_cell_clicked(self, event: nicegui.events.GenericEventArguments):
         account_id = event.args["data"]["account_id"]
         recharge_id = await(self.get_selected_recharge_id())
         recharge_request: RechargeRequest = RechargeRequest.get(recharge_id)
-        transactions = recharge_request.get_transactions(account_id)
-        email_body = self.generate_recharge_email(transactions, recharge_request)
+        email = aam.email_templates.render_recharge_emails(recharge_request, [account_id])[0]
+        if email["error"]:
+            ui.notify(email["error"])
+            return 0
 
-        self.email_to.set_value(transactions[0].account.budget_holder.email)
-        self.email_cc.set_value("")
-        self.email_subject.set_value(f"Research IT AWS account recharge - {transactions[0].account.name}")
-        self.email_body.set_value(email_body)
+        self.email_to.set_value(email["to"])
+        self.email_cc.set_value(email["cc"])
+        self.email_subject.set_value(email["subject"])
+        self.email_body.set_value(email["body"])
 
 
     def request_item_cell_double_clicked(self, event: nicegui.events.GenericEventArguments):
@@ -417,33 +527,7 @@ class UIRechargeRequests:
             accounts = []
         else:
             request = RechargeRequest.get(RechargeRequest.id == request_id)
-
-            transactions: Iterable[Transaction] = (Transaction.select(Transaction, Account)
-                                                   .join(Account)
-                                                   .where(Transaction.recharge_request == request_id))
-            monthly_usage: Iterable[MonthlyUsage] = (MonthlyUsage.select(MonthlyUsage, Account)
-                                             .join(Account)
-                                             .where(MonthlyUsage.recharge_request == request_id))
-
-            # For the properties exposed in the grid we can treat Transactions and MonthlyUsage as the same type of object.
-            items = list(transactions)
-            items.extend(list(monthly_usage))
-
-            accounts = {}
-
-            for item in items:
-                account_id = item.account.id
-                if account_id not in accounts:
-                    start_balance = item.account.get_balance(request.start_date, inclusive=False)
-                    end_balance = item.account.get_balance(request.end_date, inclusive=False)
-                    accounts[account_id] = {"account_name": item.account.name, "account_id": account_id,
-                                            "transaction_total": 0, "num_transactions": 0,
-                                            "start_balance": start_balance, "end_balance": end_balance}
-                accounts[account_id]["transaction_total"] += item.gross_total_pound
-                accounts[account_id]["num_transactions"] += 1
-
-            # Unpack dict to list to display in grid
-            accounts = [value for value in accounts.values()]
+            accounts = [summary.to_json() for summary in request.get_summaries()]
 
         self.request_items_grid.options["rowData"] = accounts
         self.request_items_grid.update()
@@ -458,7 +542,7 @@ class UINewSingleTransactionDialog:
                 ui.label("New transaction").classes("text-2xl")
                 with ui.grid(columns="auto auto"):
                     ui.label("Date")
-                    self.date_input = utilities.date_picker()
+                    self.date_input = aam.ui.widgets.date_picker()
                     ui.label("Type")
                     self.type = ui.select(options=TRANSACTION_TYPES).classes("q-field--dense")
                     ui.label("Currency")
@@ -503,7 +587,7 @@ class UINewSingleTransactionDialog:
 
         Transaction.create(account=self.selected_account_id, date=date, type=TRANSACTION_TYPES.index(self.type.value),
                            amount=amount, is_pound=is_pound, exchange_rate=exchange_rate)
-        self.parent.update_transaction_grid()
+        self.parent.refresh_rows_from(date)
         ui.notify("New transaction added.")
         self.dialog.close()
 
@@ -520,19 +604,20 @@ class UINewRechargeDialog:
 
     def __init__(self, parent: UIRechargeRequests):
         self.parent = parent
+        self.conflicts_dialog = UIRechargeConflictsDialog()
         with ui.dialog() as self.dialog:
             with ui.card():
                 ui.label("New recharge request").classes("text-2xl")
                 with ui.grid(columns="auto auto"):
                     ui.label("Date")
-                    self.date_input = utilities.date_picker(datetime.date.today())
+                    self.date_input = aam.ui.widgets.date_picker(datetime.date.today())
                     ui.label("Reference")
                     self.reference_input = ui.input(validation={"Must provide reference": lambda value: len(value) > 1})
                 with ui.grid(columns="auto auto"):
                     ui.label("Start date")
-                    self.start_date = aam.utilities.MonthYearPicker()
+                    self.start_date = aam.ui.widgets.MonthYearPicker()
                     ui.label("End date")
-                    self.end_date = aam.utilities.MonthYearPicker()
+                    self.end_date = aam.ui.widgets.MonthYearPicker()
                 with ui.row(align_items="stretch").classes('w-full'):
                     ui.button("Add", on_click=self.new_recharge_request)
                     ui.button("Cancel", on_click=self.dialog.close)
@@ -545,57 +630,52 @@ class UINewRechargeDialog:
 
     def new_recharge_request(self, _event: nicegui.events.ClickEventArguments):
         """Get the information the user has input to the Dialog and use it to create a new RechargeRequest."""
-        start_date = datetime.date(self.start_date.year, self.start_date.month, 1)
-        end_date = datetime.date(self.end_date.year, self.end_date.month, calendar.monthrange(self.end_date.year, self.end_date.month)[1])
-
-        if end_date < start_date:
-            ui.notify("End month must be after start month.")
+        if self.start_date.month_code is None or self.end_date.month_code is None:
+            ui.notify("Must select start and end month.")
             return 0
-
-        months: list[Month] = Month.select().where((Month.month_code >= self.start_date.month_code) & (Month.month_code <= self.end_date.month_code))
-        for month in months:
-            if month.exchange_rate == 1:
-                ui.notify(f"Exchange rate is 1 for month {utilities.date_from_month_code(month.month_code).strftime('%b-%Y')}. Must set exchange rate before creating recharge request.")
-                return 0
-
-        if self.reference_input.value != "":
-            recharge_request = RechargeRequest.create(start_date=start_date, end_date=end_date,
-                                                      reference=self.reference_input.value, status="Draft")
-        else:
-            ui.notify("Must provide a reference")
+        try:
+            recharge_request, result = RechargeRequest.create_for_months(self.start_date.month_code,
+                                                                         self.end_date.month_code,
+                                                                         self.reference_input.value)
+        except ValueError as e:
+            ui.notify(str(e))
             return 0
 
-
-        self.add_transactions_to_request(start_date, end_date, recharge_request)
-
-        ui.notify("New recharge request added")
+        ui.notify(f"New recharge request added with {result['transactions']} transactions and "
+                  f"{result['monthly_usage']} months of usage.")
         self.parent.parent.ui_recharge_requests.populate_request_grid()
         self.close()
+        if result["conflicts"]:
+            self.conflicts_dialog.open(result["conflicts"])
 
-    @staticmethod
-    def add_transactions_to_request(start_date: datetime.date, end_date: datetime.date,
-                                    recharge_request: RechargeRequest):
-        """Find any Transaction or MonthlyUsage between `start_date` and the `end_date` and add them to the
-        recharge request."""
-
-        transactions: Iterable[Transaction] = (Transaction.select(Transaction, Account)
-                                               .join(Account)
-                                               .where((Account.is_recharged == True) & (Transaction.date >= start_date) & (Transaction.date < end_date)))
-        for transaction in transactions:
-            if not transaction.recharge_request:
-                transaction.recharge_request = recharge_request.id
-                transaction.save()
-            else:
-                ui.notify(
-                    f"Transaction for account: {transaction.account.name}, date: {transaction.date} is already assigned to another recharge.")
-
-        usage = (MonthlyUsage.select(MonthlyUsage, Account)
-                 .join(Account)
-                 .where((Account.is_recharged == True) & (MonthlyUsage.date >= start_date) & (MonthlyUsage.date <= end_date)))
-        for month_usage in usage:
-            if not month_usage.recharge_request:
-                month_usage.recharge_request = recharge_request.id
-                month_usage.save()
-            else:
-                ui.notify(
-                    f"MonthlyUsage for account: {month_usage.account.name}, date: {month_usage.date} is already assigned to another recharge.")
+
+class UIRechargeConflictsDialog:
+    """Dialog box listing the items which could not be added to a new RechargeRequest because they are already part of
+    another RechargeRequest."""
+
+    def __init__(self):
+        with ui.dialog() as self.dialog:
+            with ui.card().classes("min-w-[800px]"):
+                ui.label("Items already assigned to another recharge request").classes("text-2xl")
+                self.summary = ui.label("")
+                self.conflicts_grid = ui.aggrid({
+                    'theme': 'balham',
+                    'defaultColDef': {"suppressMovable": True},
+                    'columnDefs': [{"headerName": "id", "field": "id", "hide": True},
+                                   {"headerName": "Type", "field": "item_type", "filter": True},
+                                   {"headerName": "Account", "field": "account_name", "sort": "asc", "filter": True},
+                                   {"headerName": "Date", "field": "date"},
+                                   {"headerName": "Recharge Request", "field": "recharge_reference", "filter": True}],
+                    'rowData': {},
+                })
+                ui.button("Close", on_click=self.dialog.close)
+
+    def open(self, conflicts: list[dict]):
+        num_transactions = sum(conflict["item_type"] == "Transaction" for conflict in conflicts)
+        num_usage = len(conflicts) - num_transactions
+        num_accounts = len({conflict["account_name"] for conflict in conflicts})
+        self.summary.set_text(f"{num_transactions} transactions and {num_usage} months of usage across {num_accounts} "
+                              f"accounts were not added.")
+        self.conflicts_grid.options["rowData"] = conflicts
+        self.conflicts_grid.update()
+        self.dialog.open()
@@ -0,0 +1,92 @@
+"""Compare read and write throughput of concurrent threads with the original database settings and with the
+settings from aam.database.
+
+Run from the repository root with: python -m benchmarks.sqlite_concurrency
+"""
+import argparse
+import pathlib
+import random
+import tempfile
+import threading
+import time
+
+import peewee
+
+import aam.database
+
+
+class Entry(peewee.Model):
+    account = peewee.CharField(index=True)
+    amount = peewee.DecimalField()
+
+
+def run(database: peewee.SqliteDatabase, readers: int, writers: int, duration: float) -> dict:
+    """Run reader and writer threads against the database for `duration` seconds, counting completed operations
+    and lock errors."""
+    Entry.bind(database)
+    database.create_tables([Entry])
+    with database.atomic():
+        Entry.insert_many([{"account": f"{i % 100:012}", "amount": random.random()} for i in range(20000)]).execute()
+
+    counts = {"reads": 0, "writes": 0, "lock_errors": 0, "max_latency": 0.0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def work(write: bool):
+        with database.connection_context():
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                try:
+                    if write:
+                        with database.atomic():
+                            Entry.insert_many([{"account": f"{random.randrange(100):012}", "amount": random.random()}
+                                               for _ in range(50)]).execute()
+                    else:
+                        (Entry.select(Entry.account, peewee.fn.SUM(Entry.amount))
+                         .where(Entry.account == f"{random.randrange(100):012}")
+                         .group_by(Entry.account).tuples().execute())
+                except peewee.OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+                    with lock:
+                        counts["lock_errors"] += 1
+                    continue
+                latency = time.perf_counter() - start
+                with lock:
+                    counts["writes" if write else "reads"] += 1
+                    counts["max_latency"] = max(counts["max_latency"], latency)
+
+    threads = ([threading.Thread(target=work, args=(False,)) for _ in range(readers)]
+               + [threading.Thread(target=work, args=(True,)) for _ in range(writers)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    database.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--busy-timeout", type=float, default=5,
+                        help="Seconds a connection waits for a lock in the original configuration (peewee's default).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configurations = {
+            "original": peewee.SqliteDatabase(pathlib.Path(directory) / "original.db", pragmas={"foreign_keys": 1},
+                                              timeout=args.busy_timeout),
+            "configured": aam.database.create_database(str(pathlib.Path(directory) / "configured.db")),
+        }
+        for name, database in configurations.items():
+            counts = run(database, args.readers, args.writers, args.duration)
+            print(f"{name:>10}: {counts['reads'] / args.duration:8.0f} reads/s, "
+                  f"{counts['writes'] / args.duration:6.0f} writes/s, {counts['lock_errors']} lock errors, "
+                  f"max latency {counts['max_latency'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measure how long it takes to import aam.models and how long the application takes to serve its first page.
+
+Run from a directory containing a config.yaml, e.g.: python -m benchmarks.startup --repeat 5
+The repository root must be importable, e.g. by setting PYTHONPATH.
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import aam.models; print(time.perf_counter() - start)"
+
+
+def measure_import(repeat: int) -> list[float]:
+    """Import aam.models in a new interpreter `repeat` times, returning the import time of each."""
+    return [float(subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True,
+                                 text=True).stdout) for _ in range(repeat)]
+
+
+def measure_first_page(url: str, timeout: float) -> float:
+    """Start the application and return the number of seconds until `url` returns a successful response."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "aam.main"], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        raise TimeoutError(f"No response from {url} after {timeout} seconds.")
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    import_times = measure_import(args.repeat)
+    print(f"import aam.models: median {statistics.median(import_times) * 1000:.0f} ms over {args.repeat} runs")
+    page_times = [measure_first_page(args.url, args.timeout) for _ in range(args.repeat)]
+    print(f"time to first page: median {statistics.median(page_times):.2f} s over {args.repeat} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import datetime
+
+import pytest
+
+import aam.utilities
+from aam import models
+from aam.config import CONFIG
+
+
+@pytest.fixture
+def account(tmp_path):
+    """An account created in January 2024 with usage in January and February and a transaction in each month."""
+    config_location = tmp_path / "config.yaml"
+    config_location.write_text("db_location: unused\n")
+    CONFIG.load(config_location)
+    models.init_database(str(tmp_path / "data.db"))
+
+    account = models.Account.create(id="111111111111", name="Account", email="a@example.com", status="ACTIVE",
+                                    creation_date=datetime.date(2024, 1, 1))
+    for month in (1, 2):
+        month_code = aam.utilities.month_code(2024, month)
+        models.Month.create(month_code=month_code, exchange_rate=0.8)
+        models.MonthlyUsage.create(account=account, date=datetime.date(2024, month, 1), amount=10 * month,
+                                   month=month_code)
+        models.Transaction.create(account=account, type=models.TRANSACTION_TYPES.index("Pre-pay"),
+                                  date=datetime.date(2024, month, 10), amount=5, is_pound=True)
+    yield account
+    models.db.close()
+
+
+def test_ledger_window_starting_mid_month_matches_whole_ledger(account):
+    end_date = datetime.date(2024, 2, 29)
+    whole_ledger = {(row["type"], row["id"]): row["running_total"]
+                    for row in account.get_transaction_details(account.creation_date, end_date)}
+
+    window = account.get_ledger_window(datetime.date(2024, 2, 15), end_date)
+
+    assert {row["date"].month for row in window} == {2}
+    for row in window:
+        assert float(row["running_total"]) == pytest.approx(float(whole_ledger[row["type"], row["id"]]))
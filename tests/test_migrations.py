@@ -0,0 +1,107 @@
+import datetime
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+import aam.utilities
+from aam import migrations, models
+from aam.config import CONFIG
+
+# The tables used by MonthlyUsage as they were created before migrations were versioned. The unique (account, month)
+# index did not exist so an account can have more than one MonthlyUsage in a month.
+BASELINE_SCHEMA = """
+CREATE TABLE "organization" ("id" VARCHAR(255) NOT NULL PRIMARY KEY, "name" VARCHAR(255));
+CREATE TABLE "person" ("id" INTEGER NOT NULL PRIMARY KEY, "first_name" VARCHAR(255) NOT NULL,
+    "last_name" VARCHAR(255) NOT NULL, "email" VARCHAR(255) NOT NULL);
+CREATE TABLE "account" ("id" VARCHAR(255) NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL,
+    "organization_id" VARCHAR(255), "email" VARCHAR(255) NOT NULL, "status" VARCHAR(255) NOT NULL,
+    "budget_holder_id" INTEGER, "finance_code" VARCHAR(255), "task_code" VARCHAR(255), "creation_date" DATE,
+    "closure_date" DATE, "is_recharged" INTEGER NOT NULL,
+    FOREIGN KEY ("organization_id") REFERENCES "organization" ("id"),
+    FOREIGN KEY ("budget_holder_id") REFERENCES "person" ("id"));
+CREATE TABLE "month" ("month_code" INTEGER NOT NULL PRIMARY KEY, "exchange_rate" DECIMAL(10, 5) NOT NULL);
+CREATE TABLE "rechargerequest" ("id" INTEGER NOT NULL PRIMARY KEY, "start_date" DATE NOT NULL,
+    "end_date" DATE NOT NULL, "reference" VARCHAR(255) NOT NULL, "status" VARCHAR(255) NOT NULL);
+CREATE TABLE "monthlyusage" ("id" INTEGER NOT NULL PRIMARY KEY, "account_id" VARCHAR(255) NOT NULL,
+    "date" DATE NOT NULL, "amount" DECIMAL(10, 5), "month_id" INTEGER NOT NULL, "shared_charge" DECIMAL(10, 5) NOT NULL,
+    "recharge_request_id" INTEGER, "note" VARCHAR(255), FOREIGN KEY ("account_id") REFERENCES "account" ("id"),
+    FOREIGN KEY ("month_id") REFERENCES "month" ("month_code"),
+    FOREIGN KEY ("recharge_request_id") REFERENCES "rechargerequest" ("id"));
+CREATE INDEX "monthlyusage_account_id" ON "monthlyusage" ("account_id");
+CREATE INDEX "monthlyusage_month_id" ON "monthlyusage" ("month_id");
+"""
+
+ACCOUNT_ID = "111111111111"
+MONTH_CODE = aam.utilities.month_code(2023, 1)
+
+
+@pytest.fixture
+def baseline_database(tmp_path):
+    """Create a database with the baseline schema, containing the given MonthlyUsage of one account in one month."""
+    config_location = tmp_path / "config.yaml"
+    config_location.write_text("db_location: unused\n")
+    CONFIG.load(config_location)
+    location = tmp_path / "data.db"
+
+    def create(usage: list[tuple]) -> str:
+        """:param usage: The (amount, recharge request id, note) of each MonthlyUsage."""
+        connection = sqlite3.connect(location)
+        connection.executescript(BASELINE_SCHEMA)
+        connection.execute("INSERT INTO organization VALUES ('o-1', 'Org')")
+        connection.execute("INSERT INTO account VALUES (?, 'Account', 'o-1', 'a@example.com', 'ACTIVE', NULL, NULL, "
+                           "NULL, '2023-01-01', NULL, 0)", [ACCOUNT_ID])
+        connection.execute("INSERT INTO month VALUES (?, 0.8)", [MONTH_CODE])
+        connection.execute("INSERT INTO rechargerequest VALUES (1, '2023-01-01', '2023-01-31', 'R1', 'Draft')")
+        connection.executemany("INSERT INTO monthlyusage (account_id, date, amount, month_id, shared_charge, "
+                               "recharge_request_id, note) VALUES (?, '2023-01-01', ?, ?, 0, ?, ?)",
+                               [(ACCOUNT_ID, amount, MONTH_CODE, recharge_request_id, note)
+                                for amount, recharge_request_id, note in usage])
+        connection.commit()
+        connection.close()
+        return str(location)
+
+    yield create
+    models.db.close()
+
+
+def get_usage() -> list[tuple]:
+    return list(models.MonthlyUsage
+                .select(models.MonthlyUsage.amount, models.MonthlyUsage.recharge_request, models.MonthlyUsage.note)
+                .order_by(models.MonthlyUsage.id)
+                .tuples())
+
+
+def test_upgrade_removes_exact_and_empty_duplicate_usage(baseline_database):
+    models.init_database(baseline_database([(10, 1, None), (None, None, None), (10, 1, "Checked")]))
+
+    assert migrations.get_schema_version() == len(migrations.MIGRATIONS)
+    assert get_usage() == [(10, 1, "Checked")]
+    # 10 dollars of usage with 20% VAT at an exchange rate of 0.8. Support was not charged until 2024.
+    assert models.get_balances([ACCOUNT_ID], datetime.date(2023, 2, 1))[ACCOUNT_ID] == pytest.approx(Decimal("9.6"))
+
+
+def test_upgrade_calculates_charges_with_default_rules(baseline_database):
+    models.init_database(baseline_database([(10, None, None)]))
+    usage_type = models.TRANSACTION_TYPES.index("Monthly Usage")
+
+    assert models.get_charge_rate("VAT", usage_type, datetime.date(2025, 1, 1)) == Decimal("0.2")
+    assert models.get_charge_rate("Support", usage_type, datetime.date(2025, 1, 1)) == Decimal("0.1")
+    # The rollup is filled by migration 5, which must use the default rules added by migration 1.
+    rollup = models.MonthlyUsageRollup.get()
+    assert float(rollup.gross_total_dollar) == pytest.approx(12)
+    assert float(rollup.gross_total_pound) == pytest.approx(9.6)
+
+
+@pytest.mark.parametrize("usage", [[(10, None, None), (20, None, None)], [(10, 1, None), (10, None, None)]])
+def test_upgrade_stops_on_conflicting_duplicate_usage(baseline_database, usage):
+    location = baseline_database(usage)
+
+    with pytest.raises(models.DuplicateMonthlyUsageError) as error:
+        models.init_database(location)
+
+    assert error.value.duplicates == [(ACCOUNT_ID, MONTH_CODE)]
+    assert f"{ACCOUNT_ID} 2023-01" in str(error.value)
+    # The migration is rolled back so no usage is lost and it runs again on the next start.
+    assert migrations.get_schema_version() == 1
+    assert len(get_usage()) == 2